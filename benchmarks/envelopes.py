@@ -0,0 +1,73 @@
+"""
+Compare zeep request serialization with the pre-rendered envelopes of parameterless operations.
+
+    python -m benchmarks.envelopes [iterations]
+
+Only the local wsdl files are needed, no camera is contacted.
+"""
+
+import sys
+import timeit
+from functools import partial
+
+from zeep import AsyncClient
+from zeep.proxy import AsyncServiceProxy
+from zeep.wsdl.utils import etree_to_string
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClient, OnvifClientServiceError, OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_client_media import OnvifClientMedia
+from src.onvif.onvif_client_media_2 import OnvifClientMedia2
+from src.onvif.onvif_envelopes import render_envelope
+
+OPERATIONS: list[tuple[type[OnvifClient], str]] = [
+    (OnvifClientDevice, "GetDeviceInformation"),
+    (OnvifClientDevice, "GetSystemDateAndTime"),
+    (OnvifClientMedia, "GetAudioOutputs"),
+    (OnvifClientMedia, "GetProfiles"),
+    (OnvifClientMedia2, "GetVideoEncoderConfigurations"),
+]
+
+
+def zeep_path(client: AsyncClient, service: AsyncServiceProxy, operation: str) -> None:
+    envelope, _ = service._binding._create(  # pylint: disable=protected-access
+        operation, (), {}, client=client, options=service._binding_options  # pylint: disable=W0212
+    )
+    etree_to_string(envelope)
+
+
+def prerendered_path(
+    client: AsyncClient, service: AsyncServiceProxy, wsdl_path: str, operation: str
+) -> None:
+    envelope, _ = render_envelope(client, service, wsdl_path, operation)
+    etree_to_string(envelope)
+
+
+def main(iterations: int) -> None:
+    settings = OnvifClientSettings(
+        source=Source.parse_obj(
+            {"host": "127.0.0.1", "port": 80, "user": "admin", "password": "password"}
+        ),
+        common=ONVIFSettings(metadata_store_enabled=False),
+    )
+    print(f"{'operation':<32}{'zeep us':>10}{'prerendered us':>16}{'speedup':>9}")
+    for client_type, operation in OPERATIONS:
+        client = client_type(settings)
+        if not isinstance(service := client.service, AsyncServiceProxy):
+            raise OnvifClientServiceError(f"{client_type.__name__} has no service")
+        wsdl_path = client._get_wsdl_path()  # pylint: disable=protected-access
+        # Bound now, a closure would see the variables of the last operation
+        zeep_call = partial(zeep_path, client.client, service, operation)
+        prerendered_call = partial(prerendered_path, client.client, service, wsdl_path, operation)
+        zeep_time = timeit.timeit(zeep_call, number=iterations) / iterations * 1e6
+        prerendered_time = timeit.timeit(prerendered_call, number=iterations) / iterations * 1e6
+        print(
+            f"{operation:<32}{zeep_time:>10.1f}{prerendered_time:>16.1f}"
+            f"{zeep_time / prerendered_time:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,21 +1,102 @@
 import os
+import json
+import asyncio
 import logging
+from contextlib import aclosing
+from dataclasses import asdict
 from functools import wraps
+from typing import Any, AsyncGenerator, AsyncIterator
 
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
 
+from src.middleware import (
+    AdmissionControlMiddleware,
+    AffinityMiddleware,
+    DisconnectCancellationMiddleware,
+    RequestDeadlineMiddleware,
+)
 from src.model.source import Source
-from src.config import ONVIFSettings
+from src.model.media import (
+    ProfileRequest,
+    ProfileField,
+    ConfigurationRequest,
+    SnapshotRequest,
+    StreamUrisRequest,
+    Media2StreamUrisRequest,
+    Media2ProfilesRequest,
+    ConfigChangesRequest,
+    VideoEncoderPushRequest,
+)
+from src.model.inventory import InventoryQuery
+from src.model.replay import ReplayUriRequest, ReplayUrisRequest, EventSearchRequest
+from src.model.ptz import (
+    PTZProfileRequest,
+    PTZVelocity,
+    ContinuousMoveRequest,
+    AbsoluteMoveRequest,
+    StopRequest,
+    GotoPresetRequest,
+    SetPresetRequest,
+    RemovePresetRequest,
+)
+from src.config import CommonSettings, ONVIFSettings
 from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_events import event_watchers
 from src.onvif.onvif_client_device import (
     OnvifClientDevice,
     DeviceInformation,
+    Services,
     SystemDateTime,
     SystemUris,
 )
-from src.onvif.onvif_client_media import OnvifClientMedia, AudioOutputs, MediaProfiles
-from src.onvif.onvif_client_media_2 import OnvifClientMedia2, GetVideoEncoderConfigurationsResponse
-from src.onvif.onvif_client_replay import OnvifClientReplay
+from src.onvif.onvif_client_media import (
+    OnvifClientMedia,
+    MediaProfile,
+    VideoSourceConfiguration,
+    VideoEncoderConfiguration,
+    MetadataConfiguration,
+    AudioOutputs,
+    MediaProfiles,
+    MediaUri,
+    CameraStreamUris,
+    get_fleet_stream_uris,
+)
+from src.onvif.onvif_client_media_2 import (
+    OnvifClientMedia2,
+    GetVideoEncoderConfigurationsResponse,
+    MediaProfiles as Media2Profiles,
+    get_fleet_stream_uris as get_fleet_stream_uris_2,
+)
+from src.onvif.onvif_config_snapshot import (
+    ConfigChanges,
+    config_snapshots,
+    get_fleet_config_changes,
+)
+from src.onvif.onvif_encoder_options import VideoEncoderSettings
+from src.onvif.onvif_encoder_push import push_fleet_encoders
+from src.onvif.onvif_client_replay import OnvifClientReplay, ReplayUri, ReplayUris
+from src.onvif.onvif_client_search import OnvifClientSearch, RecordingIndex
+from src.onvif.onvif_client_ptz import (
+    PTZVector,
+    PTZStatus,
+    PTZPreset,
+    PTZPresets,
+    PTZCommandResult,
+    PTZCommandQueue,
+    ptz_queues,
+)
+from src.onvif.onvif_client_imaging import OnvifClientImaging, CameraImaging, get_fleet_imaging
+from src.onvif.onvif_discovery import probe
+from src.onvif.onvif_registry import RegisteredCamera, camera_registry
+from src.onvif.onvif_deadline import deadline_scope
+from src.onvif.onvif_metrics import metrics
+from src.onvif.onvif_affinity import AffinityNodes, CameraOwner, camera_affinity
+from src.onvif.onvif_metadata_store import CameraMetadata, metadata_store
+from src.onvif.onvif_health import CameraHealth, camera_health
+from src.onvif.onvif_health_scheduler import health_scheduler
+from src.onvif.onvif_offload import offload_pool
+from src.onvif.onvif_snapshot import snapshot_proxy
 
 
 logging.basicConfig(
@@ -24,22 +105,64 @@ logging.basicConfig(
 )
 
 app = FastAPI()
+# Middlewares added last run first: the deadline applies to the queueing time as well,
+# requests waiting for admission or their owner are cancelled when their client disconnects
+# and forwarded requests take an admission slot of the owner only
+app.add_middleware(AdmissionControlMiddleware, settings=ONVIFSettings())
+app.add_middleware(AffinityMiddleware)
+app.add_middleware(DisconnectCancellationMiddleware)
+app.add_middleware(RequestDeadlineMiddleware)
 device_router = APIRouter()
 media_router = APIRouter()
 media2_router = APIRouter()
 replay_router = APIRouter()
+search_router = APIRouter()
+ptz_router = APIRouter()
+imaging_router = APIRouter()
+metrics_router = APIRouter()
+discovery_router = APIRouter()
+health_router = APIRouter()
+inventory_router = APIRouter()
+affinity_router = APIRouter()
+
+
+def _get_source_deadline(kwargs: dict[str, Any]) -> float | None:
+    """Deadline field of the Source of the request, directly or inside the request model"""
+    for value in kwargs.values():
+        source = value if isinstance(value, Source) else getattr(value, "source", None)
+        if isinstance(source, Source) and source.deadline:
+            return source.deadline
+    return None
 
 
 def conflict_exception_decorator(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
+        with deadline_scope(_get_source_deadline(kwargs)) as deadline:
+            timeout = asyncio.timeout_at(deadline)
+            try:
+                async with timeout:
+                    return await func(*args, **kwargs)
+            except Exception as exc:  # pylint: disable=broad-except
+                if isinstance(exc, TimeoutError) and timeout.expired():
+                    metrics.inc("deadline_exceeded", operation=func.__name__)
+                    detail = "Request deadline exceeded"
+                    raise HTTPException(status_code=504, detail=detail) from exc
+                logging.exception("Error %s, Traceback: %s", exc, exc.__traceback__)
+                raise HTTPException(status_code=409, detail=str(exc)) from exc
+
+    return wrapper
+
+
+async def _ndjson(items: AsyncGenerator[Any, None]) -> AsyncIterator[str]:
+    """Serialize dataclasses one per line, an error ends the stream with an error line"""
+    async with aclosing(items):
         try:
-            return await func(*args, **kwargs)
+            async for item in items:
+                yield json.dumps(asdict(item)) + "\n"
         except Exception as exc:  # pylint: disable=broad-except
             logging.exception("Error %s, Traceback: %s", exc, exc.__traceback__)
-            raise HTTPException(status_code=409, detail=str(exc)) from exc
-
-    return wrapper
+            yield json.dumps({"error": str(exc)}) + "\n"
 
 
 @device_router.post("/get_device_information", tags=["Device"])
@@ -63,6 +186,13 @@ async def get_system_uris(source: Source) -> SystemUris:
     return await client.get_system_uris()
 
 
+@device_router.post("/get_services", tags=["Device"])
+@conflict_exception_decorator
+async def get_services(source: Source) -> Services:
+    client = OnvifClientDevice(settings=OnvifClientSettings(source=source, common=ONVIFSettings()))
+    return await client.get_services()
+
+
 @media_router.post("/get_audio_outputs", tags=["Media"])
 @conflict_exception_decorator
 async def get_audio_outputs(source: Source) -> AudioOutputs:
@@ -72,9 +202,114 @@ async def get_audio_outputs(source: Source) -> AudioOutputs:
 
 @media_router.post("/get_profiles", tags=["Media"])
 @conflict_exception_decorator
-async def get_profiles(source: Source) -> MediaProfiles:
+async def get_profiles(
+    source: Source, fields: list[ProfileField] | None = Query(None)
+) -> MediaProfiles:
     client = OnvifClientMedia(settings=OnvifClientSettings(source=source, common=ONVIFSettings()))
-    return await client.get_profiles()
+    return await client.get_profiles([field.value for field in fields] if fields else None)
+
+
+@media_router.post("/get_profile", tags=["Media"])
+@conflict_exception_decorator
+async def get_profile(request: ProfileRequest) -> MediaProfile:
+    client = await OnvifClientMedia.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_profile(request.profile_token)
+
+
+@media_router.post("/get_video_source_configuration", tags=["Media"])
+@conflict_exception_decorator
+async def get_video_source_configuration(
+    request: ConfigurationRequest,
+) -> VideoSourceConfiguration:
+    client = await OnvifClientMedia.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_video_source_configuration(request.configuration_token)
+
+
+@media_router.post("/get_video_encoder_configuration", tags=["Media"])
+@conflict_exception_decorator
+async def get_video_encoder_configuration(
+    request: ConfigurationRequest,
+) -> VideoEncoderConfiguration:
+    client = await OnvifClientMedia.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_video_encoder_configuration(request.configuration_token)
+
+
+@media_router.post("/get_metadata_configuration", tags=["Media"])
+@conflict_exception_decorator
+async def get_metadata_configuration(request: ConfigurationRequest) -> MetadataConfiguration:
+    client = await OnvifClientMedia.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_metadata_configuration(request.configuration_token)
+
+
+@media_router.post("/get_snapshot_uri", tags=["Media"])
+@conflict_exception_decorator
+async def get_snapshot_uri(request: ProfileRequest) -> MediaUri:
+    client = OnvifClientMedia(
+        settings=OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_snapshot_uri(request.profile_token)
+
+
+@media_router.post("/get_snapshot", tags=["Media"], response_class=StreamingResponse)
+@conflict_exception_decorator
+async def get_snapshot(request: SnapshotRequest) -> StreamingResponse:
+    snapshot = await snapshot_proxy.open(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings()), request.profile_token
+    )
+    return StreamingResponse(snapshot.chunks, media_type=snapshot.content_type)
+
+
+@media_router.post("/get_stream_uris", tags=["Media"])
+@conflict_exception_decorator
+async def get_stream_uris(request: StreamUrisRequest) -> list[CameraStreamUris]:
+    return await get_fleet_stream_uris(
+        request.sources, ONVIFSettings(), request.stream.value, request.protocol.value
+    )
+
+
+@media_router.post("/get_config_changes", tags=["Media"])
+@conflict_exception_decorator
+async def get_config_changes(
+    request: ConfigChangesRequest, background_tasks: BackgroundTasks
+) -> list[ConfigChanges]:
+    changes, snapshots = await get_fleet_config_changes(
+        request.sources, ONVIFSettings(), request.consumer, request.full
+    )
+    # Background tasks run once the response is sent, an undelivered response commits nothing
+    background_tasks.add_task(config_snapshots.commit, request.consumer, snapshots)
+    return changes
+
+
+@media_router.post(
+    "/push_video_encoder_configuration", tags=["Media"], response_class=StreamingResponse
+)
+@conflict_exception_decorator
+async def push_video_encoder_configuration(request: VideoEncoderPushRequest) -> StreamingResponse:
+    results = push_fleet_encoders(
+        request.sources,
+        ONVIFSettings(),
+        VideoEncoderSettings(**request.change.dict()),
+        request.configuration_tokens,
+        request.media2,
+        request.dry_run,
+        request.rollback,
+        request.concurrency,
+    )
+    return StreamingResponse(_ndjson(results), media_type="application/x-ndjson")
+
+
+@media2_router.post("/get_stream_uris", tags=["Media2"])
+@conflict_exception_decorator
+async def get_stream_uris_2(request: Media2StreamUrisRequest) -> list[CameraStreamUris]:
+    return await get_fleet_stream_uris_2(request.sources, ONVIFSettings(), request.protocol.value)
 
 
 @media2_router.post("/get_video_encoder_configurations", tags=["Media2"])
@@ -86,19 +321,256 @@ async def get_video_encoder_configurations(source: Source) -> GetVideoEncoderCon
 
 @media_router.post("/get_profiles_2", tags=["Media2"])
 @conflict_exception_decorator
-async def get_profiles_2(source: Source) -> dict[str, str]:
-    client = OnvifClientMedia2(settings=OnvifClientSettings(source=source, common=ONVIFSettings()))
-    return await client.get_profiles()
+async def get_profiles_2(request: Media2ProfilesRequest) -> Media2Profiles:
+    client = await OnvifClientMedia2.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_profiles(
+        [config_type.value for config_type in request.types], request.profile_token
+    )
 
 
 @replay_router.post("/get_replay_uri", tags=["Replay"])
 @conflict_exception_decorator
-async def get_replay_uri(source: Source) -> dict[str, str]:
-    client = OnvifClientReplay(settings=OnvifClientSettings(source=source, common=ONVIFSettings()))
-    return await client.get_replay_uri()
+async def get_replay_uri(request: ReplayUriRequest) -> ReplayUri:
+    client = await OnvifClientReplay.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    if not (recording_token := request.recording_token):
+        if not (tokens := await client.get_recording_tokens()):
+            raise ValueError("Camera has no recordings")
+        recording_token = tokens[0]
+    return await client.get_replay_uri(
+        recording_token, request.stream.value, request.protocol.value
+    )
+
+
+@replay_router.post("/get_replay_uris", tags=["Replay"])
+@conflict_exception_decorator
+async def get_replay_uris(request: ReplayUrisRequest) -> ReplayUris:
+    client = await OnvifClientReplay.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    return await client.get_replay_uris(
+        request.recording_tokens, request.stream.value, request.protocol.value
+    )
+
+
+@search_router.post("/get_recordings", tags=["Search"])
+@conflict_exception_decorator
+async def get_recordings(source: Source) -> RecordingIndex:
+    client = await OnvifClientSearch.create_async(
+        OnvifClientSettings(source=source, common=ONVIFSettings())
+    )
+    return await client.get_recording_index()
+
+
+@search_router.post("/stream_recordings", tags=["Search"], response_class=StreamingResponse)
+@conflict_exception_decorator
+async def stream_recordings(source: Source) -> StreamingResponse:
+    client = await OnvifClientSearch.create_async(
+        OnvifClientSettings(source=source, common=ONVIFSettings())
+    )
+    return StreamingResponse(
+        _ndjson(client.iterate_recordings()), media_type="application/x-ndjson"
+    )
+
+
+@search_router.post("/stream_events", tags=["Search"], response_class=StreamingResponse)
+@conflict_exception_decorator
+async def stream_events(request: EventSearchRequest) -> StreamingResponse:
+    client = await OnvifClientSearch.create_async(
+        OnvifClientSettings(source=request.source, common=ONVIFSettings())
+    )
+    events = client.iterate_events(
+        request.start_point,
+        request.end_point,
+        request.recording_tokens,
+        request.include_start_state,
+    )
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+def _ptz_speed(velocity: PTZVelocity | None) -> PTZVector | None:
+    if velocity is None:
+        return None
+    return PTZVector.from_pan_tilt_zoom(velocity.pan, velocity.tilt, velocity.zoom)
+
+
+async def _ptz_queue(request: PTZProfileRequest) -> PTZCommandQueue:
+    return await ptz_queues.get(OnvifClientSettings(source=request.source, common=ONVIFSettings()))
+
+
+@ptz_router.post("/continuous_move", tags=["PTZ"])
+@conflict_exception_decorator
+async def continuous_move(request: ContinuousMoveRequest) -> PTZCommandResult:
+    queue = await _ptz_queue(request)
+    return await queue.submit(
+        "continuous_move",
+        profile_token=request.profile_token,
+        velocity=_ptz_speed(request.velocity),
+        timeout=request.timeout,
+    )
+
+
+@ptz_router.post("/absolute_move", tags=["PTZ"])
+@conflict_exception_decorator
+async def absolute_move(request: AbsoluteMoveRequest) -> PTZCommandResult:
+    queue = await _ptz_queue(request)
+    position = request.position
+    return await queue.submit(
+        "absolute_move",
+        profile_token=request.profile_token,
+        position=PTZVector.from_pan_tilt_zoom(position.pan, position.tilt, position.zoom),
+        speed=_ptz_speed(request.speed),
+    )
+
+
+@ptz_router.post("/stop", tags=["PTZ"])
+@conflict_exception_decorator
+async def stop(request: StopRequest) -> PTZCommandResult:
+    queue = await _ptz_queue(request)
+    return await queue.submit(
+        "stop", profile_token=request.profile_token, pan_tilt=request.pan_tilt, zoom=request.zoom
+    )
+
+
+@ptz_router.post("/goto_preset", tags=["PTZ"])
+@conflict_exception_decorator
+async def goto_preset(request: GotoPresetRequest) -> PTZCommandResult:
+    queue = await _ptz_queue(request)
+    return await queue.submit(
+        "goto_preset",
+        profile_token=request.profile_token,
+        preset_token=request.preset_token,
+        speed=_ptz_speed(request.speed),
+    )
+
+
+@ptz_router.post("/get_status", tags=["PTZ"])
+@conflict_exception_decorator
+async def get_ptz_status(request: PTZProfileRequest) -> PTZStatus:
+    queue = await _ptz_queue(request)
+    return await queue.client.get_status(request.profile_token)
+
+
+@ptz_router.post("/get_presets", tags=["PTZ"])
+@conflict_exception_decorator
+async def get_presets(request: PTZProfileRequest) -> PTZPresets:
+    queue = await _ptz_queue(request)
+    return await queue.client.get_presets(request.profile_token)
+
+
+@ptz_router.post("/set_preset", tags=["PTZ"])
+@conflict_exception_decorator
+async def set_preset(request: SetPresetRequest) -> PTZPreset:
+    queue = await _ptz_queue(request)
+    token = await queue.client.set_preset(
+        request.profile_token, request.preset_name, request.preset_token
+    )
+    return PTZPreset(token=token, name=request.preset_name)
+
+
+@ptz_router.post("/remove_preset", tags=["PTZ"])
+@conflict_exception_decorator
+async def remove_preset(request: RemovePresetRequest) -> PTZCommandResult:
+    queue = await _ptz_queue(request)
+    await queue.client.remove_preset(request.profile_token, request.preset_token)
+    return PTZCommandResult(operation="remove_preset")
+
+
+@imaging_router.post("/get_video_sources_imaging", tags=["Imaging"])
+@conflict_exception_decorator
+async def get_video_sources_imaging(source: Source) -> CameraImaging:
+    client = await OnvifClientImaging.create_async(
+        OnvifClientSettings(source=source, common=ONVIFSettings())
+    )
+    return await client.get_video_sources_imaging()
+
+
+@imaging_router.post("/get_video_sources_imaging_batch", tags=["Imaging"])
+@conflict_exception_decorator
+async def get_video_sources_imaging_batch(sources: list[Source]) -> list[CameraImaging]:
+    return await get_fleet_imaging(sources, ONVIFSettings())
+
+
+@discovery_router.post("/probe", tags=["Discovery"])
+@conflict_exception_decorator
+async def discovery_probe(timeout: float | None = None) -> list[RegisteredCamera]:
+    matches = await probe(timeout=timeout or ONVIFSettings().discovery_timeout)
+    return camera_registry.update(matches)
+
+
+@discovery_router.get("/cameras", tags=["Discovery"])
+async def get_registered_cameras() -> list[RegisteredCamera]:
+    return camera_registry.list()
+
+
+@health_router.post("/register", tags=["Health"])
+async def register_health_checks(sources: list[Source]) -> list[CameraHealth]:
+    return [health_scheduler.register(source) for source in sources]
+
+
+@health_router.get("/cameras", tags=["Health"])
+async def get_cameras_health() -> list[CameraHealth]:
+    return camera_health.list()
+
+
+@inventory_router.post("/cameras", tags=["Inventory"])
+@conflict_exception_decorator
+async def query_inventory(query: InventoryQuery) -> list[CameraMetadata]:
+    if not metadata_store:
+        raise ValueError("Metadata store is disabled")
+    return await metadata_store.query(query)
+
+
+@metrics_router.get("", tags=["Metrics"])
+async def get_metrics() -> dict[str, list[dict]]:
+    return metrics.snapshot()
+
+
+@affinity_router.get("/nodes", tags=["Affinity"])
+@conflict_exception_decorator
+async def get_affinity_nodes() -> AffinityNodes:
+    return camera_affinity.get_nodes()
+
+
+@affinity_router.post("/owner", tags=["Affinity"])
+@conflict_exception_decorator
+async def get_camera_owner(source: Source) -> CameraOwner:
+    return camera_affinity.get_camera_owner(source)
+
+
+@app.on_event("startup")
+async def start_background_clients() -> None:
+    # Every instance has its own URL, it comes from the environment (ONVIF_SETTINGS__...)
+    camera_affinity.configure(CommonSettings().onvif_settings)
+    offload_pool.configure(ONVIFSettings())
+    health_scheduler.start(ONVIFSettings())
+
+
+@app.on_event("shutdown")
+async def stop_background_clients() -> None:
+    await health_scheduler.stop()
+    await event_watchers.stop()
+    await ptz_queues.stop()
+    await snapshot_proxy.close()
+    await camera_affinity.close()
+    offload_pool.close()
+    if metadata_store:
+        # Blocks until the queued updates are written
+        await asyncio.to_thread(metadata_store.close)
 
 
 app.include_router(device_router, prefix="/api/device")
 app.include_router(media_router, prefix="/api/media")
 app.include_router(media2_router, prefix="/api/media2")
 app.include_router(replay_router, prefix="/api/replay")
+app.include_router(search_router, prefix="/api/search")
+app.include_router(ptz_router, prefix="/api/ptz")
+app.include_router(imaging_router, prefix="/api/imaging")
+app.include_router(discovery_router, prefix="/api/discovery")
+app.include_router(health_router, prefix="/api/health")
+app.include_router(inventory_router, prefix="/api/inventory")
+app.include_router(affinity_router, prefix="/api/affinity")
+app.include_router(metrics_router, prefix="/api/metrics")
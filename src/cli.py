@@ -0,0 +1,267 @@
+"""
+Fleet operations from the command line, without the HTTP API in between.
+
+    python -m src.cli device_information cameras.csv results.jsonl --concurrency 64 --resume
+
+Sources are read from CSV (a header with Source field names) or JSONL (a Source per line).
+Every camera gets one JSONL line in the output as soon as it is done, with either
+"result" or "error". With --resume the cameras already in the output are skipped, with
+--retry-errors as well the error lines are removed from the output and those cameras are
+queried again, so that every camera keeps a single line.
+"""
+
+import os
+import csv
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, TextIO, TypeVar
+
+from pydantic import ValidationError
+
+from src.config import ONVIFSettings
+from src.model.media import StreamType, TransportProtocol
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClient, OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_client_imaging import OnvifClientImaging
+from src.onvif.onvif_client_media import OnvifClientMedia
+from src.onvif.onvif_client_search import OnvifClientSearch
+from src.onvif.onvif_deadline import deadline_scope
+
+Operation = Callable[[OnvifClientSettings, argparse.Namespace], Awaitable[Any]]
+T = TypeVar("T", bound=OnvifClient)
+
+
+@asynccontextmanager
+async def _open(client_type: type[T], settings: OnvifClientSettings) -> AsyncIterator[T]:
+    """Client of one camera, its connections are closed once the camera is done"""
+    client = await client_type.create_async(settings)
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def _device_information(settings: OnvifClientSettings, _: argparse.Namespace) -> Any:
+    async with _open(OnvifClientDevice, settings) as client:
+        return await client.get_device_information()
+
+
+async def _system_date_and_time(settings: OnvifClientSettings, _: argparse.Namespace) -> Any:
+    async with _open(OnvifClientDevice, settings) as client:
+        return await client.get_system_date_and_time()
+
+
+async def _profiles(settings: OnvifClientSettings, _: argparse.Namespace) -> Any:
+    async with _open(OnvifClientMedia, settings) as client:
+        return await client.get_profiles()
+
+
+async def _stream_uris(settings: OnvifClientSettings, args: argparse.Namespace) -> Any:
+    async with _open(OnvifClientMedia, settings) as client:
+        return await client.get_stream_uris(args.stream, args.protocol)
+
+
+async def _imaging(settings: OnvifClientSettings, _: argparse.Namespace) -> Any:
+    async with _open(OnvifClientImaging, settings) as client:
+        return await client.get_video_sources_imaging()
+
+
+async def _recordings(settings: OnvifClientSettings, _: argparse.Namespace) -> Any:
+    async with _open(OnvifClientSearch, settings) as client:
+        return await client.get_recording_index()
+
+
+OPERATIONS: dict[str, Operation] = {
+    "device_information": _device_information,
+    "system_date_and_time": _system_date_and_time,
+    "profiles": _profiles,
+    "stream_uris": _stream_uris,
+    "imaging": _imaging,
+    "recordings": _recordings,
+}
+
+
+@dataclass
+class RunSummary:
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+
+def _read_csv(file: TextIO) -> Iterator[dict]:
+    for row in csv.DictReader(file):
+        # Empty cells are missing values, not empty strings
+        yield {key: value for key, value in row.items() if key and value not in ("", None)}
+
+
+def _read_jsonl(file: TextIO) -> Iterator[dict]:
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exc:
+            logging.warning("Line %s of the sources is not valid JSON: %s", number, exc)
+
+
+def read_sources(path: str, file_format: str | None = None) -> Iterator[Source]:
+    """Sources of the file, read lazily so that large inventories are not loaded at once"""
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8", newline="") as file:
+        rows = _read_csv(file) if file_format == "csv" else _read_jsonl(file)
+        for row in rows:
+            try:
+                yield Source.parse_obj(row)
+            except ValidationError as exc:
+                logging.warning("Invalid source %s: %s", row, exc)
+
+
+def _read_output(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line of an interrupted run may be cut off
+                continue
+            if isinstance(item, dict) and "camera" in item:
+                yield item
+
+
+def read_done_cameras(path: str) -> set[str]:
+    """Cameras which already have a line in the output of a previous run"""
+    if not os.path.exists(path):
+        return set()
+    return {item["camera"] for item in _read_output(path)}
+
+
+def drop_errors(path: str) -> None:
+    """Remove the error lines from the output, their cameras are then queried again"""
+    if not os.path.exists(path):
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as output:
+        for item in _read_output(path):
+            if "error" not in item:
+                output.write(json.dumps(item) + "\n")
+    os.replace(temporary, path)
+
+
+async def run_camera(
+    operation: str, source: Source, common: ONVIFSettings, args: argparse.Namespace
+) -> dict:
+    camera = source.get_camera_key()
+    try:
+        with deadline_scope(args.deadline):
+            result = await OPERATIONS[operation](
+                OnvifClientSettings(source=source, common=common, store_metadata=False), args
+            )
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.debug("%s of %s failed: %r", operation, camera, exc)
+        return {"camera": camera, "operation": operation, "error": str(exc) or repr(exc)}
+    return {"camera": camera, "operation": operation, "result": asdict(result)}
+
+
+async def run(
+    args: argparse.Namespace, sources: Iterator[Source], output: TextIO, done: set[str]
+) -> RunSummary:
+    """
+    Run the operation for every source with at most `concurrency` cameras at once.
+    Lines are flushed one by one, an interrupted run loses the cameras in flight only.
+    """
+    # A one-off run starts no event subscriptions and does not write the metadata store
+    common = ONVIFSettings(events_enabled=False, metadata_store_enabled=False)
+    summary = RunSummary()
+    queue: asyncio.Queue[Source | None] = asyncio.Queue(maxsize=args.concurrency * 2)
+
+    async def worker() -> None:
+        while (source := await queue.get()) is not None:
+            line = await run_camera(args.operation, source, common, args)
+            output.write(json.dumps(line, default=str) + "\n")
+            output.flush()
+            if "error" in line:
+                summary.failed += 1
+            else:
+                summary.succeeded += 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+    try:
+        for source in sources:
+            if (camera := source.get_camera_key()) in done:
+                summary.skipped += 1
+                continue
+            # The same camera listed twice is queried once
+            done.add(camera)
+            await queue.put(source)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return summary
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description=__doc__.split("\n")[1])
+    parser.add_argument("operation", choices=sorted(OPERATIONS))
+    parser.add_argument("sources", help="CSV or JSONL file with the cameras")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Format of the sources file")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=ONVIFSettings().fleet_concurrency,
+        help="Cameras queried at once",
+    )
+    parser.add_argument("--deadline", type=float, help="Seconds allowed per camera")
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip the cameras already in the output"
+    )
+    parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="With --resume, remove the error lines and query those cameras again",
+    )
+    parser.add_argument(
+        "--stream", default=StreamType.RTP_UNICAST.value, choices=[t.value for t in StreamType]
+    )
+    parser.add_argument(
+        "--protocol",
+        default=TransportProtocol.RTSP.value,
+        choices=[p.value for p in TransportProtocol],
+    )
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    logging.basicConfig(
+        format="%(asctime)s %(filename)s %(levelname)s: %(message)s",
+        level=os.environ.get("LOGGING", "WARNING"),
+    )
+    args = parse_args(argv)
+    if args.resume and args.retry_errors:
+        drop_errors(args.output)
+    done = read_done_cameras(args.output) if args.resume else set()
+    sources = read_sources(args.sources, args.format)
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as output:
+        summary = asyncio.run(run(args, sources, output, done))
+    print(
+        f"{args.operation}: {summary.succeeded} succeeded, {summary.failed} failed, "
+        f"{summary.skipped} skipped",
+        file=sys.stderr,
+    )
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
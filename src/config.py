@@ -6,6 +6,91 @@ class ONVIFSettings(BaseModel):
     timeout: int = 60
     operation_timeout: int = 60
     verify_ssl: bool = False
+    http_digest: bool = True
+    clock_offset_ttl: int = 3600
+    cache_ttl: int = 300
+    cache_ttl_with_events: int = 3600
+    # Directory of the local databases, accessible to the user running the API only.
+    # Empty means $XDG_CACHE_HOME/onvif-api, relative database paths are placed in it
+    data_dir: str = ""
+    # "memory" keeps the cache per process, "sqlite" shares it between workers of one host
+    cache_backend: str = "memory"
+    cache_path: str = "onvif_cache.sqlite"
+    bosch_url_ttl: int = 3600
+    metadata_store_enabled: bool = False
+    metadata_store_path: str = "onvif_metadata.sqlite"
+    events_enabled: bool = True
+    events_pull_timeout: int = 30
+    events_subscription_time: int = 120
+    events_retry_interval: int = 600
+    ptz_keepalive: int = 300
+    imaging_options_ttl: int = 86400
+    fleet_concurrency: int = 32
+    snapshot_cache_ttl: float = 2.0
+    snapshot_cache_max_bytes: int = 64 * 1024 * 1024
+    snapshot_max_image_bytes: int = 2 * 1024 * 1024
+    # Chunks a client may lag behind a shared snapshot download before it is cut off
+    snapshot_subscriber_chunks: int = 64
+    recordings_index_ttl: int = 300
+    search_keep_alive: int = 30
+    search_page_size: int = 100
+    search_wait_time: int = 5
+    # A device which never reports a completed search is given up on after this many pages
+    search_max_pages: int = 1000
+    discovery_timeout: float = 3.0
+    health_enabled: bool = True
+    health_check_interval: float = 60.0
+    health_check_max_interval: float = 600.0
+    health_check_jitter: float = 0.2
+    health_check_timeout: float = 5.0
+    health_check_rate: float = 20.0
+    health_check_burst: int = 20
+    health_check_concurrency: int = 16
+    health_down_after: int = 2
+    # A camera marked down still gets one user request through every health_probe_after seconds
+    health_probe_after: float = 30.0
+    encoder_options_ttl: int = 86400
+    encoder_push_rate: float = 2.0
+    parse_offload_threshold: int = 256 * 1024
+    parse_offload_workers: int = 4
+    admission_max_in_flight: int = 64
+    admission_queue_timeout: float = 5.0
+    admission_retry_after: int = 1
+    # Path prefix -> priority class, the longest matching prefix wins
+    admission_priorities: dict[str, str] = {
+        "/api/ptz": "interactive",
+        "/api/media/get_snapshot": "interactive",
+        "/api/inventory": "bulk",
+        "/api/discovery": "bulk",
+        "/api/media/push_video_encoder_configuration": "bulk",
+        "/api/media/get_config_changes": "bulk",
+        "/api/media/get_stream_uris": "bulk",
+        "/api/media2/get_stream_uris": "bulk",
+        "/api/replay/get_replay_uris": "bulk",
+        "/api/imaging/get_video_sources_imaging_batch": "bulk",
+    }
+    # Lower ranks are admitted first
+    admission_priority_ranks: dict[str, int] = {"interactive": 0, "normal": 1, "bulk": 2}
+    admission_queue_limits: dict[str, int] = {"interactive": 64, "normal": 128, "bulk": 16}
+    # Base URLs of the API instances sharing the cameras, affinity_self_url is in the list
+    affinity_enabled: bool = False
+    affinity_nodes: list[str] = []
+    affinity_self_url: str | None = None
+    affinity_replicas: int = 100
+    affinity_forward_timeout: float = 60.0
+    # Shared by the instances, signs forwarded requests so clients cannot pass as a peer
+    affinity_secret: str | None = None
+    dns_cache_ttl: float = 300.0
+    dns_negative_ttl: float = 30.0
+    max_response_size: int = 2 * 1024 * 1024
+    # Operations whose responses grow with the number of profiles, topics or results
+    max_response_sizes: dict[str, int] = {
+        "GetProfiles": 8 * 1024 * 1024,
+        "GetEventProperties": 8 * 1024 * 1024,
+        "GetRecordingSearchResults": 8 * 1024 * 1024,
+        "GetEventSearchResults": 8 * 1024 * 1024,
+        "PullMessages": 4 * 1024 * 1024,
+    }
 
 
 class CommonSettings(BaseSettings):
@@ -0,0 +1,364 @@
+"""ASGI middlewares in front of the API routers"""
+
+import time
+import json
+import heapq
+import asyncio
+import itertools
+import logging
+
+import httpx
+from pydantic import ValidationError
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_affinity import camera_affinity
+from src.onvif.onvif_deadline import cap_timeout, deadline_scope, get_remaining
+from src.onvif.onvif_metrics import metrics
+
+DEADLINE_HEADER = b"x-request-deadline"
+FORWARDED_HEADER = b"x-onvif-forwarded"
+# Headers which describe the connection to the proxy, not the request or the response
+HOP_BY_HOP_HEADERS = {
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+    b"host",
+}
+NOT_FORWARDED_PATHS = ("/api/affinity", "/api/metrics")
+
+DEFAULT_PRIORITY = "normal"
+
+
+def get_header_deadline(scope: Scope) -> float | None:
+    """Seconds of the X-Request-Deadline header, None when it is missing or invalid"""
+    for name, value in scope.get("headers", []):
+        if name.lower() == DEADLINE_HEADER:
+            try:
+                seconds = float(value)
+            except ValueError:
+                return None
+            return seconds if seconds > 0 else None
+    return None
+
+
+class RequestDeadlineMiddleware:
+    """Deadline from the X-Request-Deadline header for the calls made while serving a request"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with deadline_scope(get_header_deadline(scope)):
+            await self.app(scope, receive, send)
+
+
+class DisconnectCancellationMiddleware:
+    """
+    Cancel the handler when the client disconnects before the response is complete, so
+    pending camera calls stop instead of running into the operation timeout.
+    The request messages are read eagerly to notice the disconnect while the handler runs.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        response_complete = disconnected = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+
+        async def watch() -> None:
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_complete and not handler.done():
+                        disconnected = True
+                        handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected:
+                handler.cancel()
+                raise
+            metrics.inc("requests_cancelled", path=scope["path"])
+            logging.info("Client disconnected, cancelled %s", scope["path"])
+        finally:
+            watcher.cancel()
+
+
+class AdmissionController:
+    """
+    At most `max_in_flight` requests are served at once. Others wait in a queue per priority
+    class, a freed slot goes to the most important class first (lowest rank), in arrival order
+    within the class. A request is shed when its class queue is full or it waits too long.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        priority_ranks: dict[str, int],
+        queue_limits: dict[str, int],
+        queue_timeout: float,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.priority_ranks = priority_ranks
+        self.queue_limits = queue_limits
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._queued: dict[str, int] = {}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def queued(self, priority: str) -> int:
+        return self._queued.get(priority, 0)
+
+    async def acquire(self, priority: str) -> bool:
+        """Take a slot, False when the request has to be shed"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return True
+        if self.queued(priority) >= self.queue_limits.get(priority, 0):
+            metrics.inc("requests_shed", priority=priority, reason="queue_full")
+            return False
+        # The caller would not wait for an answer after its deadline anyway
+        timeout = self.queue_timeout
+        if (remaining := get_remaining()) is not None:
+            timeout = max(min(timeout, remaining), 0.0)
+        future = asyncio.get_running_loop().create_future()
+        rank = self.priority_ranks.get(priority, self.priority_ranks.get(DEFAULT_PRIORITY, 0))
+        heapq.heappush(self._waiters, (rank, next(self._sequence), future))
+        self._queued[priority] = self.queued(priority) + 1
+        started = time.monotonic()
+        try:
+            # Not wait_for, which swallows a cancellation once the slot has been handed over
+            async with asyncio.timeout(timeout):
+                await future
+        except TimeoutError:
+            metrics.inc("requests_shed", priority=priority, reason="queue_timeout")
+            return False
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self._queued[priority] -= 1
+            metrics.observe("admission_wait_seconds", time.monotonic() - started, priority=priority)
+        return True
+
+    def release(self) -> None:
+        """Free a slot, or hand it over to the next waiter"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionControlMiddleware:
+    """
+    Admission control in front of the routers, shed requests get a 503 with Retry-After right
+    away instead of piling up clients and sockets. Paths outside of the API and the metrics
+    are always admitted.
+    """
+
+    def __init__(self, app: ASGIApp, settings: ONVIFSettings) -> None:
+        self.app = app
+        self.settings = settings
+        self.controller = AdmissionController(
+            max_in_flight=settings.admission_max_in_flight,
+            priority_ranks=settings.admission_priority_ranks,
+            queue_limits=settings.admission_queue_limits,
+            queue_timeout=settings.admission_queue_timeout,
+        )
+
+    def get_priority(self, path: str) -> str | None:
+        """Priority class of the path, None for paths which bypass admission control"""
+        if not path.startswith("/api/") or path.startswith("/api/metrics"):
+            return None
+        priorities = self.settings.admission_priorities
+        matches = [prefix for prefix in priorities if path.startswith(prefix)]
+        return priorities[max(matches, key=len)] if matches else DEFAULT_PRIORITY
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or (priority := self.get_priority(scope["path"])) is None:
+            await self.app(scope, receive, send)
+            return
+        if not await self.controller.acquire(priority):
+            response = JSONResponse(
+                {"detail": "Server is overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.settings.admission_retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+
+def get_request_source(body: bytes) -> Source | None:
+    """Camera of a request body which is a Source or has one in its `source` field"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    data = data["source"] if isinstance(data.get("source"), dict) else data
+    try:
+        source = Source.parse_obj(data)
+    except ValidationError:
+        return None
+    if not (source.host or source.bosch_security_url or source.endpoint_reference):
+        return None
+    return source
+
+
+class AffinityMiddleware:
+    """
+    Forward requests about a single camera to the instance which owns it on the hash ring.
+    Requests for several cameras, requests forwarded by a peer and requests whose owner
+    cannot be connected to are served locally. An owner which fails after it got the request
+    is not retried here, the request gets a 502.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def _is_candidate(self, scope: Scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and camera_affinity.enabled
+            and scope["method"] == "POST"
+            and scope["path"].startswith("/api/")
+            and not scope["path"].startswith(NOT_FORWARDED_PATHS)
+            and not self._is_peer_forward(scope)
+        )
+
+    @staticmethod
+    def _is_peer_forward(scope: Scope) -> bool:
+        """Only a peer's mark stops forwarding, anyone else's is replaced when forwarding"""
+        return any(
+            name.lower() == FORWARDED_HEADER
+            and camera_affinity.is_peer_forward(
+                value.decode("latin-1"), scope["method"], scope["path"]
+            )
+            for name, value in scope["headers"]
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._is_candidate(scope):
+            await self.app(scope, receive, send)
+            return
+        messages: list[Message] = []
+        body = b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        async def replay() -> Message:
+            return messages.pop(0) if messages else await receive()
+
+        source = get_request_source(body)
+        if not (source and (owner := camera_affinity.get_forward_url(source))):
+            await self.app(scope, replay, send)
+            return
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        try:
+            await self._forward(owner, scope, body, send_wrapper)
+            metrics.inc("affinity_forwarded", owner=owner)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as exc:
+            # The owner never got the request, serving it here does not run it twice
+            metrics.inc("affinity_forward_errors", owner=owner)
+            logging.warning("Forwarding to %s failed, serving locally: %r", owner, exc)
+            await self.app(scope, replay, send)
+        except httpx.TransportError as exc:
+            # The owner may already be running the request, e.g. a PTZ move
+            metrics.inc("affinity_forward_errors", owner=owner)
+            if response_started:
+                raise
+            logging.warning("Forwarding to %s failed: %r", owner, exc)
+            response = JSONResponse(
+                {"detail": f"Owner of the camera did not answer: {exc!r}"}, status_code=502
+            )
+            await response(scope, replay, send)
+
+    @staticmethod
+    async def _forward(owner: str, scope: Scope, body: bytes, send: Send) -> None:
+        headers = [
+            (name, value)
+            for name, value in scope["headers"]
+            if name.lower() not in HOP_BY_HOP_HEADERS
+            and name.lower() not in (b"content-length", DEADLINE_HEADER, FORWARDED_HEADER)
+        ]
+        forwarded = camera_affinity.sign_forward(scope["method"], scope["path"])
+        headers.append((FORWARDED_HEADER, forwarded.encode()))
+        # The owner gets what is left of the deadline, not the original budget
+        if (remaining := get_remaining()) is not None:
+            headers.append((DEADLINE_HEADER, str(max(remaining, 0.001)).encode()))
+        url = owner.rstrip("/") + scope["path"]
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode()
+        client = camera_affinity.get_client()
+        request = client.build_request(
+            "POST", url, content=body, headers=headers, timeout=cap_timeout(client.timeout)
+        )
+        response = await client.send(request, stream=True)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [
+                        (name, value)
+                        for name, value in response.headers.raw
+                        if name.lower() not in HOP_BY_HOP_HEADERS
+                    ],
+                }
+            )
+            # Raw chunks, the content encoding of the owner's response is kept
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await response.aclose()
@@ -0,0 +1,30 @@
+from pydantic import BaseModel, Field
+
+
+class InventoryQuery(BaseModel):
+    manufacturer: str | None = Field(None, example="Bosch")
+    model: str | None = Field(None, example="AUTODOME IP starlight 7000i")
+    firmware_below: str | None = Field(
+        None,
+        title="Firmware below",
+        description="Only cameras with a firmware version lower than this one.",
+        example="7.80.0125",
+    )
+    firmware_at_least: str | None = Field(
+        None,
+        title="Firmware at least",
+        description="Only cameras with a firmware version equal or higher than this one.",
+        example="7.10.0000",
+    )
+    encoding: str | None = Field(
+        None,
+        title="Encoding",
+        description="Only cameras with at least one video encoder using this encoding.",
+        example="H264",
+    )
+    service: str | None = Field(
+        None,
+        title="Service",
+        description="Only cameras offering the service with this namespace.",
+        example="http://www.onvif.org/ver20/ptz/wsdl",
+    )
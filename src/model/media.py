@@ -0,0 +1,153 @@
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+from src.model.source import Source
+
+
+class ProfileRequest(BaseModel):
+    source: Source
+    profile_token: str = Field(
+        ...,
+        title="Profile token",
+        description="Token of the media profile.",
+        example="Profile_1",
+    )
+
+
+class ConfigurationRequest(BaseModel):
+    source: Source
+    configuration_token: str = Field(
+        ...,
+        title="Configuration token",
+        description="Token of the configuration.",
+        example="VideoEncoderToken_1",
+    )
+
+
+class ProfileField(Enum):
+    VIDEO_SOURCE_CONFIGURATION = "video_source_configuration"
+    AUDIO_SOURCE_CONFIGURATION = "audio_source_configuration"
+    VIDEO_ENCODER_CONFIGURATION = "video_encoder_configuration"
+    AUDIO_ENCODER_CONFIGURATION = "audio_encoder_configuration"
+    VIDEO_ANALYTICS_CONFIGURATION = "video_analytics_configuration"
+    PTZ_CONFIGURATION = "ptz_configuration"
+    METADATA_CONFIGURATION = "metadata_configuration"
+    EXTENSION = "extension"
+
+
+class SnapshotRequest(BaseModel):
+    source: Source
+    profile_token: str | None = Field(
+        None,
+        title="Profile token",
+        description=(
+            "Token of the media profile to take the snapshot from. "
+            "If it is None, then the first profile of the camera will be used."
+        ),
+        example="Profile_1",
+    )
+
+
+class StreamType(Enum):
+    RTP_UNICAST = "RTP-Unicast"
+    RTP_MULTICAST = "RTP-Multicast"
+
+
+class TransportProtocol(Enum):
+    UDP = "UDP"
+    TCP = "TCP"
+    RTSP = "RTSP"
+    HTTP = "HTTP"
+
+
+class Media2StreamProtocol(Enum):
+    RTSP_UNICAST = "RtspUnicast"
+    RTSP_MULTICAST = "RtspMulticast"
+    RTSP = "RTSP"
+    RTSP_OVER_HTTP = "RtspOverHttp"
+
+
+class Media2ConfigurationType(Enum):
+    ALL = "All"
+    VIDEO_SOURCE = "VideoSource"
+    VIDEO_ENCODER = "VideoEncoder"
+    AUDIO_SOURCE = "AudioSource"
+    AUDIO_ENCODER = "AudioEncoder"
+    AUDIO_OUTPUT = "AudioOutput"
+    AUDIO_DECODER = "AudioDecoder"
+    METADATA = "Metadata"
+    ANALYTICS = "Analytics"
+    PTZ = "PTZ"
+
+
+class Media2ProfilesRequest(BaseModel):
+    source: Source
+    types: list[Media2ConfigurationType] = Field(
+        [Media2ConfigurationType.ALL],
+        title="Configuration types",
+        description=(
+            "Configurations to include in the profiles. "
+            "An empty list returns the profiles without configurations."
+        ),
+        example=["VideoEncoder"],
+    )
+    profile_token: str | None = Field(
+        None,
+        title="Profile token",
+        description="If it is None, then all profiles will be returned.",
+        example="Profile_1",
+    )
+
+
+class StreamUrisRequest(BaseModel):
+    sources: list[Source]
+    stream: StreamType = StreamType.RTP_UNICAST
+    protocol: TransportProtocol = TransportProtocol.RTSP
+
+
+class Media2StreamUrisRequest(BaseModel):
+    sources: list[Source]
+    protocol: Media2StreamProtocol = Media2StreamProtocol.RTSP_UNICAST
+
+
+class ConfigChangesRequest(BaseModel):
+    sources: list[Source]
+    consumer: str = Field(
+        "default",
+        title="Consumer",
+        description="Name of the consumer, changes are tracked separately for every consumer.",
+        max_length=64,
+    )
+    full: bool = Field(
+        False,
+        title="Full snapshot",
+        description="Return every section instead of the changes since the previous request.",
+    )
+
+
+class VideoEncoderChange(BaseModel):
+    encoding: str | None = Field(None, example="H264")
+    width: int | None = Field(None, example=1920)
+    height: int | None = Field(None, example=1080)
+    quality: float | None = None
+    frame_rate_limit: float | None = Field(None, example=25)
+    bitrate_limit: int | None = Field(None, example=4096)
+    gov_length: int | None = Field(None, example=50)
+    profile: str | None = Field(None, example="Main")
+
+
+class VideoEncoderPushRequest(BaseModel):
+    sources: list[Source]
+    change: VideoEncoderChange
+    configuration_tokens: list[str] | None = Field(
+        None,
+        title="Encoder configuration tokens",
+        description="Encoders to change on every camera. If it is None, all encoders are changed.",
+    )
+    media2: bool = Field(True, description="Use the media2 service instead of media.")
+    dry_run: bool = Field(False, description="Only validate and report the planned changes.")
+    rollback: bool = Field(
+        True, description="Restore the changed encoders of a camera when one of them fails."
+    )
+    concurrency: int | None = Field(None, description="Cameras changed at the same time.", gt=0)
@@ -0,0 +1,66 @@
+from pydantic import BaseModel, Field
+
+from src.model.source import Source
+
+
+class PTZProfileRequest(BaseModel):
+    source: Source
+    profile_token: str = Field(
+        ...,
+        title="Profile token",
+        description="Media profile which contains the PTZ configuration.",
+        example="Profile_1",
+    )
+
+
+class PTZVelocity(BaseModel):
+    pan: float = Field(0.0, ge=-1.0, le=1.0, title="Pan velocity")
+    tilt: float = Field(0.0, ge=-1.0, le=1.0, title="Tilt velocity")
+    zoom: float = Field(0.0, ge=-1.0, le=1.0, title="Zoom velocity")
+
+
+class PTZPosition(BaseModel):
+    pan: float = Field(..., title="Pan position")
+    tilt: float = Field(..., title="Tilt position")
+    zoom: float | None = Field(None, title="Zoom position")
+
+
+class ContinuousMoveRequest(PTZProfileRequest):
+    velocity: PTZVelocity
+    timeout: float | None = Field(
+        None,
+        title="Timeout",
+        description="Seconds after which the camera stops the move by itself.",
+        example=1.0,
+    )
+
+
+class AbsoluteMoveRequest(PTZProfileRequest):
+    position: PTZPosition
+    speed: PTZVelocity | None = None
+
+
+class StopRequest(PTZProfileRequest):
+    pan_tilt: bool = True
+    zoom: bool = True
+
+
+class GotoPresetRequest(PTZProfileRequest):
+    preset_token: str
+    speed: PTZVelocity | None = None
+
+
+class SetPresetRequest(PTZProfileRequest):
+    preset_name: str | None = None
+    preset_token: str | None = Field(
+        None,
+        title="Preset token",
+        description=(
+            "Overwrite existing preset with this token. "
+            "If it is None, then new preset will be created."
+        ),
+    )
+
+
+class RemovePresetRequest(PTZProfileRequest):
+    preset_token: str
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+from src.model.media import StreamType, TransportProtocol
+from src.model.source import Source
+
+
+class ReplayUriRequest(BaseModel):
+    source: Source
+    recording_token: str | None = Field(
+        None,
+        title="Recording token",
+        description=(
+            "Recording to replay. "
+            "If it is None, then the first recording found on the camera will be used."
+        ),
+        example="OnvifRecordingToken_1",
+    )
+    stream: StreamType = StreamType.RTP_UNICAST
+    protocol: TransportProtocol = TransportProtocol.UDP
+
+
+class ReplayUrisRequest(BaseModel):
+    source: Source
+    recording_tokens: list[str] | None = Field(
+        None,
+        title="Recording tokens",
+        description="If it is None, then replay uris of all recordings will be returned.",
+    )
+    stream: StreamType = StreamType.RTP_UNICAST
+    protocol: TransportProtocol = TransportProtocol.UDP
+
+
+class EventSearchRequest(BaseModel):
+    source: Source
+    start_point: datetime = Field(..., title="Start of the searched interval")
+    end_point: datetime | None = Field(
+        None,
+        title="End of the searched interval",
+        description="If it is None, then the search runs until the end of the recordings.",
+    )
+    recording_tokens: list[str] | None = Field(
+        None,
+        title="Recording tokens",
+        description="If it is None, then events of all recordings will be searched.",
+    )
+    include_start_state: bool = False
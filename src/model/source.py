@@ -1,3 +1,5 @@
+import hashlib
+
 from pydantic import BaseModel, Field
 
 
@@ -35,3 +37,35 @@ class Source(BaseModel):
         description="Used when we try to connect to camera through Bosch security system.",
         example="https://cbs.com/rest/vx/v1/devices/bvip2:cb80a4b7569d/connection",
     )
+    endpoint_reference: str | None = Field(
+        None,
+        title="Endpoint reference",
+        description=(
+            "WS-Discovery endpoint reference of a discovered camera. "
+            "It is used when host is not set."
+        ),
+        example="urn:uuid:5f5a69c2-e0ae-504f-829b-00408c8e5b11",
+    )
+    deadline: float | None = Field(
+        None,
+        title="Request deadline",
+        description=(
+            "Seconds the caller waits for the answer. "
+            "Calls to the camera are cancelled when they would end later."
+        ),
+        example=5.0,
+        gt=0,
+    )
+
+    def get_camera_key(self) -> str:
+        """Identify the camera independently of the credentials used to reach it"""
+        if self.bosch_security_url:
+            return self.bosch_security_url
+        if self.endpoint_reference and not self.host:
+            return self.endpoint_reference
+        return f"{self.host}:{self.port}"
+
+    def get_credentials_key(self) -> str:
+        """Fingerprint of the credentials, cached responses are only served to the same login"""
+        credentials = f"{self.user or ''}\0{self.password or ''}".encode()
+        return hashlib.sha256(credentials).hexdigest()[:32]
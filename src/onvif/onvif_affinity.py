@@ -0,0 +1,154 @@
+"""Consistent-hash assignment of cameras to the API instances which own them"""
+
+import hmac
+import bisect
+import hashlib
+from dataclasses import dataclass, field
+
+import httpx
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+
+DEFAULT_ONVIF_PORT = 80
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def normalize_camera_key(source: Source) -> str:
+    """Camera key which does not depend on the spelling of the host or an omitted port"""
+    if source.bosch_security_url:
+        return source.bosch_security_url.strip()
+    if source.endpoint_reference and not source.host:
+        return source.endpoint_reference.strip().lower()
+    host = (source.host or "").strip().lower().rstrip(".")
+    return f"{host}:{source.port or DEFAULT_ONVIF_PORT}"
+
+
+@dataclass
+class HashRing:
+    """
+    Ring of `replicas` virtual points per node. Adding or removing a node only moves the
+    cameras between that node and its ring neighbours, about 1/n of them.
+    """
+
+    replicas: int = 100
+    nodes: list[str] = field(default_factory=list)
+    _points: list[int] = field(default_factory=list, repr=False)
+    _owners: list[str] = field(default_factory=list, repr=False)
+
+    def __post_init__(self) -> None:
+        self.set_nodes(self.nodes)
+
+    def set_nodes(self, nodes: list[str]) -> None:
+        self.nodes = sorted(set(nodes))
+        ring = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(self.replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def get_node(self, key: str) -> str | None:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+@dataclass
+class AffinityNodes:
+    self_url: str | None
+    nodes: list[str]
+
+
+@dataclass
+class CameraOwner:
+    camera: str
+    owner: str | None
+    local: bool
+
+
+class CameraAffinity:
+    """
+    Owner of every camera among the configured API instances. Each instance is addressed by
+    its own base URL, e.g. one uvicorn process per port, so that requests can be forwarded
+    to a specific one and its sessions, caches and per-camera limits are reused.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.self_url: str | None = None
+        self.forward_timeout = 60.0
+        self.secret: str | None = None
+        self.ring = HashRing()
+        self._client: httpx.AsyncClient | None = None
+
+    def configure(self, settings: ONVIFSettings) -> None:
+        self.enabled = settings.affinity_enabled
+        self_url = settings.affinity_self_url
+        self.self_url = self_url.rstrip("/") if self_url else None
+        self.forward_timeout = settings.affinity_forward_timeout
+        self.secret = settings.affinity_secret
+        # Members come from the settings only, every instance must see the same ring
+        self.ring = HashRing(
+            replicas=settings.affinity_replicas,
+            nodes=[node.rstrip("/") for node in settings.affinity_nodes],
+        )
+
+    def get_owner(self, source: Source) -> str | None:
+        return self.ring.get_node(normalize_camera_key(source))
+
+    def get_nodes(self) -> AffinityNodes:
+        return AffinityNodes(self_url=self.self_url, nodes=self.ring.nodes)
+
+    def get_camera_owner(self, source: Source) -> CameraOwner:
+        owner = self.get_owner(source)
+        return CameraOwner(
+            camera=normalize_camera_key(source),
+            owner=owner,
+            local=self.get_forward_url(source) is None,
+        )
+
+    def get_forward_url(self, source: Source) -> str | None:
+        """Base URL of the owner of the camera, None when this instance serves it"""
+        if not self.enabled or not self.self_url:
+            return None
+        owner = self.get_owner(source)
+        return owner if owner and owner != self.self_url else None
+
+    def sign_forward(self, method: str, path: str) -> str:
+        """Forwarded header naming this instance, signed when a secret is configured"""
+        sender = self.self_url or ""
+        if not self.secret:
+            return sender
+        return f"{sender};sig={self._get_signature(sender, method, path)}"
+
+    def is_peer_forward(self, value: str, method: str, path: str) -> bool:
+        """Whether a forwarded header was sent by another instance of the ring"""
+        sender, _, signature = value.partition(";sig=")
+        if sender not in self.ring.nodes or sender == self.self_url:
+            return False
+        if not self.secret:
+            return True
+        return hmac.compare_digest(signature, self._get_signature(sender, method, path))
+
+    def _get_signature(self, sender: str, method: str, path: str) -> str:
+        message = f"{sender}\n{method}\n{path}".encode()
+        return hmac.new((self.secret or "").encode(), message, hashlib.sha256).hexdigest()
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.forward_timeout)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+
+camera_affinity = CameraAffinity()
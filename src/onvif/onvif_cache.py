@@ -0,0 +1,266 @@
+"""Cache for onvif responses, in-process or shared by the worker processes of one host"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import dataclasses
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Awaitable, Callable
+
+from pydantic import ValidationError, parse_obj_as
+
+from src.config import CommonSettings, ONVIFSettings
+from src.onvif.onvif_storage import get_private_path
+
+
+class CacheSection(Enum):
+    BOSCH_SECURITY_URL = "bosch_security.url"
+    MEDIA_PROFILES = "media.profiles"
+    MEDIA_SNAPSHOT_URI = "media.snapshot_uri"
+    MEDIA_STREAM_URI = "media.stream_uri"
+    MEDIA_VIDEO_ENCODER_OPTIONS = "media.video_encoder_options"
+    MEDIA2_VIDEO_ENCODER_CONFIGURATIONS = "media2.video_encoder_configurations"
+    MEDIA2_PROFILES = "media2.profiles"
+    MEDIA2_PROFILE_TOKENS = "media2.profile_tokens"
+    MEDIA2_STREAM_URI = "media2.stream_uri"
+    MEDIA2_VIDEO_ENCODER_OPTIONS = "media2.video_encoder_options"
+    IMAGING_OPTIONS = "imaging.options"
+    SEARCH_RECORDINGS = "search.recordings"
+
+
+# The first item of every key is the CacheSection the entry belongs to
+CacheKey = tuple[Any, ...]
+
+
+def with_credentials(key: CacheKey, credentials_key: str) -> CacheKey:
+    """
+    Key of a response fetched with the given credentials. A camera answers according to the
+    login, so a response must not be served to a request with other (or wrong) credentials.
+    """
+    return (key[0], credentials_key, *key[1:])
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: float
+
+    def is_expired(self, now: float) -> bool:
+        return now >= self.expires_at
+
+
+class OnvifCache:
+    """
+    Cached responses grouped per camera. Every entry key starts with a CacheSection,
+    so all entries of one section (e.g. every cached profile list) can be dropped at once
+    when the camera reports that the underlying configuration has changed.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, dict[CacheKey, CacheEntry]] = {}
+        self._event_backed: set[str] = set()
+
+    def get(self, camera_key: str, key: CacheKey) -> Any | None:
+        entries = self._entries.get(camera_key)
+        if not entries or not (entry := entries.get(key)):
+            return None
+        if entry.is_expired(time.monotonic()):
+            del entries[key]
+            return None
+        return entry.value
+
+    def set(self, camera_key: str, key: CacheKey, value: Any, ttl: float) -> None:
+        self._entries.setdefault(camera_key, {})[key] = CacheEntry(
+            value=value, expires_at=time.monotonic() + ttl
+        )
+
+    async def get_async(self, camera_key: str, key: CacheKey) -> Any | None:
+        """get for the event loop, backends which block do it in their own thread"""
+        return self.get(camera_key, key)
+
+    def set_soon(self, camera_key: str, key: CacheKey, value: Any, ttl: float) -> None:
+        """set for the event loop, backends which block do it later in their own thread"""
+        self.set(camera_key, key, value, ttl)
+
+    async def get_or_fetch(
+        self,
+        camera_key: str,
+        key: CacheKey,
+        fetch: Callable[[], Awaitable[Any]],
+        ttl: float | Callable[[Any], float],
+    ) -> Any:
+        """`ttl` may depend on the fetched value, a value with a ttl of 0 is not cached"""
+        if (value := await self.get_async(camera_key, key)) is not None:
+            return value
+        value = await fetch()
+        if (value_ttl := ttl(value) if callable(ttl) else ttl) > 0:
+            self.set_soon(camera_key, key, value, value_ttl)
+        return value
+
+    def invalidate(self, camera_key: str, *sections: CacheSection) -> None:
+        """Drop cached entries of the given sections, or every entry when no section is given"""
+        if not sections:
+            self._entries.pop(camera_key, None)
+            return
+        if entries := self._entries.get(camera_key):
+            for key in [key for key in entries if key[0] in sections]:
+                del entries[key]
+
+    def is_event_backed(self, camera_key: str) -> bool:
+        return camera_key in self._event_backed
+
+    def set_event_backed(self, camera_key: str, event_backed: bool) -> None:
+        if event_backed:
+            self._event_backed.add(camera_key)
+        else:
+            self._event_backed.discard(camera_key)
+
+
+def _to_json(value: Any) -> Any:
+    return value.value if isinstance(value, Enum) else str(value)
+
+
+def dump_value(value: Any) -> str:
+    """JSON of a cached value, a dataclass is stored with its type so that it can be rebuilt"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        value_type = type(value)
+        item = {
+            "type": f"{value_type.__module__}:{value_type.__qualname__}",
+            "value": dataclasses.asdict(value),
+        }
+        return json.dumps(item, default=_to_json)
+    return json.dumps({"value": value}, default=_to_json)
+
+
+def load_value(data: str) -> Any:
+    item = json.loads(data)
+    if not (name := item.get("type")):
+        return item["value"]
+    module, _, qualname = name.partition(":")
+    # Only dataclasses of this package which are already loaded, nothing is imported
+    value_type = (
+        getattr(sys.modules.get(module), qualname, None) if module.startswith("src.") else None
+    )
+    if not (isinstance(value_type, type) and dataclasses.is_dataclass(value_type)):
+        raise ValueError(f"Cached value of unknown type {name}")
+    return parse_obj_as(value_type, item["value"])
+
+
+class SqliteOnvifCache(OnvifCache):
+    """
+    OnvifCache stored in a SQLite database in WAL mode, so uvicorn workers on the same host
+    share cached responses instead of each asking the cameras. Values are stored as JSON,
+    expiry uses wall clock time because monotonic clocks are not comparable across processes.
+    Whether a camera is event backed stays per process, every worker runs its own watchers.
+    Database calls of the event loop run in a single thread, in the order they were made,
+    so an invalidation is never overtaken by a later read.
+    """
+
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        # Clients are created in worker threads and resolve urls through the cache there
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="onvif-cache")
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "camera TEXT NOT NULL, section TEXT NOT NULL, key TEXT NOT NULL, "
+            "value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (camera, section, key))"
+        )
+        self._connection.commit()
+        self._writes = 0
+
+    @staticmethod
+    def _split_key(key: CacheKey) -> tuple[str, str]:
+        return key[0].value, json.dumps(key[1:], default=str)
+
+    def _submit(self, func: Callable[..., Any], *args: Any) -> None:
+        """Run a write in the database thread without waiting for it"""
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(_log_write_error)
+
+    async def get_async(self, camera_key: str, key: CacheKey) -> Any | None:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.get, camera_key, key
+        )
+
+    def set_soon(self, camera_key: str, key: CacheKey, value: Any, ttl: float) -> None:
+        self._submit(self.set, camera_key, key, value, ttl)
+
+    def get(self, camera_key: str, key: CacheKey) -> Any | None:
+        section, item = self._split_key(key)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries "
+                "WHERE camera = ? AND section = ? AND key = ? AND expires_at > ?",
+                (camera_key, section, item, time.time()),
+            ).fetchone()
+        if not row:
+            return None
+        try:
+            return load_value(row[0])
+        except (ValueError, TypeError, ValidationError) as exc:
+            # Written by another version of the API, it is fetched again
+            logging.debug("Cached %s of %s cannot be loaded: %s", section, camera_key, exc)
+            return None
+
+    def set(self, camera_key: str, key: CacheKey, value: Any, ttl: float) -> None:
+        section, item = self._split_key(key)
+        try:
+            data = dump_value(value)
+        except (TypeError, ValueError) as exc:
+            logging.debug("%s of %s is not cached: %s", section, camera_key, exc)
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (camera_key, section, item, data, time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                self._connection.execute(
+                    "DELETE FROM entries WHERE expires_at <= ?", (time.time(),)
+                )
+
+    def invalidate(self, camera_key: str, *sections: CacheSection) -> None:
+        self._submit(self._invalidate, camera_key, *sections)
+
+    def _invalidate(self, camera_key: str, *sections: CacheSection) -> None:
+        with self._lock, self._connection:
+            if not sections:
+                self._connection.execute("DELETE FROM entries WHERE camera = ?", (camera_key,))
+                return
+            self._connection.executemany(
+                "DELETE FROM entries WHERE camera = ? AND section = ?",
+                [(camera_key, section.value) for section in sections],
+            )
+
+    def get_documents_path(self) -> str:
+        """Database of the remote documents imported by wsdl files, next to the responses"""
+        return f"{self.path}.documents"
+
+
+def _log_write_error(future: Future) -> None:
+    if exc := future.exception():
+        logging.warning("Writing the response cache failed: %r", exc)
+
+
+def create_cache(settings: ONVIFSettings) -> OnvifCache:
+    if settings.cache_backend == "sqlite":
+        return SqliteOnvifCache(get_private_path(settings, settings.cache_path))
+    return OnvifCache()
+
+
+response_cache = create_cache(CommonSettings().onvif_settings)
@@ -1,25 +1,51 @@
 """Base class for onvif clients"""
 
+import asyncio
 from abc import abstractmethod
 from dataclasses import dataclass
 from functools import wraps
+from typing import Any, Awaitable, Callable, TypeVar
 
 import httpx
 from httpx import ReadTimeout, ConnectTimeout  # we used httpx inside of zeep
 from zeep import Settings, AsyncClient
 from zeep.proxy import ServiceProxy, AsyncServiceProxy
-from zeep.wsse.username import UsernameToken
-from zeep.transports import AsyncTransport
+from zeep.cache import SqliteCache
 from zeep.exceptions import Fault
 
 from src.config import ONVIFSettings
 from src.model.source import Source
+from src.onvif.onvif_cache import (
+    CacheKey,
+    CacheSection,
+    SqliteOnvifCache,
+    response_cache,
+    with_credentials,
+)
+from src.onvif.onvif_clock import SkewedUsernameToken, clock_offsets
+from src.onvif.onvif_dns import DEFAULT_LIMITS, ResolvingHTTPTransport
+from src.onvif.onvif_envelopes import call_prerendered
+from src.onvif.onvif_health import camera_health
+from src.onvif.onvif_offload import OffloadingBinding, convert
+from src.onvif.onvif_registry import camera_registry
+from src.onvif.onvif_transport import (
+    BoundedAsyncTransport,
+    CachedDigestAuth,
+    ResponseTooLargeError,
+)
+
+
+# Token timestamps are in seconds, smaller differences cannot explain a rejected token
+CLOCK_OFFSET_TOLERANCE = 1.0
 
 
 @dataclass
 class OnvifClientSettings:
     source: Source
     common: ONVIFSettings
+    check_health: bool = True
+    # One-off runs such as the CLI do not record what they see in the metadata store
+    store_metadata: bool = True
 
 
 class CreateOnvifClientError(Exception):
@@ -34,19 +60,82 @@ class ReadTimeoutAsyncOnvifClientError(Exception):
     pass
 
 
+def is_auth_fault(fault: Fault) -> bool:
+    codes = " ".join(str(code) for code in [fault.code, *(fault.subcodes or [])])
+    return (
+        "NotAuthorized" in codes
+        or "FailedAuthentication" in codes
+        or "not authorized" in (fault.message or "").lower()
+    )
+
+
 def async_timeout_checker(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
+        client = args[0] if args and isinstance(args[0], OnvifClient) else None
         try:
-            return await func(*args, **kwargs)
+            # Tokens are created in the camera's time, measure it before the first of them
+            if client and client.source.user:
+                if clock_offsets.needs_refresh(client.source.get_camera_key()):
+                    await client.refresh_clock_offset()
+            try:
+                result = await func(*args, **kwargs)
+            except Fault as exc:
+                # A drifted camera clock makes the token look expired, measure it once more
+                if not (client and is_auth_fault(exc) and await client.refresh_clock_offset()):
+                    raise
+                result = await func(*args, **kwargs)
         except (ReadTimeout, ConnectTimeout) as exc:
             raise OnvifClientServiceError("ONVIF timeout error") from exc
+        except ResponseTooLargeError as exc:
+            raise OnvifClientServiceError(f"ONVIF response too large. Error: {exc}") from exc
         except Fault as exc:
+            if client:
+                # The camera answered, it only refused the request
+                camera_health.report_available(client.source.get_camera_key())
             raise OnvifClientServiceError(f"ONVIF unexpected Fault. Error: {exc.message}") from exc
+        if client:
+            camera_health.report_available(client.source.get_camera_key())
+        return result
 
     return wrapper
 
 
+async def gather_with_concurrency(limit: int, *coros):
+    """Like asyncio.gather(return_exceptions=True) but with at most `limit` running at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
+
+
+FleetResult = TypeVar("FleetResult")
+
+
+async def run_fleet(
+    sources: list[Source],
+    common: ONVIFSettings,
+    fetch: Callable[[OnvifClientSettings], Awaitable[FleetResult]],
+    on_error: Callable[[str, BaseException], FleetResult],
+) -> list[FleetResult]:
+    """
+    Result of `fetch` for every source, in the order of the sources, with at most
+    fleet_concurrency cameras at once. A failed camera does not fail the others,
+    its result is built by `on_error` from the camera key and the exception.
+    """
+    results = await gather_with_concurrency(
+        common.fleet_concurrency,
+        *(fetch(OnvifClientSettings(source=source, common=common)) for source in sources),
+    )
+    return [
+        on_error(source.get_camera_key(), result) if isinstance(result, BaseException) else result
+        for source, result in zip(sources, results)
+    ]
+
+
 def get_camera_url_for_bosch_security(url):
     response = httpx.post(url, verify=False, timeout=30)
     response.raise_for_status()
@@ -62,8 +151,13 @@ class AsyncZeepClientFix(AsyncClient):
     https://github.com/mvantellingen/python-zeep/issues/1288
     Currently this project has no solution for this issue but it's doesn't merged yet.
     So we need to use this workaround.
+    Responses above `offload_threshold` bytes are parsed in a worker thread.
     """
 
+    def __init__(self, *args, offload_threshold: int | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.offload_threshold = offload_threshold
+
     def create_service(self, binding_name: str, address: str) -> AsyncServiceProxy:
         """Create a new AsyncServiceProxy for the given binding name and address.
 
@@ -78,7 +172,7 @@ class AsyncZeepClientFix(AsyncClient):
                 f"No binding found with the given QName. Available bindings "
                 f"are: {', '.join(self.wsdl.bindings.keys())}"
             ) from exc
-        return AsyncServiceProxy(self, binding, address=address)
+        return AsyncServiceProxy(self, OffloadingBinding(binding), address=address)
 
 
 class OnvifClient:  # pylint: disable=too-few-public-methods
@@ -87,34 +181,167 @@ class OnvifClient:  # pylint: disable=too-few-public-methods
     def __init__(self, settings: OnvifClientSettings) -> None:
         self.source: Source = settings.source
         self.common: ONVIFSettings = settings.common
+        self.store_metadata = settings.store_metadata
+        if settings.check_health:
+            camera_health.check_available(
+                self.source.get_camera_key(), self.common.health_probe_after
+            )
+        self.client: AsyncClient | None = None
         self.service: ServiceProxy | None = self._get_service()
 
+    @classmethod
+    async def create_async(cls, settings: OnvifClientSettings):
+        """Create the client in a worker thread, wsdl parsing would block the event loop"""
+        # cls is a concrete subclass here, mypy cannot tell and rejects passing it directly
+        return await asyncio.to_thread(lambda: cls(settings))
+
     def _get_service(self) -> AsyncServiceProxy | None:
         if client := self._create_client():
+            self.client = client
             return client.create_service(self.BINDING_NAME, self._get_service_url())
         raise CreateOnvifClientError("We couldn't create onvif client")
 
     def _create_client(self) -> AsyncClient:
         return AsyncZeepClientFix(
             wsdl=self._get_wsdl_path(),
-            wsse=UsernameToken(self.source.user or "", self.source.password or "", use_digest=True),
-            settings=Settings(xml_huge_tree=True, raw_response=False, strict=False),
-            transport=AsyncTransport(
-                timeout=self.common.timeout,
-                operation_timeout=self.common.operation_timeout,
-                verify_ssl=self.common.verify_ssl,
+            wsse=(
+                SkewedUsernameToken(
+                    self.source.get_camera_key(), self.source.user, self.source.password or ""
+                )
+                if self.source.user
+                else None
             ),
+            # Replies come back raw and are parsed by OffloadingBinding
+            settings=Settings(xml_huge_tree=True, raw_response=True, strict=False),
+            transport=self._create_transport(),
+            offload_threshold=self.common.parse_offload_threshold,
+        )
+
+    def _create_transport(self, **client_kwargs) -> BoundedAsyncTransport:
+        return BoundedAsyncTransport(
+            camera_key=self.source.get_camera_key(),
+            max_response_size=self.common.max_response_size,
+            max_response_sizes=self.common.max_response_sizes,
+            client=self._create_http_client(**client_kwargs),
+            cache=self._create_document_cache(),
+            timeout=self.common.timeout,
+            operation_timeout=self.common.operation_timeout,
+            verify_ssl=self.common.verify_ssl,
+        )
+
+    def _create_http_client(
+        self, limits: httpx.Limits = DEFAULT_LIMITS, **kwargs
+    ) -> httpx.AsyncClient:
+        """
+        Client for the operations, with HTTP Digest for cameras that require it and host names
+        resolved through the shared DNS cache
+        """
+        auth = (
+            CachedDigestAuth(
+                self.source.get_camera_key(), self.source.user, self.source.password or ""
+            )
+            if self.common.http_digest and self.source.user
+            else None
+        )
+        transport = ResolvingHTTPTransport(
+            self.common.dns_cache_ttl,
+            self.common.dns_negative_ttl,
+            verify=self.common.verify_ssl,
+            limits=limits,
+        )
+        return httpx.AsyncClient(
+            auth=auth,
+            transport=transport,
+            timeout=self.common.operation_timeout,
+            **kwargs,
         )
 
     def _get_base_url(self):
         if self.source.bosch_security_url:
-            return get_camera_url_for_bosch_security(self.source.bosch_security_url)
+            return self._get_bosch_security_base_url()
+        if self.source.endpoint_reference and not self.source.host:
+            return camera_registry.get_base_url(self.source.endpoint_reference)
         return f"http://{self.source.host}:{self.source.port}"
 
+    def _create_document_cache(self) -> SqliteCache | None:
+        """
+        Remote documents imported by the wsdl files are fetched once per host and shared by
+        the workers. Parsed wsdl objects cannot be shared between processes.
+        """
+        # The response cache is created from the application settings, not the request ones
+        if not isinstance(response_cache, SqliteOnvifCache):
+            return None
+        return SqliteCache(path=response_cache.get_documents_path(), timeout=None)
+
+    def _get_bosch_security_base_url(self) -> str:
+        camera_key, key = self.source.get_camera_key(), (CacheSection.BOSCH_SECURITY_URL,)
+        if (url := response_cache.get(camera_key, key)) is None:
+            url = get_camera_url_for_bosch_security(self.source.bosch_security_url)
+            response_cache.set(camera_key, key, url, self.common.bosch_url_ttl)
+        return url
+
+    async def refresh_clock_offset(self) -> bool:
+        """Measure the camera clock again, True when the corrected time has changed"""
+        # Imported here, the device client is itself an OnvifClient
+        from src.onvif.onvif_client_device import (  # pylint: disable=import-outside-toplevel
+            measure_clock_offset,
+        )
+
+        if not self.source.user:
+            return False
+        camera_key = self.source.get_camera_key()
+        previous = clock_offsets.get(camera_key) or 0.0
+        offset = await clock_offsets.measure(
+            camera_key,
+            lambda: measure_clock_offset(
+                OnvifClientSettings(source=self.source, common=self.common)
+            ),
+            self.common.clock_offset_ttl,
+        )
+        return offset is not None and abs(offset - previous) >= CLOCK_OFFSET_TOLERANCE
+
+    async def _call_prerendered(self, operation: str) -> Any:
+        """Call an operation without arguments, reusing its serialized request envelope"""
+        self._check_service()
+        return await call_prerendered(
+            self.client, self.service, self._get_wsdl_path(), operation  # type: ignore
+        )
+
+    async def _convert(self, create, obj):
+        """Convert a response into dataclasses, off the event loop when the response was large"""
+        return await convert(self.client, create, obj)  # type: ignore
+
+    async def close(self) -> None:
+        if self.client:
+            await self.client.transport.aclose()
+
     def _check_service(self):
         if not self.service:
             raise OnvifClientServiceError("Service doesn't initialized")
 
+    async def _cached(
+        self,
+        key: CacheKey,
+        fetch,
+        ttl: float | None = None,
+        get_ttl: Callable[[Any, float], float] | None = None,
+    ):
+        """`get_ttl` shortens the ttl of a fetched value which is valid for less time"""
+        camera_key = self.source.get_camera_key()
+        if ttl is None:
+            ttl = (
+                self.common.cache_ttl_with_events
+                if response_cache.is_event_backed(camera_key)
+                else self.common.cache_ttl
+            )
+        key = with_credentials(key, self.source.get_credentials_key())
+        if get_ttl:
+            value_ttl, default_ttl = get_ttl, ttl
+            return await response_cache.get_or_fetch(
+                camera_key, key, fetch, lambda value: value_ttl(value, default_ttl)
+            )
+        return await response_cache.get_or_fetch(camera_key, key, fetch, ttl)
+
     @abstractmethod
     def _get_service_url(self):
         pass
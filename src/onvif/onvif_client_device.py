@@ -1,8 +1,12 @@
 import os
-from dataclasses import dataclass
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
 from typing import Any
 
-from src.onvif.onvif_client import OnvifClient, async_timeout_checker
+from src.onvif.onvif_client import OnvifClient, OnvifClientSettings, async_timeout_checker
+from src.onvif.onvif_metadata_store import ServiceSummary, metadata_store
+from src.onvif.onvif_transport import camera_models
 
 
 @dataclass
@@ -70,12 +74,27 @@ class SystemDateTime:
         return SystemDateTime(
             date_time_type=obj["DateTimeType"],
             daylight_savings=obj["DaylightSavings"],
-            time_zone=obj["TimeZone"]["TZ"],
+            time_zone=obj["TimeZone"]["TZ"] if obj["TimeZone"] else None,
             utc_date_time=DateTime.create(obj["UTCDateTime"]) if obj["UTCDateTime"] else None,
             local_date_time=DateTime.create(obj["LocalDateTime"]) if obj["LocalDateTime"] else None,
             extension=obj["Extension"],
         )
 
+    def get_clock_offset(self, local_time: float) -> float | None:
+        """Seconds the camera UTC clock is ahead of `local_time` (a unix timestamp)"""
+        if not (utc := self.utc_date_time):
+            return None
+        camera_time = datetime(
+            utc.date.year,
+            utc.date.month,
+            utc.date.day,
+            utc.time.hour,
+            utc.time.minute,
+            utc.time.second,
+            tzinfo=timezone.utc,
+        )
+        return camera_time.timestamp() - local_time
+
 
 @dataclass
 class SystemLog:
@@ -104,6 +123,36 @@ class SystemUris:
         )
 
 
+@dataclass
+class Service:
+    namespace: str
+    xaddr: str
+    version: str
+
+    @staticmethod
+    def create(obj: Any) -> "Service":
+        return Service(
+            namespace=obj["Namespace"],
+            xaddr=obj["XAddr"],
+            version=f"{obj['Version']['Major']}.{obj['Version']['Minor']:02d}",
+        )
+
+
+@dataclass
+class Services:
+    services: list[Service]
+
+    @staticmethod
+    def create(obj: Any) -> "Services":
+        return Services(services=[Service.create(service) for service in obj])
+
+    def get_service_summaries(self) -> list[ServiceSummary]:
+        return [
+            ServiceSummary(service.namespace, service.xaddr, service.version)
+            for service in self.services
+        ]
+
+
 class OnvifClientDevice(OnvifClient):  # pylint: disable=too-few-public-methods
     BINDING_NAME = "{http://www.onvif.org/ver10/device/wsdl}DeviceBinding"
 
@@ -116,18 +165,53 @@ class OnvifClientDevice(OnvifClient):  # pylint: disable=too-few-public-methods
     @async_timeout_checker
     async def get_device_information(self) -> DeviceInformation:
         self._check_service()
-        resp = await self.service.GetDeviceInformation()  # type: ignore
-        return DeviceInformation.create(resp)
+        resp = await self._call_prerendered("GetDeviceInformation")
+        information = DeviceInformation.create(resp)
+        camera_models.set(self.source.get_camera_key(), information.model)
+        if metadata_store and self.store_metadata:
+            metadata_store.update_device_information(
+                self.source.get_camera_key(), asdict(information)
+            )
+        return information
 
     @async_timeout_checker
     async def get_system_date_and_time(self) -> SystemDateTime:
         self._check_service()
-        resp = await self.service.GetSystemDateAndTime()  # type: ignore
+        resp = await self._call_prerendered("GetSystemDateAndTime")
         return SystemDateTime.create(resp)
 
     @async_timeout_checker
     async def get_system_uris(self) -> SystemUris:
         self._check_service()
-        resp = await self.service.GetSystemUris()  # type: ignore
+        resp = await self._call_prerendered("GetSystemUris")
         sys_uris = SystemUris.create(resp)
         return sys_uris
+
+    @async_timeout_checker
+    async def get_services(self) -> Services:
+        self._check_service()
+        resp = await self.service.GetServices(IncludeCapability=False)  # type: ignore
+        services = Services.create(resp)
+        if metadata_store and self.store_metadata:
+            metadata_store.update_services(
+                self.source.get_camera_key(), services.get_service_summaries()
+            )
+        return services
+
+
+async def measure_clock_offset(settings: OnvifClientSettings) -> float | None:
+    """
+    Offset of the camera clock. GetSystemDateAndTime must be answered without
+    authentication, so no token is sent which the skewed clock could make invalid.
+    """
+    source = settings.source.copy(update={"user": None, "password": None})
+    client = await OnvifClientDevice.create_async(
+        OnvifClientSettings(source=source, common=settings.common, check_health=False)
+    )
+    try:
+        started = time.time()
+        date_time = await client.get_system_date_and_time()
+    finally:
+        await client.close()
+    # The camera read its clock somewhere during the round trip, assume the middle
+    return date_time.get_clock_offset((started + time.time()) / 2)
@@ -0,0 +1,246 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any
+
+from lxml import etree
+from zeep.proxy import AsyncServiceProxy
+
+from src.onvif.onvif_cache import CacheSection, response_cache
+from src.onvif.onvif_client import (
+    OnvifClient,
+    OnvifClientSettings,
+    OnvifClientServiceError,
+    async_timeout_checker,
+)
+from src.onvif.onvif_deadline import create_background_task
+
+PROFILE_CHANGED_TOPIC = "Media/ProfileChanged"
+CONFIGURATION_CHANGED_TOPIC = "Media/ConfigurationChanged"
+CONFIGURATION_TOPICS = {PROFILE_CHANGED_TOPIC, CONFIGURATION_CHANGED_TOPIC}
+
+PROFILE_SECTIONS = (
+    CacheSection.MEDIA_PROFILES,
+    CacheSection.MEDIA_SNAPSHOT_URI,
+    CacheSection.MEDIA_STREAM_URI,
+    CacheSection.MEDIA2_PROFILES,
+    CacheSection.MEDIA2_PROFILE_TOKENS,
+    CacheSection.MEDIA2_STREAM_URI,
+)
+
+# ConfigurationChanged carries the configuration type in its "Type" source item.
+# Every configuration is embedded in the profiles, so profiles are always invalidated.
+CONFIGURATION_TYPE_SECTIONS: dict[str, tuple[CacheSection, ...]] = {
+    "VideoEncoder": (
+        CacheSection.MEDIA_PROFILES,
+        CacheSection.MEDIA2_PROFILES,
+        CacheSection.MEDIA2_VIDEO_ENCODER_CONFIGURATIONS,
+    ),
+}
+
+
+def _is_element(obj: Any) -> bool:
+    # comments and processing instructions have a non-string tag
+    return isinstance(obj, etree._Element) and isinstance(obj.tag, str)  # pylint: disable=W0212
+
+
+def _collect_topics(elements: Any, prefix: str = "") -> set[str]:
+    topics = set()
+    for element in elements or []:
+        if not _is_element(element):
+            continue
+        name = f"{prefix}{etree.QName(element).localname}"
+        topics.add(name)
+        topics |= _collect_topics(element, f"{name}/")
+    return topics
+
+
+def _get_simple_items(item_list: Any) -> dict[str, str]:
+    if item_list is None:
+        return {}
+    if _is_element(item_list):
+        return {
+            element.get("Name"): element.get("Value")
+            for element in item_list.iter()
+            if _is_element(element) and etree.QName(element).localname == "SimpleItem"
+        }
+    return {item["Name"]: item["Value"] for item in item_list["SimpleItem"] or []}
+
+
+def _get_message_part(message: Any, name: str) -> Any:
+    if _is_element(message):
+        parts = [element for element in message if _is_element(element)]
+        return next((part for part in parts if etree.QName(part).localname == name), None)
+    return message[name]
+
+
+@dataclass
+class NotificationMessage:
+    topic: str
+    source: dict[str, str] = field(default_factory=dict)
+    data: dict[str, str] = field(default_factory=dict)
+
+    @staticmethod
+    def create(obj: Any) -> "NotificationMessage":
+        # Topic looks like "tns1:Media/ConfigurationChanged", the prefix is irrelevant for us
+        topic = str(obj["Topic"]["_value_1"]).strip()
+        message = obj["Message"]["_value_1"]
+        return NotificationMessage(
+            topic=topic.split(":", 1)[-1],
+            source=_get_simple_items(_get_message_part(message, "Source")),
+            data=_get_simple_items(_get_message_part(message, "Data")),
+        )
+
+
+@dataclass
+class PullPointSubscription:
+    address: str
+    pull_point: AsyncServiceProxy
+    manager: AsyncServiceProxy
+
+
+class OnvifClientEvents(OnvifClient):  # pylint: disable=too-few-public-methods
+    BINDING_NAME = "{http://www.onvif.org/ver10/events/wsdl}EventBinding"
+    PULL_POINT_BINDING_NAME = "{http://www.onvif.org/ver10/events/wsdl}PullPointSubscriptionBinding"
+    SUBSCRIPTION_MANAGER_BINDING_NAME = (
+        "{http://www.onvif.org/ver10/events/wsdl}SubscriptionManagerBinding"
+    )
+
+    def _get_service_url(self):
+        return f"{self._get_base_url()}/onvif/event_service"
+
+    def _get_wsdl_path(self):
+        return os.path.join(self.common.wsdl_path, "ver10/events/wsdl/event.wsdl")
+
+    @async_timeout_checker
+    async def get_event_topics(self) -> set[str]:
+        self._check_service()
+        resp = await self._call_prerendered("GetEventProperties")
+        return _collect_topics(resp["TopicSet"]["_value_1"] if resp["TopicSet"] else None)
+
+    @async_timeout_checker
+    async def create_pull_point_subscription(self, termination: int) -> PullPointSubscription:
+        self._check_service()
+        resp = await self.service.CreatePullPointSubscription(  # type: ignore
+            InitialTerminationTime=f"PT{termination}S"
+        )
+        address = resp["SubscriptionReference"]["Address"]["_value_1"]
+        return PullPointSubscription(
+            address=address,
+            pull_point=self.client.create_service(  # type: ignore
+                self.PULL_POINT_BINDING_NAME, address
+            ),
+            manager=self.client.create_service(  # type: ignore
+                self.SUBSCRIPTION_MANAGER_BINDING_NAME, address
+            ),
+        )
+
+    @async_timeout_checker
+    async def pull_messages(
+        self, subscription: PullPointSubscription, timeout: int, limit: int = 100
+    ) -> list[NotificationMessage]:
+        resp = await subscription.pull_point.PullMessages(
+            Timeout=timedelta(seconds=timeout), MessageLimit=limit
+        )
+        messages = resp["NotificationMessage"] or []
+        return [NotificationMessage.create(message) for message in messages]
+
+    @async_timeout_checker
+    async def renew(self, subscription: PullPointSubscription, termination: int) -> None:
+        await subscription.manager.Renew(TerminationTime=f"PT{termination}S")
+
+    @async_timeout_checker
+    async def unsubscribe(self, subscription: PullPointSubscription) -> None:
+        await subscription.pull_point.Unsubscribe()
+
+
+def get_invalidated_sections(message: NotificationMessage) -> tuple[CacheSection, ...]:
+    if message.topic == PROFILE_CHANGED_TOPIC:
+        return PROFILE_SECTIONS
+    if message.topic == CONFIGURATION_CHANGED_TOPIC:
+        return CONFIGURATION_TYPE_SECTIONS.get(
+            message.source.get("Type", ""),
+            (CacheSection.MEDIA_PROFILES, CacheSection.MEDIA2_PROFILES),
+        )
+    return ()
+
+
+class OnvifEventWatcher:
+    """
+    Keeps a pull point subscription open on one camera and invalidates the cached
+    sections affected by configuration-change notifications. While the subscription is
+    alive the camera is marked as event backed, so its responses are cached with
+    the longer cache_ttl_with_events instead of the plain cache_ttl.
+    """
+
+    def __init__(self, settings: OnvifClientSettings) -> None:
+        self.settings = settings
+        self.camera_key = settings.source.get_camera_key()
+
+    async def run(self) -> None:
+        common = self.settings.common
+        client = await OnvifClientEvents.create_async(self.settings)
+        if not await client.get_event_topics() & CONFIGURATION_TOPICS:
+            logging.info("Camera %s has no configuration change events", self.camera_key)
+            return
+        subscription = await client.create_pull_point_subscription(common.events_subscription_time)
+        pull_timeout = min(common.events_pull_timeout, common.operation_timeout // 2)
+        renew_interval = common.events_subscription_time / 2
+        # Anything cached before the subscription existed could have missed a notification
+        response_cache.invalidate(self.camera_key)
+        response_cache.set_event_backed(self.camera_key, True)
+        try:
+            renew_at = time.monotonic() + renew_interval
+            while True:
+                for message in await client.pull_messages(subscription, pull_timeout):
+                    if sections := get_invalidated_sections(message):
+                        logging.info("Camera %s: %s", self.camera_key, message.topic)
+                        response_cache.invalidate(self.camera_key, *sections)
+                if time.monotonic() >= renew_at:
+                    await client.renew(subscription, common.events_subscription_time)
+                    renew_at = time.monotonic() + renew_interval
+        finally:
+            response_cache.set_event_backed(self.camera_key, False)
+            response_cache.invalidate(self.camera_key)
+            try:
+                await client.unsubscribe(subscription)
+            except (OnvifClientServiceError, OSError) as exc:
+                logging.debug("Unsubscribe for %s failed: %s", self.camera_key, exc)
+
+
+class OnvifEventWatchers:
+    def __init__(self) -> None:
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._retry_after: dict[str, float] = {}
+
+    def watch(self, settings: OnvifClientSettings) -> None:
+        """Start watching the camera unless it is already watched or recently failed"""
+        if not settings.common.events_enabled:
+            return
+        camera_key = settings.source.get_camera_key()
+        now = time.monotonic()
+        if camera_key in self._tasks or now < self._retry_after.get(camera_key, 0):
+            return
+        self._retry_after[camera_key] = now + settings.common.events_retry_interval
+        task = create_background_task(self._run(OnvifEventWatcher(settings)))
+        self._tasks[camera_key] = task
+
+    async def _run(self, watcher: OnvifEventWatcher) -> None:
+        try:
+            await watcher.run()
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Event subscription for %s stopped: %s", watcher.camera_key, exc)
+        finally:
+            self._tasks.pop(watcher.camera_key, None)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+event_watchers = OnvifEventWatchers()
@@ -0,0 +1,348 @@
+import os
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any
+
+from zeep.exceptions import Fault
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_cache import CacheSection
+from src.onvif.onvif_client import (
+    OnvifClient,
+    OnvifClientServiceError,
+    OnvifClientSettings,
+    async_timeout_checker,
+    run_fleet,
+)
+from src.onvif.onvif_client_media import OnvifClientMedia
+from src.onvif.onvif_encoder_options import FloatRange
+
+
+@dataclass
+class ModeLevel:
+    mode: str
+    level: float | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ModeLevel":
+        return ModeLevel(mode=obj["Mode"], level=obj["Level"])
+
+
+@dataclass
+class Exposure:
+    mode: str
+    priority: str | None = None
+    min_exposure_time: float | None = None
+    max_exposure_time: float | None = None
+    min_gain: float | None = None
+    max_gain: float | None = None
+    min_iris: float | None = None
+    max_iris: float | None = None
+    exposure_time: float | None = None
+    gain: float | None = None
+    iris: float | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Exposure":
+        return Exposure(
+            mode=obj["Mode"],
+            priority=obj["Priority"],
+            min_exposure_time=obj["MinExposureTime"],
+            max_exposure_time=obj["MaxExposureTime"],
+            min_gain=obj["MinGain"],
+            max_gain=obj["MaxGain"],
+            min_iris=obj["MinIris"],
+            max_iris=obj["MaxIris"],
+            exposure_time=obj["ExposureTime"],
+            gain=obj["Gain"],
+            iris=obj["Iris"],
+        )
+
+
+@dataclass
+class FocusConfiguration:
+    auto_focus_mode: str
+    default_speed: float | None = None
+    near_limit: float | None = None
+    far_limit: float | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "FocusConfiguration":
+        return FocusConfiguration(
+            auto_focus_mode=obj["AutoFocusMode"],
+            default_speed=obj["DefaultSpeed"],
+            near_limit=obj["NearLimit"],
+            far_limit=obj["FarLimit"],
+        )
+
+
+@dataclass
+class WhiteBalance:
+    mode: str
+    cr_gain: float | None = None
+    cb_gain: float | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "WhiteBalance":
+        return WhiteBalance(mode=obj["Mode"], cr_gain=obj["CrGain"], cb_gain=obj["CbGain"])
+
+
+@dataclass
+class ImagingSettings:
+    brightness: float | None = None
+    color_saturation: float | None = None
+    contrast: float | None = None
+    sharpness: float | None = None
+    ir_cut_filter: str | None = None
+    backlight_compensation: ModeLevel | None = None
+    wide_dynamic_range: ModeLevel | None = None
+    white_balance: WhiteBalance | None = None
+    exposure: Exposure | None = None
+    focus: FocusConfiguration | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ImagingSettings":
+        return ImagingSettings(
+            brightness=obj["Brightness"],
+            color_saturation=obj["ColorSaturation"],
+            contrast=obj["Contrast"],
+            sharpness=obj["Sharpness"],
+            ir_cut_filter=obj["IrCutFilter"],
+            backlight_compensation=(
+                ModeLevel.create(obj["BacklightCompensation"])
+                if obj["BacklightCompensation"]
+                else None
+            ),
+            wide_dynamic_range=(
+                ModeLevel.create(obj["WideDynamicRange"]) if obj["WideDynamicRange"] else None
+            ),
+            white_balance=WhiteBalance.create(obj["WhiteBalance"]) if obj["WhiteBalance"] else None,
+            exposure=Exposure.create(obj["Exposure"]) if obj["Exposure"] else None,
+            focus=FocusConfiguration.create(obj["Focus"]) if obj["Focus"] else None,
+        )
+
+
+def _float_range(obj: Any) -> FloatRange | None:
+    return FloatRange.create(obj) if obj else None
+
+
+@dataclass
+class ModeLevelOptions:
+    modes: list[str] = field(default_factory=list)
+    level: FloatRange | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ModeLevelOptions":
+        return ModeLevelOptions(modes=list(obj["Mode"] or []), level=_float_range(obj["Level"]))
+
+
+@dataclass
+class ExposureOptions:
+    modes: list[str] = field(default_factory=list)
+    priorities: list[str] = field(default_factory=list)
+    exposure_time: FloatRange | None = None
+    gain: FloatRange | None = None
+    iris: FloatRange | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ExposureOptions":
+        return ExposureOptions(
+            modes=list(obj["Mode"] or []),
+            priorities=list(obj["Priority"] or []),
+            exposure_time=_float_range(obj["ExposureTime"]),
+            gain=_float_range(obj["Gain"]),
+            iris=_float_range(obj["Iris"]),
+        )
+
+
+@dataclass
+class FocusOptions:
+    auto_focus_modes: list[str] = field(default_factory=list)
+    default_speed: FloatRange | None = None
+    near_limit: FloatRange | None = None
+    far_limit: FloatRange | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "FocusOptions":
+        return FocusOptions(
+            auto_focus_modes=list(obj["AutoFocusModes"] or []),
+            default_speed=_float_range(obj["DefaultSpeed"]),
+            near_limit=_float_range(obj["NearLimit"]),
+            far_limit=_float_range(obj["FarLimit"]),
+        )
+
+
+@dataclass
+class ImagingOptions:
+    brightness: FloatRange | None = None
+    color_saturation: FloatRange | None = None
+    contrast: FloatRange | None = None
+    sharpness: FloatRange | None = None
+    ir_cut_filter_modes: list[str] = field(default_factory=list)
+    backlight_compensation: ModeLevelOptions | None = None
+    wide_dynamic_range: ModeLevelOptions | None = None
+    white_balance_modes: list[str] = field(default_factory=list)
+    exposure: ExposureOptions | None = None
+    focus: FocusOptions | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ImagingOptions":
+        return ImagingOptions(
+            brightness=_float_range(obj["Brightness"]),
+            color_saturation=_float_range(obj["ColorSaturation"]),
+            contrast=_float_range(obj["Contrast"]),
+            sharpness=_float_range(obj["Sharpness"]),
+            ir_cut_filter_modes=list(obj["IrCutFilterModes"] or []),
+            backlight_compensation=(
+                ModeLevelOptions.create(obj["BacklightCompensation"])
+                if obj["BacklightCompensation"]
+                else None
+            ),
+            wide_dynamic_range=(
+                ModeLevelOptions.create(obj["WideDynamicRange"])
+                if obj["WideDynamicRange"]
+                else None
+            ),
+            white_balance_modes=(
+                list(obj["WhiteBalance"]["Mode"] or []) if obj["WhiteBalance"] else []
+            ),
+            exposure=ExposureOptions.create(obj["Exposure"]) if obj["Exposure"] else None,
+            focus=FocusOptions.create(obj["Focus"]) if obj["Focus"] else None,
+        )
+
+
+@dataclass
+class ImagingStatus:
+    focus_position: float | None = None
+    focus_move_status: str | None = None
+    focus_error: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "ImagingStatus":
+        if not (focus := obj["FocusStatus20"]):
+            return ImagingStatus()
+        return ImagingStatus(
+            focus_position=focus["Position"],
+            focus_move_status=focus["MoveStatus"],
+            focus_error=focus["Error"],
+        )
+
+
+@dataclass
+class VideoSourceImaging:
+    video_source_token: str
+    settings: ImagingSettings | None = None
+    options: ImagingOptions | None = None
+    status: ImagingStatus | None = None
+
+
+@dataclass
+class CameraImaging:
+    camera: str
+    video_sources: list[VideoSourceImaging] = field(default_factory=list)
+    error: str | None = None
+
+
+class OnvifClientImaging(OnvifClient):  # pylint: disable=too-few-public-methods
+    BINDING_NAME = "{http://www.onvif.org/ver20/imaging/wsdl}ImagingBinding"
+
+    def _get_service_url(self):
+        return f"{self._get_base_url()}/onvif/imaging_service"
+
+    def _get_wsdl_path(self):
+        return os.path.join(self.common.wsdl_path, "ver20/imaging/wsdl/imaging.wsdl")
+
+    @async_timeout_checker
+    async def get_imaging_settings(self, video_source_token: str) -> ImagingSettings:
+        self._check_service()
+        resp = await self.service.GetImagingSettings(  # type: ignore
+            VideoSourceToken=video_source_token
+        )
+        return ImagingSettings.create(resp)
+
+    @async_timeout_checker
+    async def get_options(self, video_source_token: str) -> ImagingOptions:
+        self._check_service()
+
+        async def fetch() -> ImagingOptions:
+            resp = await self.service.GetOptions(  # type: ignore
+                VideoSourceToken=video_source_token
+            )
+            return ImagingOptions.create(resp)
+
+        # Options describe what the sensor supports, they practically never change
+        return await self._cached(
+            (CacheSection.IMAGING_OPTIONS, video_source_token),
+            fetch,
+            ttl=self.common.imaging_options_ttl,
+        )
+
+    @async_timeout_checker
+    async def get_status(self, video_source_token: str) -> ImagingStatus:
+        self._check_service()
+        resp = await self.service.GetStatus(VideoSourceToken=video_source_token)  # type: ignore
+        return ImagingStatus.create(resp)
+
+    async def get_video_source_tokens(self) -> list[str]:
+        media = await OnvifClientMedia.create_async(
+            OnvifClientSettings(
+                source=self.source, common=self.common, store_metadata=self.store_metadata
+            )
+        )
+        try:
+            profiles = await media.get_profiles()
+        finally:
+            await media.close()
+        tokens = [
+            profile.video_source_configuration.source_token
+            for profile in profiles.profiles
+            if profile.video_source_configuration
+        ]
+        return list(dict.fromkeys(tokens))
+
+    async def _get_optional_status(self, video_source_token: str) -> ImagingStatus | None:
+        try:
+            return await self.get_status(video_source_token)
+        except OnvifClientServiceError as exc:
+            # GetStatus is optional, cameras without focus control refuse it
+            if isinstance(exc.__cause__, Fault):
+                return None
+            raise
+
+    async def get_video_source_imaging(self, video_source_token: str) -> VideoSourceImaging:
+        settings, options, status = await asyncio.gather(
+            self.get_imaging_settings(video_source_token),
+            self.get_options(video_source_token),
+            self._get_optional_status(video_source_token),
+        )
+        return VideoSourceImaging(
+            video_source_token=video_source_token,
+            settings=settings,
+            options=options,
+            status=status,
+        )
+
+    async def get_video_sources_imaging(self) -> CameraImaging:
+        tokens = await self.get_video_source_tokens()
+        video_sources = await asyncio.gather(
+            *(self.get_video_source_imaging(token) for token in tokens)
+        )
+        return CameraImaging(camera=self.source.get_camera_key(), video_sources=video_sources)
+
+
+async def _get_camera_imaging(settings: OnvifClientSettings) -> CameraImaging:
+    client = await OnvifClientImaging.create_async(settings)
+    try:
+        return await client.get_video_sources_imaging()
+    finally:
+        await client.close()
+
+
+async def get_fleet_imaging(sources: list[Source], common: ONVIFSettings) -> list[CameraImaging]:
+    return await run_fleet(
+        sources,
+        common,
+        _get_camera_imaging,
+        lambda camera, exc: CameraImaging(camera=camera, error=str(exc)),
+    )
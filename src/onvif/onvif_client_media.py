@@ -1,9 +1,26 @@
 import os
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import Any
 
-from src.onvif.onvif_client import OnvifClient, async_timeout_checker
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_cache import CacheSection, response_cache
+from src.onvif.onvif_client import (
+    OnvifClient,
+    OnvifClientSettings,
+    async_timeout_checker,
+    run_fleet,
+)
+from src.onvif.onvif_client_events import event_watchers
+from src.onvif.onvif_client_ptz import PTZConfiguration
+from src.onvif.onvif_encoder_options import (
+    MEDIA_ENCODER_LAYOUT,
+    VideoEncoderOptions,
+    VideoResolution,
+)
+from src.onvif.onvif_metadata_store import EncoderSummary, ProfileSummary, metadata_store
 
 
 @dataclass
@@ -66,35 +83,12 @@ class IPType(Enum):
     IPV6 = "IPv6"
 
 
-class EFlipMode(Enum):
-    OFF = "OFF"
-    ON = "ON"
-    EXTENDED = "Extended"
-
-
-class ReverseMode(Enum):
-    OFF = "OFF"
-    ON = "ON"
-    AUTO = "AUTO"
-    EXTENDED = "Extended"
-
-
 class AudioEncoding(Enum):
     G711 = "G711"
     G726 = "G726"
     AAC = "AAC"
 
 
-@dataclass
-class VideoResolution:
-    width: int
-    height: int
-
-    @staticmethod
-    def create(obj: Any) -> "VideoResolution":
-        return VideoResolution(width=obj["Width"], height=obj["Height"])
-
-
 @dataclass
 class Rotate:
     mode: RotateMode | None = None
@@ -483,173 +477,6 @@ class VideoAnalyticsConfiguration:
         )
 
 
-@dataclass
-class PTZSpeed:
-    pan_tilt: float
-    zoom: float
-
-    @staticmethod
-    def create(obj: Any) -> "PTZSpeed":
-        return PTZSpeed(pan_tilt=obj["PanTilt"], zoom=obj["Zoom"])
-
-
-@dataclass
-class FloatRange:
-    min: float
-    max: float
-
-    @staticmethod
-    def create(obj: Any) -> "FloatRange":
-        return FloatRange(min=obj["Min"], max=obj["Max"])
-
-
-@dataclass
-class Space2DDescription:
-    uri: str
-    x_range: FloatRange
-    y_range: FloatRange
-    extension: dict | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "Space2DDescription":
-        return Space2DDescription(
-            uri=obj["URI"],
-            x_range=FloatRange.create(obj["XRange"]),
-            y_range=FloatRange.create(obj["YRange"]),
-            extension=obj["Extension"],
-        )
-
-
-@dataclass
-class Space1DDescription:
-    uri: str
-    x_range: FloatRange
-
-    @staticmethod
-    def create(obj: Any) -> "Space1DDescription":
-        return Space1DDescription(uri=obj["URI"], x_range=FloatRange.create(obj["XRange"]))
-
-
-@dataclass
-class PanTiltLimits:
-    range: Space2DDescription
-
-    @staticmethod
-    def create(obj: Any) -> "PanTiltLimits":
-        return PanTiltLimits(range=Space2DDescription.create(obj["Range"]))
-
-
-@dataclass
-class ZoomLimits:
-    range: Space1DDescription
-
-    @staticmethod
-    def create(obj: Any) -> "ZoomLimits":
-        return ZoomLimits(range=Space1DDescription.create(obj["Range"]))
-
-
-@dataclass
-class EFlip:
-    mode: EFlipMode | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "EFlip":
-        return EFlip(mode=EFlipMode(obj["Mode"]))
-
-
-@dataclass
-class Reverse:
-    mode: ReverseMode | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "Reverse":
-        return Reverse(mode=ReverseMode(obj["Mode"]))
-
-
-@dataclass
-class PTControlDirection:
-    e_flip: EFlip | None = None
-    reverse: Reverse | None = None
-    extension: dict | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "PTControlDirection":
-        e_flip = EFlip.create(obj["EFlip"]) if obj.get("EFlip") else None
-        reverse = Reverse.create(obj["Reverse"]) if obj.get("Reverse") else None
-        return PTControlDirection(e_flip=e_flip, reverse=reverse, extension=obj["Extension"])
-
-
-@dataclass
-class PTZConfigurationExtension:
-    pt_control_direction: PTControlDirection | None = None
-    extension: dict | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "PTZConfigurationExtension":
-        pt_control_direction = (
-            PTControlDirection.create(obj["PTControlDirection"])
-            if obj.get("PTControlDirection")
-            else None
-        )
-        return PTZConfigurationExtension(
-            pt_control_direction=pt_control_direction, extension=obj["Extension"]
-        )
-
-
-@dataclass
-class PTZConfiguration:
-    token: str
-    name: str
-    use_count: int
-    node_token: str
-    default_ptz_timeout: float
-    move_ramp: int | None = None
-    preset_ramp: int | None = None
-    preset_tour_ramp: int | None = None
-    default_absolute_pant_tilt_position_space: str | None = None
-    default_absolute_zoom_position_space: str | None = None
-    default_relative_pan_tilt_translation_space: str | None = None
-    default_relative_zoom_translation_space: str | None = None
-    default_continuous_pan_tilt_velocity_space: str | None = None
-    default_continuous_zoom_velocity_space: str | None = None
-    default_ptz_speed: PTZSpeed | None = None
-    pan_tilt_limits: PanTiltLimits | None = None
-    zoom_limits: ZoomLimits | None = None
-    extension: PTZConfigurationExtension | None = None
-
-    @staticmethod
-    def create(obj: Any) -> "PTZConfiguration":
-        pan_tilt_limits = (
-            PanTiltLimits.create(obj["PanTiltLimits"]) if obj["PanTiltLimits"] else None
-        )
-        zoom_limits = ZoomLimits.create(obj["ZoomLimits"]) if obj["ZoomLimits"] else None
-        extension = PTZConfigurationExtension.create(obj["Extension"]) if obj["Extension"] else None
-        return PTZConfiguration(
-            token=obj["token"],
-            name=obj["Name"],
-            use_count=obj["UseCount"],
-            move_ramp=obj["MoveRamp"],
-            preset_ramp=obj["PresetRamp"],
-            preset_tour_ramp=obj["PresetTourRamp"],
-            node_token=obj["NodeToken"],
-            default_absolute_pant_tilt_position_space=obj["DefaultAbsolutePantTiltPositionSpace"],
-            default_absolute_zoom_position_space=obj["DefaultAbsoluteZoomPositionSpace"],
-            default_relative_pan_tilt_translation_space=obj[
-                "DefaultRelativePanTiltTranslationSpace"
-            ],
-            default_relative_zoom_translation_space=obj["DefaultRelativeZoomTranslationSpace"],
-            default_continuous_pan_tilt_velocity_space=obj["DefaultContinuousPanTiltVelocitySpace"],
-            default_continuous_zoom_velocity_space=obj["DefaultContinuousZoomVelocitySpace"],
-            default_ptz_speed=(
-                PTZSpeed.create(obj["DefaultPTZSpeed"]) if obj["DefaultPTZSpeed"] else None
-            ),
-            default_ptz_timeout=float(obj["DefaultPTZTimeout"].total_seconds()),
-            pan_tilt_limits=pan_tilt_limits,
-            zoom_limits=zoom_limits,
-            extension=extension,
-        )
-
-
 @dataclass
 class PTZFilter:
     status: bool
@@ -690,14 +517,13 @@ class MetadataConfiguration:
 
     @staticmethod
     def create(obj: Any) -> "MetadataConfiguration":
-        ptz_status = PTZFilter.create(obj["PTZStatus"]) if obj.get("PTZStatus") else None
-        events = EventSubscription.create(obj["Events"]) if obj.get("Events") else None
-        multicast = (
-            MulticastConfiguration.create(obj["Multicast"]) if obj.get("Multicast") else None
-        )
+        # Zeep objects have no get(), every element of the type is there, None when missing
+        ptz_status = PTZFilter.create(obj["PTZStatus"]) if obj["PTZStatus"] else None
+        events = EventSubscription.create(obj["Events"]) if obj["Events"] else None
+        multicast = MulticastConfiguration.create(obj["Multicast"]) if obj["Multicast"] else None
         analytics_engine_configuration = (
             AnalyticsEngineConfiguration.create(obj["AnalyticsEngineConfiguration"])
-            if obj.get("AnalyticsEngineConfiguration")
+            if obj["AnalyticsEngineConfiguration"]
             else None
         )
         return MetadataConfiguration(
@@ -776,6 +602,19 @@ class ProfileExtension:
         )
 
 
+# Optional parts of a profile: dataclass field -> (element, dataclass)
+PROFILE_CONFIGURATIONS: dict[str, tuple[str, Any]] = {
+    "video_source_configuration": ("VideoSourceConfiguration", VideoSourceConfiguration),
+    "audio_source_configuration": ("AudioSourceConfiguration", AudioSourceConfiguration),
+    "video_encoder_configuration": ("VideoEncoderConfiguration", VideoEncoderConfiguration),
+    "audio_encoder_configuration": ("AudioEncoderConfiguration", AudioEncoderConfiguration),
+    "video_analytics_configuration": ("VideoAnalyticsConfiguration", VideoAnalyticsConfiguration),
+    "ptz_configuration": ("PTZConfiguration", PTZConfiguration),
+    "metadata_configuration": ("MetadataConfiguration", MetadataConfiguration),
+    "extension": ("Extension", ProfileExtension),
+}
+
+
 @dataclass
 class MediaProfile:
     token: str = ""
@@ -791,53 +630,15 @@ class MediaProfile:
     extension: ProfileExtension | None = None
 
     @staticmethod
-    def create(obj: Any) -> "MediaProfile":
-        video_source_configuration = (
-            VideoSourceConfiguration.create(obj["VideoSourceConfiguration"])
-            if obj["VideoSourceConfiguration"]
-            else None
-        )
-        audio_source_configuration = (
-            AudioSourceConfiguration.create(obj["AudioSourceConfiguration"])
-            if obj["AudioSourceConfiguration"]
-            else None
-        )
-        video_encoder_configuration = (
-            VideoEncoderConfiguration.create(obj["VideoEncoderConfiguration"])
-            if obj["VideoEncoderConfiguration"]
-            else None
-        )
-        audio_encoder_configuration = (
-            AudioEncoderConfiguration.create(obj["AudioEncoderConfiguration"])
-            if obj["AudioEncoderConfiguration"]
-            else None
-        )
-        video_analytics_configuration = (
-            VideoAnalyticsConfiguration.create(obj["VideoAnalyticsConfiguration"])
-            if obj["VideoAnalyticsConfiguration"]
-            else None
-        )
-        ptz_configuration = (
-            PTZConfiguration.create(obj["PTZConfiguration"]) if obj["PTZConfiguration"] else None
-        )
-        metadata_configuration = (
-            MetadataConfiguration.create(obj["MetadataConfiguration"])
-            if obj["MetadataConfiguration"]
-            else None
-        )
-        extension = ProfileExtension.create(obj["Extension"]) if obj["Extension"] else None
+    def create(obj: Any, fields: set[str] | None = None) -> "MediaProfile":
+        """Only the parts listed in `fields` are converted, all of them when it is None"""
+        configurations = {
+            name: configuration_type.create(obj[element]) if obj[element] else None
+            for name, (element, configuration_type) in PROFILE_CONFIGURATIONS.items()
+            if fields is None or name in fields
+        }
         return MediaProfile(
-            token=obj["token"],
-            fixed=obj["fixed"],
-            name=obj["Name"],
-            video_source_configuration=video_source_configuration,
-            audio_source_configuration=audio_source_configuration,
-            video_encoder_configuration=video_encoder_configuration,
-            audio_encoder_configuration=audio_encoder_configuration,
-            video_analytics_configuration=video_analytics_configuration,
-            ptz_configuration=ptz_configuration,
-            metadata_configuration=metadata_configuration,
-            extension=extension,
+            token=obj["token"], fixed=obj["fixed"], name=obj["Name"], **configurations
         )
 
 
@@ -846,12 +647,102 @@ class MediaProfiles:
     profiles: list[MediaProfile]
 
     @staticmethod
-    def create(obj: Any) -> "MediaProfiles":
-        return MediaProfiles(profiles=[MediaProfile.create(profile) for profile in obj])
+    def create(obj: Any, fields: set[str] | None = None) -> "MediaProfiles":
+        return MediaProfiles(profiles=[MediaProfile.create(profile, fields) for profile in obj])
+
+    def get_profile_summaries(self) -> list[ProfileSummary]:
+        return [
+            ProfileSummary(
+                token=profile.token,
+                name=profile.name,
+                video_source_token=(
+                    profile.video_source_configuration.source_token
+                    if profile.video_source_configuration
+                    else None
+                ),
+                video_encoder_token=(
+                    profile.video_encoder_configuration.token
+                    if profile.video_encoder_configuration
+                    else None
+                ),
+            )
+            for profile in self.profiles
+        ]
+
+    def get_encoder_summaries(self) -> list[EncoderSummary]:
+        encoders = {
+            encoder.token: encoder
+            for profile in self.profiles
+            if (encoder := profile.video_encoder_configuration)
+        }
+        return [
+            EncoderSummary(
+                token=encoder.token,
+                name=encoder.name,
+                encoding=encoder.encoding.value,
+                width=encoder.resolution.width,
+                height=encoder.resolution.height,
+                frame_rate_limit=(
+                    encoder.rate_control.frame_rate_limit if encoder.rate_control else None
+                ),
+                bitrate_limit=encoder.rate_control.bitrate_limit if encoder.rate_control else None,
+                gov_length=encoder.h264.gov_length if encoder.h264 else None,
+                profile=encoder.h264.h264_profile.value if encoder.h264 else None,
+            )
+            for encoder in encoders.values()
+        ]
+
+
+@dataclass
+class MediaUri:
+    uri: str
+    invalid_after_connect: bool = False
+    invalid_after_reboot: bool = False
+    timeout: float | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "MediaUri":
+        return MediaUri(
+            uri=obj["Uri"],
+            invalid_after_connect=obj["InvalidAfterConnect"],
+            invalid_after_reboot=obj["InvalidAfterReboot"],
+            timeout=obj["Timeout"].total_seconds() if obj["Timeout"] else None,
+        )
+
+    def get_cache_ttl(self, ttl: float) -> float:
+        """
+        A uri which is invalid after a connection cannot be reused at all and one with a
+        Timeout only until it expires. A Timeout of 0 means that the uri stays valid.
+        """
+        if self.invalid_after_connect:
+            return 0
+        return min(ttl, self.timeout) if self.timeout else ttl
+
+
+@dataclass
+class ProfileStreamUri:
+    profile_token: str
+    uri: str
+    profile_name: str | None = None
+
+
+@dataclass
+class CameraStreamUris:
+    camera: str
+    stream_uris: list[ProfileStreamUri] = field(default_factory=list)
+    error: str | None = None
+
+
+ENCODER_CACHE_SECTIONS = (
+    CacheSection.MEDIA_PROFILES,
+    CacheSection.MEDIA2_PROFILES,
+    CacheSection.MEDIA2_VIDEO_ENCODER_CONFIGURATIONS,
+)
 
 
 class OnvifClientMedia(OnvifClient):  # pylint: disable=too-few-public-methods
     BINDING_NAME = "{http://www.onvif.org/ver10/media/wsdl}MediaBinding"
+    ENCODER_LAYOUT = MEDIA_ENCODER_LAYOUT
 
     def _get_service_url(self):
         service_url = f"{self._get_base_url()}/onvif/media_service"
@@ -863,11 +754,202 @@ class OnvifClientMedia(OnvifClient):  # pylint: disable=too-few-public-methods
     @async_timeout_checker
     async def get_audio_outputs(self) -> AudioOutputs:
         self._check_service()
-        resp = await self.service.GetAudioOutputs()  # type: ignore
+        resp = await self._call_prerendered("GetAudioOutputs")
         return AudioOutputs.create(resp)
 
     @async_timeout_checker
-    async def get_profiles(self) -> MediaProfiles:
+    async def get_profiles(self, fields: list[str] | None = None) -> MediaProfiles:
+        """
+        Profiles with only the configurations named in `fields` converted, e.g.
+        ["video_encoder_configuration"]. All configurations are converted when it is None.
+        """
+        self._check_service()
+        event_watchers.watch(OnvifClientSettings(source=self.source, common=self.common))
+        if fields is None:
+            return await self._cached((CacheSection.MEDIA_PROFILES,), self._get_profiles)
+        selected = set(fields)
+        if unknown := selected - PROFILE_CONFIGURATIONS.keys():
+            raise ValueError(f"Unknown profile fields: {', '.join(sorted(unknown))}")
+
+        async def fetch() -> MediaProfiles:
+            resp = await self._call_prerendered("GetProfiles")
+            return await self._convert(lambda obj: MediaProfiles.create(obj, selected), resp)
+
+        return await self._cached((CacheSection.MEDIA_PROFILES, tuple(sorted(selected))), fetch)
+
+    @async_timeout_checker
+    async def get_profile(self, profile_token: str) -> MediaProfile:
+        self._check_service()
+
+        async def fetch() -> MediaProfile:
+            resp = await self.service.GetProfile(ProfileToken=profile_token)  # type: ignore
+            return MediaProfile.create(resp)
+
+        return await self._cached((CacheSection.MEDIA_PROFILES, "profile", profile_token), fetch)
+
+    @async_timeout_checker
+    async def get_video_source_configuration(
+        self, configuration_token: str
+    ) -> VideoSourceConfiguration:
+        self._check_service()
+
+        async def fetch() -> VideoSourceConfiguration:
+            resp = await self.service.GetVideoSourceConfiguration(  # type: ignore
+                ConfigurationToken=configuration_token
+            )
+            return VideoSourceConfiguration.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_PROFILES, "video_source", configuration_token), fetch
+        )
+
+    @async_timeout_checker
+    async def get_video_encoder_configuration(
+        self, configuration_token: str
+    ) -> VideoEncoderConfiguration:
+        self._check_service()
+
+        async def fetch() -> VideoEncoderConfiguration:
+            resp = await self.get_video_encoder_configuration_object(configuration_token)
+            return VideoEncoderConfiguration.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_PROFILES, "video_encoder", configuration_token), fetch
+        )
+
+    @async_timeout_checker
+    async def get_metadata_configuration(self, configuration_token: str) -> MetadataConfiguration:
+        self._check_service()
+
+        async def fetch() -> MetadataConfiguration:
+            resp = await self.service.GetMetadataConfiguration(  # type: ignore
+                ConfigurationToken=configuration_token
+            )
+            return MetadataConfiguration.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_PROFILES, "metadata", configuration_token), fetch
+        )
+
+    async def _get_profiles(self) -> MediaProfiles:
+        resp = await self._call_prerendered("GetProfiles")
+        profiles = await self._convert(MediaProfiles.create, resp)
+        if metadata_store and self.store_metadata:
+            camera_key = self.source.get_camera_key()
+            metadata_store.update_profiles(camera_key, profiles.get_profile_summaries())
+            metadata_store.update_encoders(camera_key, profiles.get_encoder_summaries())
+        return profiles
+
+    @async_timeout_checker
+    async def get_snapshot_uri(self, profile_token: str) -> MediaUri:
+        self._check_service()
+
+        async def fetch() -> MediaUri:
+            resp = await self.service.GetSnapshotUri(ProfileToken=profile_token)  # type: ignore
+            return MediaUri.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_SNAPSHOT_URI, profile_token),
+            fetch,
+            get_ttl=MediaUri.get_cache_ttl,
+        )
+
+    @async_timeout_checker
+    async def get_stream_uri(
+        self, profile_token: str, stream: str = "RTP-Unicast", protocol: str = "RTSP"
+    ) -> MediaUri:
+        self._check_service()
+
+        async def fetch() -> MediaUri:
+            resp = await self.service.GetStreamUri(  # type: ignore
+                StreamSetup={"Stream": stream, "Transport": {"Protocol": protocol}},
+                ProfileToken=profile_token,
+            )
+            return MediaUri.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_STREAM_URI, profile_token, stream, protocol),
+            fetch,
+            get_ttl=MediaUri.get_cache_ttl,
+        )
+
+    async def get_stream_uris(
+        self, stream: str = "RTP-Unicast", protocol: str = "RTSP"
+    ) -> CameraStreamUris:
+        profiles = (await self.get_profiles()).profiles
+        uris = await asyncio.gather(
+            *(self.get_stream_uri(profile.token, stream, protocol) for profile in profiles)
+        )
+        return CameraStreamUris(
+            camera=self.source.get_camera_key(),
+            stream_uris=[
+                ProfileStreamUri(
+                    profile_token=profile.token, uri=uri.uri, profile_name=profile.name
+                )
+                for profile, uri in zip(profiles, uris)
+            ],
+        )
+
+    async def get_video_encoder_configuration_tokens(self) -> list[str]:
+        profiles = (await self.get_profiles()).profiles
+        tokens = [
+            profile.video_encoder_configuration.token
+            for profile in profiles
+            if profile.video_encoder_configuration
+        ]
+        return list(dict.fromkeys(tokens))
+
+    @async_timeout_checker
+    async def get_video_encoder_configuration_object(self, configuration_token: str) -> Any:
+        """Configuration as returned by the camera, so it can be sent back without losing fields"""
+        self._check_service()
+        return await self.service.GetVideoEncoderConfiguration(  # type: ignore
+            ConfigurationToken=configuration_token
+        )
+
+    @async_timeout_checker
+    async def get_video_encoder_configuration_options(
+        self, configuration_token: str
+    ) -> VideoEncoderOptions:
+        self._check_service()
+
+        async def fetch() -> VideoEncoderOptions:
+            resp = await self.service.GetVideoEncoderConfigurationOptions(  # type: ignore
+                ConfigurationToken=configuration_token
+            )
+            return VideoEncoderOptions.create(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA_VIDEO_ENCODER_OPTIONS, configuration_token),
+            fetch,
+            ttl=self.common.encoder_options_ttl,
+        )
+
+    @async_timeout_checker
+    async def set_video_encoder_configuration(self, obj: Any) -> None:
         self._check_service()
-        resp = await self.service.GetProfiles()  # type: ignore
-        return MediaProfiles.create(resp)
+        await self.service.SetVideoEncoderConfiguration(  # type: ignore
+            Configuration=obj, ForcePersistence=True
+        )
+        response_cache.invalidate(self.source.get_camera_key(), *ENCODER_CACHE_SECTIONS)
+
+
+async def _get_camera_stream_uris(
+    settings: OnvifClientSettings, stream: str, protocol: str
+) -> CameraStreamUris:
+    client = await OnvifClientMedia.create_async(settings)
+    try:
+        return await client.get_stream_uris(stream, protocol)
+    finally:
+        await client.close()
+
+
+async def get_fleet_stream_uris(
+    sources: list[Source], common: ONVIFSettings, stream: str, protocol: str
+) -> list[CameraStreamUris]:
+    return await run_fleet(
+        sources,
+        common,
+        lambda settings: _get_camera_stream_uris(settings, stream, protocol),
+        lambda camera, exc: CameraStreamUris(camera=camera, error=str(exc)),
+    )
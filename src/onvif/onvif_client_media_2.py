@@ -1,9 +1,26 @@
 import os
+import asyncio
 import logging
 from dataclasses import dataclass, field
 from typing import Any
 
-from src.onvif.onvif_client import OnvifClient, async_timeout_checker
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_cache import CacheSection, response_cache
+from src.onvif.onvif_client import (
+    OnvifClient,
+    OnvifClientSettings,
+    async_timeout_checker,
+    run_fleet,
+)
+from src.onvif.onvif_client_events import event_watchers
+from src.onvif.onvif_metadata_store import EncoderSummary, metadata_store
+from src.onvif.onvif_client_media import (
+    ENCODER_CACHE_SECTIONS,
+    CameraStreamUris,
+    ProfileStreamUri,
+)
+from src.onvif.onvif_encoder_options import MEDIA2_ENCODER_LAYOUT, VideoEncoderOptions
 
 
 @dataclass
@@ -11,6 +28,10 @@ class VideoResolution:
     width: int | None = None
     height: int | None = None
 
+    @staticmethod
+    def create(obj: Any) -> "VideoResolution":
+        return VideoResolution(width=obj["Width"], height=obj["Height"])
+
 
 @dataclass
 class RateControl:
@@ -18,6 +39,14 @@ class RateControl:
     bitrate_limit: int | None = None
     constant_bitrate: bool | None = None
 
+    @staticmethod
+    def create(obj: Any) -> "RateControl":
+        return RateControl(
+            frame_rate_limit=obj["FrameRateLimit"],
+            bitrate_limit=obj["BitrateLimit"],
+            constant_bitrate=obj["ConstantBitRate"],
+        )
+
 
 @dataclass
 class Address:
@@ -25,6 +54,12 @@ class Address:
     ipv4_address: str | None = None
     ipv6_address: str | None = None
 
+    @staticmethod
+    def create(obj: Any) -> "Address":
+        return Address(
+            type=obj["Type"], ipv4_address=obj["IPv4Address"], ipv6_address=obj["IPv6Address"]
+        )
+
 
 @dataclass
 class Multicast:
@@ -33,6 +68,15 @@ class Multicast:
     ttl: int | None = None
     auto_start: bool | None = None
 
+    @staticmethod
+    def create(obj: Any) -> "Multicast":
+        return Multicast(
+            address=Address.create(obj["Address"]) if obj["Address"] else None,
+            port=obj["Port"],
+            ttl=obj["TTL"],
+            auto_start=obj["AutoStart"],
+        )
+
 
 @dataclass
 class VideoEncoderConfiguration:
@@ -48,6 +92,22 @@ class VideoEncoderConfiguration:
     profile: str | None = None
     guaranteed_frame_rate: float | None = None
 
+    @staticmethod
+    def create(obj: Any) -> "VideoEncoderConfiguration":
+        return VideoEncoderConfiguration(
+            name=obj["Name"],
+            use_count=obj["UseCount"],
+            encoding=obj["Encoding"],
+            resolution=VideoResolution.create(obj["Resolution"]) if obj["Resolution"] else None,
+            rate_control=RateControl.create(obj["RateControl"]) if obj["RateControl"] else None,
+            multicast=Multicast.create(obj["Multicast"]) if obj["Multicast"] else None,
+            quality=obj["Quality"],
+            token=obj["token"],
+            gov_length=obj["GovLength"],
+            profile=obj["Profile"],
+            guaranteed_frame_rate=obj["GuaranteedFrameRate"],
+        )
+
 
 @dataclass
 class GetVideoEncoderConfigurationsResponse:
@@ -56,43 +116,128 @@ class GetVideoEncoderConfigurationsResponse:
     @staticmethod
     def create(obj: Any) -> "GetVideoEncoderConfigurationsResponse":
         return GetVideoEncoderConfigurationsResponse(
-            encoders=[
-                VideoEncoderConfiguration(
-                    name=encoder["Name"],
-                    use_count=encoder["UseCount"],
-                    encoding=encoder["Encoding"],
-                    resolution=VideoResolution(
-                        width=encoder["Resolution"]["Width"],
-                        height=encoder["Resolution"]["Height"],
-                    ),
-                    rate_control=RateControl(
-                        frame_rate_limit=encoder["RateControl"]["FrameRateLimit"],
-                        bitrate_limit=encoder["RateControl"]["BitrateLimit"],
-                        constant_bitrate=encoder["RateControl"]["ConstantBitRate"],
-                    ),
-                    multicast=Multicast(
-                        address=Address(
-                            type=encoder["Multicast"]["Address"]["Type"],
-                            ipv4_address=encoder["Multicast"]["Address"]["IPv4Address"],
-                            ipv6_address=encoder["Multicast"]["Address"]["IPv6Address"],
-                        ),
-                        port=encoder["Multicast"]["Port"],
-                        ttl=encoder["Multicast"]["TTL"],
-                        auto_start=encoder["Multicast"]["AutoStart"],
-                    ),
-                    quality=encoder["Quality"],
-                    token=encoder["token"],
-                    gov_length=encoder["GovLength"],
-                    profile=encoder["Profile"],
-                    guaranteed_frame_rate=encoder["GuaranteedFrameRate"],
-                )
-                for encoder in obj
-            ]
+            encoders=[VideoEncoderConfiguration.create(encoder) for encoder in obj]
         )
 
+    def get_encoder_summaries(self) -> list[EncoderSummary]:
+        return [
+            EncoderSummary(
+                token=encoder.token,
+                name=encoder.name,
+                encoding=encoder.encoding,
+                width=encoder.resolution.width if encoder.resolution else None,
+                height=encoder.resolution.height if encoder.resolution else None,
+                frame_rate_limit=(
+                    encoder.rate_control.frame_rate_limit if encoder.rate_control else None
+                ),
+                bitrate_limit=encoder.rate_control.bitrate_limit if encoder.rate_control else None,
+                gov_length=encoder.gov_length,
+                profile=encoder.profile,
+            )
+            for encoder in self.encoders
+            if encoder.token
+        ]
+
+
+@dataclass
+class Rectangle:
+    x: int | None = None
+    y: int | None = None
+    width: int | None = None
+    height: int | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Rectangle":
+        return Rectangle(x=obj["x"], y=obj["y"], width=obj["width"], height=obj["height"])
+
+
+@dataclass
+class VideoSourceConfiguration:
+    token: str | None = None
+    name: str | None = None
+    use_count: int | None = None
+    source_token: str | None = None
+    bounds: Rectangle | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "VideoSourceConfiguration":
+        return VideoSourceConfiguration(
+            token=obj["token"],
+            name=obj["Name"],
+            use_count=obj["UseCount"],
+            source_token=obj["SourceToken"],
+            bounds=Rectangle.create(obj["Bounds"]) if obj["Bounds"] else None,
+        )
+
+
+@dataclass
+class Configuration:
+    """Common part of the configuration types which are not modelled in detail"""
+
+    token: str | None = None
+    name: str | None = None
+    use_count: int | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Configuration":
+        return Configuration(token=obj["token"], name=obj["Name"], use_count=obj["UseCount"])
+
+
+def _configuration(obj: Any) -> Configuration | None:
+    return Configuration.create(obj) if obj else None
+
+
+@dataclass
+class MediaProfile:
+    token: str
+    name: str | None = None
+    fixed: bool | None = None
+    video_source: VideoSourceConfiguration | None = None
+    audio_source: Configuration | None = None
+    video_encoder: VideoEncoderConfiguration | None = None
+    audio_encoder: Configuration | None = None
+    analytics: Configuration | None = None
+    ptz: Configuration | None = None
+    metadata: Configuration | None = None
+    audio_output: Configuration | None = None
+    audio_decoder: Configuration | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "MediaProfile":
+        configurations = obj["Configurations"]
+        if not configurations:
+            return MediaProfile(token=obj["token"], name=obj["Name"], fixed=obj["fixed"])
+        video_source, video_encoder = configurations["VideoSource"], configurations["VideoEncoder"]
+        return MediaProfile(
+            token=obj["token"],
+            name=obj["Name"],
+            fixed=obj["fixed"],
+            video_source=VideoSourceConfiguration.create(video_source) if video_source else None,
+            audio_source=_configuration(configurations["AudioSource"]),
+            video_encoder=(
+                VideoEncoderConfiguration.create(video_encoder) if video_encoder else None
+            ),
+            audio_encoder=_configuration(configurations["AudioEncoder"]),
+            analytics=_configuration(configurations["Analytics"]),
+            ptz=_configuration(configurations["PTZ"]),
+            metadata=_configuration(configurations["Metadata"]),
+            audio_output=_configuration(configurations["AudioOutput"]),
+            audio_decoder=_configuration(configurations["AudioDecoder"]),
+        )
+
+
+@dataclass
+class MediaProfiles:
+    profiles: list[MediaProfile] = field(default_factory=list)
+
+    @staticmethod
+    def create(obj: Any) -> "MediaProfiles":
+        return MediaProfiles(profiles=[MediaProfile.create(profile) for profile in obj or []])
+
 
 class OnvifClientMedia2(OnvifClient):  # pylint: disable=too-few-public-methods
     BINDING_NAME = "{http://www.onvif.org/ver20/media/wsdl}Media2Binding"
+    ENCODER_LAYOUT = MEDIA2_ENCODER_LAYOUT
 
     def _get_service_url(self):
         service_url = f"{self._get_base_url()}/onvif/media_service"
@@ -105,12 +250,130 @@ class OnvifClientMedia2(OnvifClient):  # pylint: disable=too-few-public-methods
     @async_timeout_checker
     async def get_video_encoder_configurations(self) -> GetVideoEncoderConfigurationsResponse:
         self._check_service()
-        resp = await self.service.GetVideoEncoderConfigurations()  # type: ignore
-        return GetVideoEncoderConfigurationsResponse.create(resp)
+        event_watchers.watch(OnvifClientSettings(source=self.source, common=self.common))
+        return await self._cached(
+            (CacheSection.MEDIA2_VIDEO_ENCODER_CONFIGURATIONS,),
+            self._get_video_encoder_configurations,
+        )
+
+    async def _get_video_encoder_configurations(self) -> GetVideoEncoderConfigurationsResponse:
+        resp = await self._call_prerendered("GetVideoEncoderConfigurations")
+        configurations = GetVideoEncoderConfigurationsResponse.create(resp)
+        if metadata_store and self.store_metadata:
+            metadata_store.update_encoders(
+                self.source.get_camera_key(), configurations.get_encoder_summaries()
+            )
+        return configurations
+
+    @async_timeout_checker
+    async def get_profiles(
+        self, types: list[str] | None = None, profile_token: str | None = None
+    ) -> MediaProfiles:
+        """
+        Profiles with the configurations of the requested types only ("All" for every type).
+        Without types the camera returns the profiles without configurations.
+        """
+        self._check_service()
+        event_watchers.watch(OnvifClientSettings(source=self.source, common=self.common))
+        types = sorted(set(types or []))
+
+        async def fetch() -> MediaProfiles:
+            resp = await self.service.GetProfiles(  # type: ignore
+                Token=profile_token, Type=types or None
+            )
+            return await self._convert(MediaProfiles.create, resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA2_PROFILES, tuple(types), profile_token), fetch
+        )
+
+    async def _get_profile_names(self) -> dict[str, str]:
+        """Profile tokens and names. Without Type the camera returns no configurations"""
+
+        async def fetch() -> dict[str, str]:
+            resp = await self._call_prerendered("GetProfiles")
+            return {profile["token"]: profile["Name"] for profile in resp}
+
+        return await self._cached((CacheSection.MEDIA2_PROFILE_TOKENS,), fetch)
+
+    @async_timeout_checker
+    async def get_stream_uri(self, profile_token: str, protocol: str = "RtspUnicast") -> str:
+        self._check_service()
+
+        async def fetch() -> str:
+            return await self.service.GetStreamUri(  # type: ignore
+                Protocol=protocol, ProfileToken=profile_token
+            )
+
+        return await self._cached((CacheSection.MEDIA2_STREAM_URI, profile_token, protocol), fetch)
+
+    @async_timeout_checker
+    async def get_stream_uris(self, protocol: str = "RtspUnicast") -> CameraStreamUris:
+        self._check_service()
+        profiles = await self._get_profile_names()
+        uris = await asyncio.gather(*(self.get_stream_uri(token, protocol) for token in profiles))
+        return CameraStreamUris(
+            camera=self.source.get_camera_key(),
+            stream_uris=[
+                ProfileStreamUri(profile_token=token, uri=uri, profile_name=name)
+                for (token, name), uri in zip(profiles.items(), uris)
+            ],
+        )
+
+    async def get_video_encoder_configuration_tokens(self) -> list[str]:
+        encoders = (await self.get_video_encoder_configurations()).encoders
+        return [encoder.token for encoder in encoders if encoder.token]
+
+    @async_timeout_checker
+    async def get_video_encoder_configuration_object(self, configuration_token: str) -> Any:
+        """Configuration as returned by the camera, so it can be sent back without losing fields"""
+        self._check_service()
+        resp = await self.service.GetVideoEncoderConfigurations(  # type: ignore
+            ConfigurationToken=configuration_token
+        )
+        if not resp:
+            raise ValueError(f"Video encoder configuration {configuration_token} not found")
+        return resp[0]
 
     @async_timeout_checker
-    async def get_profiles(self) -> dict[str, str]:
+    async def get_video_encoder_configuration_options(
+        self, configuration_token: str
+    ) -> VideoEncoderOptions:
         self._check_service()
-        resp = await self.service.GetProfiles(Type="All")  # type: ignore
-        logging.info("Profiles: %s", resp)
-        return {"test": "test"}
+
+        async def fetch() -> VideoEncoderOptions:
+            resp = await self.service.GetVideoEncoderConfigurationOptions(  # type: ignore
+                ConfigurationToken=configuration_token
+            )
+            return VideoEncoderOptions.create_media2(resp)
+
+        return await self._cached(
+            (CacheSection.MEDIA2_VIDEO_ENCODER_OPTIONS, configuration_token),
+            fetch,
+            ttl=self.common.encoder_options_ttl,
+        )
+
+    @async_timeout_checker
+    async def set_video_encoder_configuration(self, obj: Any) -> None:
+        self._check_service()
+        await self.service.SetVideoEncoderConfiguration(Configuration=obj)  # type: ignore
+        response_cache.invalidate(self.source.get_camera_key(), *ENCODER_CACHE_SECTIONS)
+
+
+async def _get_camera_stream_uris(settings: OnvifClientSettings, protocol: str) -> CameraStreamUris:
+    client = await OnvifClientMedia2.create_async(settings)
+    try:
+        return await client.get_stream_uris(protocol)
+    finally:
+        await client.close()
+
+
+async def get_fleet_stream_uris(
+    sources: list[Source], common: ONVIFSettings, protocol: str
+) -> list[CameraStreamUris]:
+    return await run_fleet(
+        sources,
+        common,
+        lambda settings: _get_camera_stream_uris(settings, protocol),
+        lambda camera, exc: CameraStreamUris(camera=camera, error=str(exc)),
+    )
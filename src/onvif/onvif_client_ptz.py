@@ -0,0 +1,507 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import Enum
+from typing import Any
+
+import httpx
+
+from src.onvif.onvif_client import OnvifClient, OnvifClientSettings, async_timeout_checker
+from src.onvif.onvif_deadline import create_background_task
+from src.onvif.onvif_encoder_options import FloatRange
+from src.onvif.onvif_metrics import metrics
+from src.onvif.onvif_transport import BoundedAsyncTransport
+
+
+class EFlipMode(Enum):
+    OFF = "OFF"
+    ON = "ON"
+    EXTENDED = "Extended"
+
+
+class ReverseMode(Enum):
+    OFF = "OFF"
+    ON = "ON"
+    AUTO = "AUTO"
+    EXTENDED = "Extended"
+
+
+@dataclass
+class PTZSpeed:
+    pan_tilt: float
+    zoom: float
+
+    @staticmethod
+    def create(obj: Any) -> "PTZSpeed":
+        return PTZSpeed(pan_tilt=obj["PanTilt"], zoom=obj["Zoom"])
+
+
+@dataclass
+class Space2DDescription:
+    uri: str
+    x_range: FloatRange
+    y_range: FloatRange
+    extension: dict | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Space2DDescription":
+        return Space2DDescription(
+            uri=obj["URI"],
+            x_range=FloatRange.create(obj["XRange"]),
+            y_range=FloatRange.create(obj["YRange"]),
+            extension=obj["Extension"],
+        )
+
+
+@dataclass
+class Space1DDescription:
+    uri: str
+    x_range: FloatRange
+
+    @staticmethod
+    def create(obj: Any) -> "Space1DDescription":
+        return Space1DDescription(uri=obj["URI"], x_range=FloatRange.create(obj["XRange"]))
+
+
+@dataclass
+class PanTiltLimits:
+    range: Space2DDescription
+
+    @staticmethod
+    def create(obj: Any) -> "PanTiltLimits":
+        return PanTiltLimits(range=Space2DDescription.create(obj["Range"]))
+
+
+@dataclass
+class ZoomLimits:
+    range: Space1DDescription
+
+    @staticmethod
+    def create(obj: Any) -> "ZoomLimits":
+        return ZoomLimits(range=Space1DDescription.create(obj["Range"]))
+
+
+@dataclass
+class EFlip:
+    mode: EFlipMode | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "EFlip":
+        return EFlip(mode=EFlipMode(obj["Mode"]))
+
+
+@dataclass
+class Reverse:
+    mode: ReverseMode | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Reverse":
+        return Reverse(mode=ReverseMode(obj["Mode"]))
+
+
+@dataclass
+class PTControlDirection:
+    e_flip: EFlip | None = None
+    reverse: Reverse | None = None
+    extension: dict | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTControlDirection":
+        e_flip = EFlip.create(obj["EFlip"]) if obj.get("EFlip") else None
+        reverse = Reverse.create(obj["Reverse"]) if obj.get("Reverse") else None
+        return PTControlDirection(e_flip=e_flip, reverse=reverse, extension=obj["Extension"])
+
+
+@dataclass
+class PTZConfigurationExtension:
+    pt_control_direction: PTControlDirection | None = None
+    extension: dict | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZConfigurationExtension":
+        pt_control_direction = (
+            PTControlDirection.create(obj["PTControlDirection"])
+            if obj.get("PTControlDirection")
+            else None
+        )
+        return PTZConfigurationExtension(
+            pt_control_direction=pt_control_direction, extension=obj["Extension"]
+        )
+
+
+@dataclass
+class PTZConfiguration:
+    token: str
+    name: str
+    use_count: int
+    node_token: str
+    default_ptz_timeout: float
+    move_ramp: int | None = None
+    preset_ramp: int | None = None
+    preset_tour_ramp: int | None = None
+    default_absolute_pant_tilt_position_space: str | None = None
+    default_absolute_zoom_position_space: str | None = None
+    default_relative_pan_tilt_translation_space: str | None = None
+    default_relative_zoom_translation_space: str | None = None
+    default_continuous_pan_tilt_velocity_space: str | None = None
+    default_continuous_zoom_velocity_space: str | None = None
+    default_ptz_speed: PTZSpeed | None = None
+    pan_tilt_limits: PanTiltLimits | None = None
+    zoom_limits: ZoomLimits | None = None
+    extension: PTZConfigurationExtension | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZConfiguration":
+        pan_tilt_limits = (
+            PanTiltLimits.create(obj["PanTiltLimits"]) if obj["PanTiltLimits"] else None
+        )
+        zoom_limits = ZoomLimits.create(obj["ZoomLimits"]) if obj["ZoomLimits"] else None
+        extension = PTZConfigurationExtension.create(obj["Extension"]) if obj["Extension"] else None
+        return PTZConfiguration(
+            token=obj["token"],
+            name=obj["Name"],
+            use_count=obj["UseCount"],
+            move_ramp=obj["MoveRamp"],
+            preset_ramp=obj["PresetRamp"],
+            preset_tour_ramp=obj["PresetTourRamp"],
+            node_token=obj["NodeToken"],
+            default_absolute_pant_tilt_position_space=obj["DefaultAbsolutePantTiltPositionSpace"],
+            default_absolute_zoom_position_space=obj["DefaultAbsoluteZoomPositionSpace"],
+            default_relative_pan_tilt_translation_space=obj[
+                "DefaultRelativePanTiltTranslationSpace"
+            ],
+            default_relative_zoom_translation_space=obj["DefaultRelativeZoomTranslationSpace"],
+            default_continuous_pan_tilt_velocity_space=obj["DefaultContinuousPanTiltVelocitySpace"],
+            default_continuous_zoom_velocity_space=obj["DefaultContinuousZoomVelocitySpace"],
+            default_ptz_speed=(
+                PTZSpeed.create(obj["DefaultPTZSpeed"]) if obj["DefaultPTZSpeed"] else None
+            ),
+            default_ptz_timeout=float(obj["DefaultPTZTimeout"].total_seconds()),
+            pan_tilt_limits=pan_tilt_limits,
+            zoom_limits=zoom_limits,
+            extension=extension,
+        )
+
+
+@dataclass
+class Vector2D:
+    x: float
+    y: float
+    space: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Vector2D":
+        return Vector2D(x=obj["x"], y=obj["y"], space=obj["space"])
+
+
+@dataclass
+class Vector1D:
+    x: float
+    space: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "Vector1D":
+        return Vector1D(x=obj["x"], space=obj["space"])
+
+
+@dataclass
+class PTZVector:
+    pan_tilt: Vector2D | None = None
+    zoom: Vector1D | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZVector":
+        return PTZVector(
+            pan_tilt=Vector2D.create(obj["PanTilt"]) if obj["PanTilt"] else None,
+            zoom=Vector1D.create(obj["Zoom"]) if obj["Zoom"] else None,
+        )
+
+    @staticmethod
+    def from_pan_tilt_zoom(pan: float, tilt: float, zoom: float | None = None) -> "PTZVector":
+        return PTZVector(
+            pan_tilt=Vector2D(x=pan, y=tilt), zoom=Vector1D(x=zoom) if zoom is not None else None
+        )
+
+    def to_onvif(self) -> dict[str, Any]:
+        vector: dict[str, Any] = {}
+        if self.pan_tilt:
+            vector["PanTilt"] = {"x": self.pan_tilt.x, "y": self.pan_tilt.y}
+            if self.pan_tilt.space:
+                vector["PanTilt"]["space"] = self.pan_tilt.space
+        if self.zoom:
+            vector["Zoom"] = {"x": self.zoom.x}
+            if self.zoom.space:
+                vector["Zoom"]["space"] = self.zoom.space
+        return vector
+
+
+@dataclass
+class PTZMoveStatus:
+    pan_tilt: str | None = None
+    zoom: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZMoveStatus":
+        return PTZMoveStatus(pan_tilt=obj["PanTilt"], zoom=obj["Zoom"])
+
+
+@dataclass
+class PTZStatus:
+    utc_time: str
+    position: PTZVector | None = None
+    move_status: PTZMoveStatus | None = None
+    error: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZStatus":
+        return PTZStatus(
+            utc_time=str(obj["UtcTime"]),
+            position=PTZVector.create(obj["Position"]) if obj["Position"] else None,
+            move_status=PTZMoveStatus.create(obj["MoveStatus"]) if obj["MoveStatus"] else None,
+            error=obj["Error"],
+        )
+
+
+@dataclass
+class PTZPreset:
+    token: str
+    name: str | None = None
+    position: PTZVector | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "PTZPreset":
+        return PTZPreset(
+            token=obj["token"],
+            name=obj["Name"],
+            position=PTZVector.create(obj["PTZPosition"]) if obj["PTZPosition"] else None,
+        )
+
+
+@dataclass
+class PTZPresets:
+    presets: list[PTZPreset]
+
+    @staticmethod
+    def create(obj: Any) -> "PTZPresets":
+        return PTZPresets(presets=[PTZPreset.create(preset) for preset in obj])
+
+
+@dataclass
+class PTZCommandResult:
+    operation: str
+    coalesced: bool = False
+    latency: float | None = None
+
+
+class OnvifClientPTZ(OnvifClient):  # pylint: disable=too-few-public-methods
+    BINDING_NAME = "{http://www.onvif.org/ver20/ptz/wsdl}PTZBinding"
+
+    def _get_service_url(self):
+        return f"{self._get_base_url()}/onvif/ptz_service"
+
+    def _get_wsdl_path(self):
+        return os.path.join(self.common.wsdl_path, "ver20/ptz/wsdl/ptz.wsdl")
+
+    def _create_transport(self, **client_kwargs) -> BoundedAsyncTransport:
+        # Keep the connection open between joystick commands instead of httpx's 5 s default
+        return super()._create_transport(
+            limits=httpx.Limits(keepalive_expiry=self.common.ptz_keepalive), **client_kwargs
+        )
+
+    @async_timeout_checker
+    async def continuous_move(
+        self, profile_token: str, velocity: PTZVector, timeout: float | None = None
+    ) -> None:
+        self._check_service()
+        await self.service.ContinuousMove(  # type: ignore
+            ProfileToken=profile_token,
+            Velocity=velocity.to_onvif(),
+            Timeout=timedelta(seconds=timeout) if timeout else None,
+        )
+
+    @async_timeout_checker
+    async def absolute_move(
+        self, profile_token: str, position: PTZVector, speed: PTZVector | None = None
+    ) -> None:
+        self._check_service()
+        await self.service.AbsoluteMove(  # type: ignore
+            ProfileToken=profile_token,
+            Position=position.to_onvif(),
+            Speed=speed.to_onvif() if speed else None,
+        )
+
+    @async_timeout_checker
+    async def stop(self, profile_token: str, pan_tilt: bool = True, zoom: bool = True) -> None:
+        self._check_service()
+        await self.service.Stop(  # type: ignore
+            ProfileToken=profile_token, PanTilt=pan_tilt, Zoom=zoom
+        )
+
+    @async_timeout_checker
+    async def get_status(self, profile_token: str) -> PTZStatus:
+        self._check_service()
+        resp = await self.service.GetStatus(ProfileToken=profile_token)  # type: ignore
+        return PTZStatus.create(resp)
+
+    @async_timeout_checker
+    async def get_presets(self, profile_token: str) -> PTZPresets:
+        self._check_service()
+        resp = await self.service.GetPresets(ProfileToken=profile_token)  # type: ignore
+        return PTZPresets.create(resp)
+
+    @async_timeout_checker
+    async def goto_preset(
+        self, profile_token: str, preset_token: str, speed: PTZVector | None = None
+    ) -> None:
+        self._check_service()
+        await self.service.GotoPreset(  # type: ignore
+            ProfileToken=profile_token,
+            PresetToken=preset_token,
+            Speed=speed.to_onvif() if speed else None,
+        )
+
+    @async_timeout_checker
+    async def set_preset(
+        self, profile_token: str, preset_name: str | None = None, preset_token: str | None = None
+    ) -> str:
+        self._check_service()
+        return await self.service.SetPreset(  # type: ignore
+            ProfileToken=profile_token, PresetName=preset_name, PresetToken=preset_token
+        )
+
+    @async_timeout_checker
+    async def remove_preset(self, profile_token: str, preset_token: str) -> None:
+        self._check_service()
+        await self.service.RemovePreset(  # type: ignore
+            ProfileToken=profile_token, PresetToken=preset_token
+        )
+
+
+# Moves that only matter in their latest version. A newer pending command of the same
+# operation replaces the older one instead of being queued behind it.
+COALESCED_OPERATIONS = {"continuous_move", "absolute_move"}
+
+
+@dataclass
+class PTZCommand:
+    operation: str
+    kwargs: dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class PTZCommandQueue:
+    """
+    Sends move commands of one camera strictly in order over a warm client.
+    While a command is in flight, newer moves overwrite the pending one (last write wins).
+    A stop drops every pending move and is sent right after the in-flight command,
+    so a move can never overtake the stop that followed it.
+    """
+
+    def __init__(self, client: OnvifClientPTZ, camera_key: str) -> None:
+        self.client = client
+        self.camera_key = camera_key
+        self.last_used = time.monotonic()
+        self._pending: deque[PTZCommand] = deque()
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def is_busy(self) -> bool:
+        return bool(self._pending) or self._worker is not None
+
+    def submit(self, operation: str, **kwargs: Any) -> asyncio.Future:
+        self.last_used = time.monotonic()
+        command = PTZCommand(operation, kwargs, asyncio.get_running_loop().create_future())
+        if operation == "stop":
+            while self._pending and self._pending[-1].operation in COALESCED_OPERATIONS:
+                self._resolve_coalesced(self._pending.pop())
+        elif (
+            operation in COALESCED_OPERATIONS
+            and self._pending
+            and self._pending[-1].operation == operation
+        ):
+            self._resolve_coalesced(self._pending.pop())
+        self._pending.append(command)
+        if not self._worker:
+            self._worker = create_background_task(self._run())
+        return command.future
+
+    def _resolve_coalesced(self, command: PTZCommand) -> None:
+        metrics.inc("ptz_commands_coalesced", camera=self.camera_key, operation=command.operation)
+        if not command.future.done():
+            command.future.set_result(PTZCommandResult(operation=command.operation, coalesced=True))
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                command = self._pending.popleft()
+                try:
+                    await getattr(self.client, command.operation)(**command.kwargs)
+                except Exception as exc:  # pylint: disable=broad-except
+                    metrics.inc(
+                        "ptz_command_errors", camera=self.camera_key, operation=command.operation
+                    )
+                    if not command.future.done():
+                        command.future.set_exception(exc)
+                    continue
+                latency = time.monotonic() - command.enqueued_at
+                metrics.observe(
+                    "ptz_command_latency_seconds",
+                    latency,
+                    camera=self.camera_key,
+                    operation=command.operation,
+                )
+                if not command.future.done():
+                    command.future.set_result(
+                        PTZCommandResult(operation=command.operation, latency=latency)
+                    )
+        finally:
+            self._worker = None
+
+    async def close(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        await self.client.close()
+
+
+class PTZCommandQueues:
+    """
+    Warm PTZ clients and their command queues, one per camera and credentials. A warm
+    client is only reused with the exact login it was created with, so a request with a
+    wrong password is never sent over a client authenticated with the right one.
+    """
+
+    def __init__(self) -> None:
+        self._queues: dict[tuple[str, str], PTZCommandQueue] = {}
+        self._locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+    async def get(self, settings: OnvifClientSettings) -> PTZCommandQueue:
+        key = (settings.source.get_camera_key(), settings.source.get_credentials_key())
+        await self._close_idle(settings.common.ptz_keepalive)
+        if not (queue := self._queues.get(key)):
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                if not (queue := self._queues.get(key)):
+                    client = await OnvifClientPTZ.create_async(settings)
+                    queue = self._queues[key] = PTZCommandQueue(client, key[0])
+        queue.last_used = time.monotonic()
+        return queue
+
+    async def _close_idle(self, keepalive: float) -> None:
+        now = time.monotonic()
+        idle = [
+            key
+            for key, queue in self._queues.items()
+            if not queue.is_busy and now - queue.last_used > keepalive
+        ]
+        await asyncio.gather(*(self._queues.pop(key).close() for key in idle))
+
+    async def stop(self) -> None:
+        queues, self._queues = list(self._queues.values()), {}
+        await asyncio.gather(*(queue.close() for queue in queues), return_exceptions=True)
+
+
+ptz_queues = PTZCommandQueues()
@@ -1,7 +1,22 @@
 import os
+import asyncio
 import logging
+from dataclasses import dataclass, field
 
-from src.onvif.onvif_client import OnvifClient, async_timeout_checker
+from src.onvif.onvif_client import OnvifClient, OnvifClientSettings, async_timeout_checker
+from src.onvif.onvif_client_search import OnvifClientSearch
+
+
+@dataclass
+class ReplayUri:
+    recording_token: str
+    uri: str
+
+
+@dataclass
+class ReplayUris:
+    camera: str
+    replay_uris: list[ReplayUri] = field(default_factory=list)
 
 
 class OnvifClientReplay(OnvifClient):  # pylint: disable=too-few-public-methods
@@ -17,11 +32,35 @@ class OnvifClientReplay(OnvifClient):  # pylint: disable=too-few-public-methods
         return os.path.join(self.common.wsdl_path, "ver10/replay.wsdl")
 
     @async_timeout_checker
-    async def get_replay_uri(self) -> dict[str, str]:
+    async def get_replay_uri(
+        self, recording_token: str, stream: str = "RTP-Unicast", protocol: str = "UDP"
+    ) -> ReplayUri:
         self._check_service()
         resp = await self.service.GetReplayUri(  # type: ignore
-            StreamSetup={"Stream": "RTP-Unicast", "Transport": {"Protocol": "UDP"}},
-            RecordingToken="OnvifRecordingToken_1",
+            StreamSetup={"Stream": stream, "Transport": {"Protocol": protocol}},
+            RecordingToken=recording_token,
+        )
+        return ReplayUri(recording_token=recording_token, uri=resp)
+
+    async def get_recording_tokens(self) -> list[str]:
+        search = await OnvifClientSearch.create_async(
+            OnvifClientSettings(source=self.source, common=self.common)
+        )
+        try:
+            return (await search.get_recording_index()).recording_tokens
+        finally:
+            await search.close()
+
+    async def get_replay_uris(
+        self,
+        recording_tokens: list[str] | None = None,
+        stream: str = "RTP-Unicast",
+        protocol: str = "UDP",
+    ) -> ReplayUris:
+        """Replay uris of the given recordings, or of every recording found by the search"""
+        if recording_tokens is None:
+            recording_tokens = await self.get_recording_tokens()
+        replay_uris = await asyncio.gather(
+            *(self.get_replay_uri(token, stream, protocol) for token in recording_tokens)
         )
-        logging.info("GetReplayUri: %s", resp)
-        return {"test": "test"}
+        return ReplayUris(camera=self.source.get_camera_key(), replay_uris=replay_uris)
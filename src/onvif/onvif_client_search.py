@@ -0,0 +1,201 @@
+import os
+import asyncio
+import logging
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+from src.onvif.onvif_cache import CacheSection
+from src.onvif.onvif_client import OnvifClient, OnvifClientServiceError, async_timeout_checker
+from src.onvif.onvif_client_events import NotificationMessage
+
+SEARCH_COMPLETED = "Completed"
+
+
+@dataclass
+class RecordingInformation:
+    recording_token: str
+    source_id: str | None = None
+    source_name: str | None = None
+    content: str | None = None
+    earliest_recording: str | None = None
+    latest_recording: str | None = None
+    recording_status: str | None = None
+
+    @staticmethod
+    def create(obj: Any) -> "RecordingInformation":
+        source = obj["Source"]
+        return RecordingInformation(
+            recording_token=obj["RecordingToken"],
+            source_id=source["SourceId"] if source else None,
+            source_name=source["Name"] if source else None,
+            content=obj["Content"],
+            earliest_recording=(
+                obj["EarliestRecording"].isoformat() if obj["EarliestRecording"] else None
+            ),
+            latest_recording=obj["LatestRecording"].isoformat() if obj["LatestRecording"] else None,
+            recording_status=obj["RecordingStatus"],
+        )
+
+
+@dataclass
+class RecordingIndex:
+    camera: str
+    recordings: list[RecordingInformation] = field(default_factory=list)
+
+    @property
+    def recording_tokens(self) -> list[str]:
+        return [recording.recording_token for recording in self.recordings]
+
+
+@dataclass
+class EventSearchResult:
+    recording_token: str
+    track_token: str
+    time: str
+    start_state_event: bool
+    topic: str | None = None
+    source: dict[str, str] = field(default_factory=dict)
+    data: dict[str, str] = field(default_factory=dict)
+
+    @staticmethod
+    def create(obj: Any) -> "EventSearchResult":
+        event = NotificationMessage.create(obj["Event"]) if obj["Event"] else None
+        return EventSearchResult(
+            recording_token=obj["RecordingToken"],
+            track_token=obj["TrackToken"],
+            time=obj["Time"].isoformat(),
+            start_state_event=obj["StartStateEvent"],
+            topic=event.topic if event else None,
+            source=event.source if event else {},
+            data=event.data if event else {},
+        )
+
+
+class OnvifClientSearch(OnvifClient):  # pylint: disable=too-few-public-methods
+    BINDING_NAME = "{http://www.onvif.org/ver10/search/wsdl}SearchBinding"
+
+    def _get_service_url(self):
+        return f"{self._get_base_url()}/onvif/search_service"
+
+    def _get_wsdl_path(self):
+        return os.path.join(self.common.wsdl_path, "ver10/search.wsdl")
+
+    @async_timeout_checker
+    async def end_search(self, search_token: str) -> None:
+        self._check_service()
+        await self.service.EndSearch(SearchToken=search_token)  # type: ignore
+
+    async def _iterate_pages(
+        self, search_token: str, get_page: Callable[[str], Awaitable[Any]]
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Yield result pages of a search. The next page is already requested while the caller
+        consumes the current one. EndSearch is sent however the iteration ends, including
+        cancellation, so the device can release the search session right away.
+        A search which is not completed after search_max_pages pages fails.
+        """
+        next_page: asyncio.Task | None = asyncio.ensure_future(get_page(search_token))
+        pages = 0
+        try:
+            while next_page:
+                page = await next_page
+                pages += 1
+                next_page = None
+                if page["SearchState"] != SEARCH_COMPLETED:
+                    if pages >= self.common.search_max_pages:
+                        raise OnvifClientServiceError(
+                            f"Search {search_token} did not complete within {pages} pages"
+                        )
+                    next_page = asyncio.ensure_future(get_page(search_token))
+                yield page
+        finally:
+            if next_page:
+                next_page.cancel()
+            try:
+                await asyncio.shield(asyncio.ensure_future(self.end_search(search_token)))
+            except OnvifClientServiceError as exc:
+                # A completed search may already be released by the device
+                logging.debug("EndSearch %s failed: %r", search_token, exc)
+
+    @async_timeout_checker
+    async def _start_recording_search(self) -> str:
+        self._check_service()
+        return await self.service.FindRecordings(  # type: ignore
+            Scope={}, KeepAliveTime=timedelta(seconds=self.common.search_keep_alive)
+        )
+
+    @async_timeout_checker
+    async def _get_recording_search_results(self, search_token: str) -> Any:
+        return await self.service.GetRecordingSearchResults(  # type: ignore
+            SearchToken=search_token,
+            MaxResults=self.common.search_page_size,
+            WaitTime=timedelta(seconds=self.common.search_wait_time),
+        )
+
+    async def iterate_recordings(self) -> AsyncGenerator[RecordingInformation, None]:
+        search_token = await self._start_recording_search()
+        pages = self._iterate_pages(search_token, self._get_recording_search_results)
+        async with aclosing(pages):
+            async for page in pages:
+                for recording in page["RecordingInformation"] or []:
+                    yield RecordingInformation.create(recording)
+
+    async def find_recordings(self) -> list[RecordingInformation]:
+        async with aclosing(self.iterate_recordings()) as recordings:
+            return [recording async for recording in recordings]
+
+    @async_timeout_checker
+    async def _start_event_search(
+        self,
+        start_point: datetime,
+        end_point: datetime | None,
+        recording_tokens: list[str] | None,
+        include_start_state: bool,
+    ) -> str:
+        self._check_service()
+        return await self.service.FindEvents(  # type: ignore
+            StartPoint=start_point,
+            EndPoint=end_point,
+            Scope={"IncludedRecordings": recording_tokens} if recording_tokens else {},
+            SearchFilter={},
+            IncludeStartState=include_start_state,
+            KeepAliveTime=timedelta(seconds=self.common.search_keep_alive),
+        )
+
+    @async_timeout_checker
+    async def _get_event_search_results(self, search_token: str) -> Any:
+        return await self.service.GetEventSearchResults(  # type: ignore
+            SearchToken=search_token,
+            MaxResults=self.common.search_page_size,
+            WaitTime=timedelta(seconds=self.common.search_wait_time),
+        )
+
+    async def iterate_events(
+        self,
+        start_point: datetime,
+        end_point: datetime | None = None,
+        recording_tokens: list[str] | None = None,
+        include_start_state: bool = False,
+    ) -> AsyncGenerator[EventSearchResult, None]:
+        search_token = await self._start_event_search(
+            start_point, end_point, recording_tokens, include_start_state
+        )
+        pages = self._iterate_pages(search_token, self._get_event_search_results)
+        async with aclosing(pages):
+            async for page in pages:
+                for result in page["Result"] or []:
+                    yield EventSearchResult.create(result)
+
+    async def get_recording_index(self) -> RecordingIndex:
+        """Recordings of the camera, cached so that every playback does not run a search"""
+
+        async def fetch() -> RecordingIndex:
+            return RecordingIndex(
+                camera=self.source.get_camera_key(), recordings=await self.find_recordings()
+            )
+
+        return await self._cached(
+            (CacheSection.SEARCH_RECORDINGS,), fetch, ttl=self.common.recordings_index_ttl
+        )
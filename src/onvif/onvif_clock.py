@@ -0,0 +1,91 @@
+"""Camera clock offsets and WS-Security tokens created in the camera's time"""
+
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from zeep.wsse.username import UsernameToken
+
+from src.onvif.onvif_metrics import metrics
+
+# Part of the ttl after which an offset is measured again, before it expires
+REFRESH_AFTER = 0.9
+
+
+class ClockOffsets:
+    """Seconds the camera clock is ahead of ours, per camera"""
+
+    def __init__(self) -> None:
+        # Offset, expiry and refresh time
+        self._offsets: dict[str, tuple[float, float, float]] = {}
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def get(self, camera_key: str) -> float | None:
+        if not (entry := self._offsets.get(camera_key)):
+            return None
+        offset, expires_at, _ = entry
+        if time.monotonic() >= expires_at:
+            del self._offsets[camera_key]
+            return None
+        return offset
+
+    def set(self, camera_key: str, offset: float, ttl: float) -> None:
+        now = time.monotonic()
+        self._offsets[camera_key] = (offset, now + ttl, now + ttl * REFRESH_AFTER)
+
+    def needs_refresh(self, camera_key: str) -> bool:
+        """True on first contact and shortly before the offset expires"""
+        entry = self._offsets.get(camera_key)
+        return entry is None or time.monotonic() >= entry[2]
+
+    async def measure(
+        self, camera_key: str, measure: Callable[[], Awaitable[float | None]], ttl: float
+    ) -> float | None:
+        """Measure the offset, concurrent callers for the same camera share one measurement"""
+        if (pending := self._pending.get(camera_key)) is None:
+            pending = asyncio.ensure_future(self._measure(camera_key, measure, ttl))
+            self._pending[camera_key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(camera_key, None))
+        return await asyncio.shield(pending)
+
+    async def _measure(
+        self, camera_key: str, measure: Callable[[], Awaitable[float | None]], ttl: float
+    ) -> float | None:
+        try:
+            offset = await measure()
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.debug("Clock offset of %s could not be measured: %r", camera_key, exc)
+            offset = None
+        if offset is None:
+            # The last known offset is kept, a camera which cannot be measured is not
+            # measured again before every request
+            self.set(camera_key, self.get(camera_key) or 0.0, ttl)
+            return None
+        self.set(camera_key, offset, ttl)
+        metrics.inc("clock_offset_refreshes")
+        return offset
+
+
+clock_offsets = ClockOffsets()
+
+
+class SkewedUsernameToken(UsernameToken):
+    """
+    UsernameToken with digest whose Created timestamp follows the camera clock, so cameras
+    with a drifted clock do not reject the token as expired or not yet valid.
+    """
+
+    def __init__(self, camera_key: str, username: str, password: str) -> None:
+        super().__init__(username, password, use_digest=True)
+        self.camera_key = camera_key
+
+    def apply(self, envelope, headers):
+        offset = clock_offsets.get(self.camera_key) or 0.0
+        # apply() runs synchronously, so concurrent requests do not see each other's time
+        self.created = datetime.utcnow() + timedelta(seconds=offset)
+        try:
+            return super().apply(envelope, headers)
+        finally:
+            self.created = None
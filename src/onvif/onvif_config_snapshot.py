@@ -0,0 +1,209 @@
+"""Configuration snapshots of cameras with change detection between fetches"""
+
+import json
+import hashlib
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings, run_fleet
+from src.onvif.onvif_client_media import MediaProfiles, OnvifClientMedia
+
+SECTION_ADDED = "added"
+SECTION_CHANGED = "changed"
+SECTION_REMOVED = "removed"
+
+
+def content_hash(value: Any) -> str:
+    """Hash which only depends on the content, not on key order or object identity"""
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _flatten(value: Any, path: str = "") -> dict[str, Any]:
+    if isinstance(value, dict) and value:
+        items: dict[str, Any] = {}
+        for key, item in value.items():
+            items.update(_flatten(item, f"{path}.{key}" if path else key))
+        return items
+    if isinstance(value, list) and value:
+        items = {}
+        for index, item in enumerate(value):
+            items.update(_flatten(item, f"{path}[{index}]"))
+        return items
+    return {path: value}
+
+
+@dataclass
+class FieldChange:
+    path: str
+    old: Any = None
+    new: Any = None
+
+
+def diff_values(old: dict, new: dict) -> list[FieldChange]:
+    old_fields, new_fields = _flatten(old), _flatten(new)
+    return [
+        FieldChange(path, old_fields.get(path), new_fields.get(path))
+        for path in sorted(old_fields.keys() | new_fields.keys())
+        if old_fields.get(path) != new_fields.get(path)
+    ]
+
+
+@dataclass
+class ConfigSection:
+    name: str
+    hash: str
+    value: dict
+
+    @staticmethod
+    def create(name: str, obj: Any) -> "ConfigSection":
+        value = asdict(obj)
+        return ConfigSection(name=name, hash=content_hash(value), value=value)
+
+
+@dataclass
+class SectionChange:
+    section: str
+    change: str
+    hash: str | None = None
+    value: dict | None = None
+    fields: list[FieldChange] = field(default_factory=list)
+
+
+@dataclass
+class ConfigChanges:
+    camera: str
+    hash: str | None = None
+    full: bool = False
+    changes: list[SectionChange] = field(default_factory=list)
+    error: str | None = None
+
+
+def get_config_sections(profiles: MediaProfiles) -> dict[str, ConfigSection]:
+    """
+    Split profiles into sections. Configurations shared by several profiles become one
+    section each, and a profile section only refers to them by token, so a changed
+    encoder is reported once instead of once per profile using it.
+    """
+    sections: dict[str, ConfigSection] = {}
+    for profile in profiles.profiles:
+        configurations = {
+            "video_encoder": profile.video_encoder_configuration,
+            "ptz_configuration": profile.ptz_configuration,
+            "metadata_configuration": profile.metadata_configuration,
+        }
+        for kind, configuration in configurations.items():
+            if configuration:
+                name = f"{kind}/{configuration.token}"
+                sections[name] = ConfigSection.create(name, configuration)
+        name = f"profile/{profile.token}"
+        sections[name] = ConfigSection.create(
+            name,
+            replace(
+                profile,
+                video_encoder_configuration=None,
+                ptz_configuration=None,
+                metadata_configuration=None,
+            ),
+        )
+        sections[name].value.update(
+            {
+                f"{kind}_token": configuration.token if configuration else None
+                for kind, configuration in configurations.items()
+            }
+        )
+        sections[name].hash = content_hash(sections[name].value)
+    return sections
+
+
+def diff_sections(
+    old: dict[str, ConfigSection], new: dict[str, ConfigSection]
+) -> list[SectionChange]:
+    changes = []
+    for name, section in new.items():
+        if not (previous := old.get(name)):
+            changes.append(SectionChange(name, SECTION_ADDED, section.hash, section.value))
+        elif previous.hash != section.hash:
+            changes.append(
+                SectionChange(
+                    name,
+                    SECTION_CHANGED,
+                    section.hash,
+                    section.value,
+                    diff_values(previous.value, section.value),
+                )
+            )
+    changes.extend(
+        SectionChange(name, SECTION_REMOVED, section.hash)
+        for name, section in old.items()
+        if name not in new
+    )
+    return changes
+
+
+CameraSections = dict[str, dict[str, ConfigSection]]
+
+
+class ConfigSnapshots:
+    """
+    Last snapshot of every camera delivered to each consumer, later fetches only return
+    what changed since then. Snapshots are committed once the changes are delivered, so a
+    response which never reaches its consumer is computed again on its next request.
+    """
+
+    def __init__(self) -> None:
+        self._snapshots: dict[tuple[str, str], dict[str, ConfigSection]] = {}
+
+    def diff(
+        self,
+        consumer: str,
+        camera_key: str,
+        sections: dict[str, ConfigSection],
+        full: bool = False,
+    ) -> ConfigChanges:
+        previous = self._snapshots.get((consumer, camera_key))
+        full = full or previous is None
+        return ConfigChanges(
+            camera=camera_key,
+            hash=content_hash(sorted((name, section.hash) for name, section in sections.items())),
+            full=full,
+            changes=diff_sections({} if full else previous or {}, sections),
+        )
+
+    def commit(self, consumer: str, snapshots: CameraSections) -> None:
+        for camera_key, sections in snapshots.items():
+            self._snapshots[consumer, camera_key] = sections
+
+    def reset(self, consumer: str, camera_key: str) -> None:
+        self._snapshots.pop((consumer, camera_key), None)
+
+
+config_snapshots = ConfigSnapshots()
+
+
+async def get_config_changes(
+    settings: OnvifClientSettings, consumer: str, full: bool = False
+) -> tuple[ConfigChanges, dict[str, ConfigSection] | None]:
+    """Changes since the snapshot delivered to the consumer and the snapshot to commit"""
+    client = await OnvifClientMedia.create_async(settings)
+    try:
+        sections = get_config_sections(await client.get_profiles())
+    finally:
+        await client.close()
+    camera_key = settings.source.get_camera_key()
+    return config_snapshots.diff(consumer, camera_key, sections, full), sections
+
+
+async def get_fleet_config_changes(
+    sources: list[Source], common: ONVIFSettings, consumer: str, full: bool = False
+) -> tuple[list[ConfigChanges], CameraSections]:
+    results = await run_fleet(
+        sources,
+        common,
+        lambda settings: get_config_changes(settings, consumer, full),
+        lambda camera, exc: (ConfigChanges(camera=camera, error=str(exc)), None),
+    )
+    snapshots = {changes.camera: sections for changes, sections in results if sections}
+    return [changes for changes, _ in results], snapshots
@@ -0,0 +1,53 @@
+"""Deadline of the API request which is served by the current task"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from typing import Any, Coroutine, Iterator
+
+import httpx
+
+# Event loop time after which the caller no longer waits for the answer
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None) -> Iterator[float | None]:
+    """Limit the current task to `seconds` from now, an outer deadline which is sooner wins"""
+    deadline = request_deadline.get()
+    if seconds is not None:
+        new_deadline = asyncio.get_running_loop().time() + seconds
+        deadline = new_deadline if deadline is None else min(deadline, new_deadline)
+    token = request_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        request_deadline.reset(token)
+
+
+def get_remaining() -> float | None:
+    if (deadline := request_deadline.get()) is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+def cap_timeout(timeout: httpx.Timeout) -> httpx.Timeout:
+    """Connect and read timeouts which end at the deadline at the latest"""
+    if (remaining := get_remaining()) is None:
+        return timeout
+    limit = max(remaining, 0.0)
+
+    def cap(value: float | None) -> float:
+        return limit if value is None else min(value, limit)
+
+    return httpx.Timeout(
+        connect=cap(timeout.connect),
+        read=cap(timeout.read),
+        write=cap(timeout.write),
+        pool=cap(timeout.pool),
+    )
+
+
+def create_background_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """Task which outlives the request that starts it, so it must not inherit its deadline"""
+    return asyncio.create_task(coro, context=Context())
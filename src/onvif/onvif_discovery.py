@@ -0,0 +1,141 @@
+"""WS-Discovery of onvif devices over asyncio UDP"""
+
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from xml.etree import ElementTree
+
+WS_DISCOVERY_ADDRESS = "239.255.255.250"
+WS_DISCOVERY_PORT = 3702
+
+SOAP_ENVELOPE_NS = "http://www.w3.org/2003/05/soap-envelope"
+WS_ADDRESSING_NS = "http://schemas.xmlsoap.org/ws/2004/08/addressing"
+WS_DISCOVERY_NS = "http://schemas.xmlsoap.org/ws/2005/04/discovery"
+NETWORK_VIDEO_TRANSMITTER_TYPE = "dn:NetworkVideoTransmitter"
+
+PROBE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="{soap}" xmlns:a="{addressing}" xmlns:d="{discovery}"
+ xmlns:dn="http://www.onvif.org/ver10/network/wsdl">
+<s:Header>
+<a:Action s:mustUnderstand="1">{discovery}/Probe</a:Action>
+<a:MessageID>urn:uuid:{message_id}</a:MessageID>
+<a:ReplyTo><a:Address>{addressing}/role/anonymous</a:Address></a:ReplyTo>
+<a:To s:mustUnderstand="1">urn:schemas-xmlsoap-org:ws:2005:04:discovery</a:To>
+</s:Header>
+<s:Body><d:Probe><d:Types>{types}</d:Types></d:Probe></s:Body>
+</s:Envelope>"""
+
+
+@dataclass
+class ProbeMatch:
+    endpoint_reference: str
+    xaddrs: list[str] = field(default_factory=list)
+    scopes: list[str] = field(default_factory=list)
+    types: list[str] = field(default_factory=list)
+    metadata_version: int | None = None
+    address: str | None = None
+
+    @staticmethod
+    def create(element: ElementTree.Element, address: str | None) -> "ProbeMatch":
+        def text(path: str) -> str:
+            found = element.find(path, NAMESPACES)
+            return (found.text or "").strip() if found is not None else ""
+
+        version = text("d:MetadataVersion")
+        return ProbeMatch(
+            endpoint_reference=text("a:EndpointReference/a:Address"),
+            xaddrs=text("d:XAddrs").split(),
+            scopes=text("d:Scopes").split(),
+            types=text("d:Types").split(),
+            metadata_version=int(version) if version.isdigit() else None,
+            address=address,
+        )
+
+
+NAMESPACES = {"s": SOAP_ENVELOPE_NS, "a": WS_ADDRESSING_NS, "d": WS_DISCOVERY_NS}
+
+
+def create_probe(message_id: str, types: str = NETWORK_VIDEO_TRANSMITTER_TYPE) -> bytes:
+    return PROBE_TEMPLATE.format(
+        soap=SOAP_ENVELOPE_NS,
+        addressing=WS_ADDRESSING_NS,
+        discovery=WS_DISCOVERY_NS,
+        message_id=message_id,
+        types=types,
+    ).encode()
+
+
+def parse_probe_matches(
+    data: bytes, message_id: str, address: str | None = None
+) -> list[ProbeMatch]:
+    """ProbeMatches which answer our probe, anything else (Hello, Bye, other probes) is ignored"""
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        return []
+    relates_to = root.find("s:Header/a:RelatesTo", NAMESPACES)
+    if relates_to is None or (relates_to.text or "").strip() != f"urn:uuid:{message_id}":
+        return []
+    matches = root.findall("s:Body/d:ProbeMatches/d:ProbeMatch", NAMESPACES)
+    return [
+        match
+        for match in (ProbeMatch.create(element, address) for element in matches)
+        if match.endpoint_reference
+    ]
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, message_id: str) -> None:
+        self.message_id = message_id
+        self.matches: dict[str, ProbeMatch] = {}
+        self.received = asyncio.Event()
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        for match in parse_probe_matches(data, self.message_id, addr[0]):
+            # Devices answer on every interface and repeat answers, the endpoint reference
+            # is the stable identity of the device
+            if match.endpoint_reference not in self.matches:
+                self.matches[match.endpoint_reference] = match
+                self.received.set()
+
+    def error_received(self, exc: Exception) -> None:
+        logging.debug("WS-Discovery socket error: %s", exc)
+
+
+async def probe(
+    timeout: float = 3.0,
+    target: tuple[str, int] = (WS_DISCOVERY_ADDRESS, WS_DISCOVERY_PORT),
+    repeats: int = 2,
+    max_matches: int | None = None,
+) -> list[ProbeMatch]:
+    """
+    Send Probe messages and collect ProbeMatches until the time budget is spent.
+    UDP is lossy, so the probe is repeated `repeats` times spread over the first half of
+    the budget. `target` can point to a unicast responder, e.g. a local test stand-in.
+    """
+    loop = asyncio.get_running_loop()
+    message_id = str(uuid.uuid4())
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _ProbeProtocol(message_id), local_addr=("0.0.0.0", 0)
+    )
+    try:
+        message = create_probe(message_id)
+        deadline = time.monotonic() + timeout
+        interval = timeout / 2 / max(repeats, 1)
+        for attempt in range(max(repeats, 1)):
+            if attempt:
+                await asyncio.sleep(interval)
+            transport.sendto(message, target)
+        while (remaining := deadline - time.monotonic()) > 0:
+            if max_matches and len(protocol.matches) >= max_matches:
+                break
+            protocol.received.clear()
+            try:
+                await asyncio.wait_for(protocol.received.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+    finally:
+        transport.close()
+    return list(protocol.matches.values())
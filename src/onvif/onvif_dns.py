@@ -0,0 +1,149 @@
+"""Cached asynchronous resolution of camera host names"""
+
+import time
+import socket
+import asyncio
+import ipaddress
+from dataclasses import dataclass
+
+import httpx
+import httpcore
+
+from src.onvif.onvif_metrics import metrics
+
+# Defaults of httpx, which only applies them when it creates the transport itself
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+DnsKey = tuple[str, int]
+
+
+class DnsResolutionError(OSError):
+    pass
+
+
+@dataclass
+class DnsEntry:
+    addresses: list[str]
+    expires: float
+    error: str | None = None
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DnsCache:
+    """
+    Resolved addresses of host names, shared by all clients. Failed lookups are cached for
+    `negative_ttl` and concurrent lookups of the same name wait for a single getaddrinfo.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[DnsKey, DnsEntry] = {}
+        self._pending: dict[DnsKey, asyncio.Future] = {}
+
+    async def resolve(self, host: str, port: int, ttl: float, negative_ttl: float) -> list[str]:
+        if is_ip_address(host):
+            return [host]
+        key = (host.lower(), port)
+        if (entry := self._entries.get(key)) and entry.expires > time.monotonic():
+            metrics.inc("dns_cache_hits", result="error" if entry.error else "ok")
+            if entry.error:
+                raise DnsResolutionError(entry.error)
+            return entry.addresses
+        if (pending := self._pending.get(key)) is None:
+            pending = asyncio.ensure_future(self._lookup(key, ttl, negative_ttl))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            metrics.inc("dns_lookups_deduplicated")
+        # A cancelled caller must not cancel the lookup the other callers are waiting for
+        resolved: DnsEntry = await asyncio.shield(pending)
+        if resolved.error:
+            raise DnsResolutionError(resolved.error)
+        return resolved.addresses
+
+    async def _lookup(self, key: DnsKey, ttl: float, negative_ttl: float) -> DnsEntry:
+        host, port = key
+        started = time.monotonic()
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+        except (socket.gaierror, UnicodeError) as exc:
+            entry = DnsEntry([], time.monotonic() + negative_ttl, f"Cannot resolve {host}: {exc}")
+        else:
+            # getaddrinfo can list an address once per protocol, keep the resolver's order
+            addresses = list(dict.fromkeys(str(info[4][0]) for info in infos))
+            entry = DnsEntry(addresses, time.monotonic() + ttl)
+        metrics.observe(
+            "dns_resolution_seconds",
+            time.monotonic() - started,
+            result="error" if entry.error else "ok",
+        )
+        self._entries[key] = entry
+        return entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+dns_cache = DnsCache()
+
+
+class ResolvingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend which connects to the cached addresses of the host. TLS is still
+    negotiated with the host name, so SNI and certificate checks are unchanged.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self, host, port, timeout=None, local_address=None, socket_options=None
+    ) -> httpcore.AsyncNetworkStream:
+        # The timeout covers the resolution and every address tried, not each of them
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            addresses = await asyncio.wait_for(
+                dns_cache.resolve(host, port, self.ttl, self.negative_ttl), timeout
+            )
+        except asyncio.TimeoutError as exc:
+            raise httpcore.ConnectTimeout(f"Resolving {host} timed out") from exc
+        except DnsResolutionError as exc:
+            raise httpcore.ConnectError(str(exc)) from exc
+        error: Exception | None = None
+        for address in addresses:
+            if deadline is not None and (timeout := deadline - time.monotonic()) <= 0:
+                raise httpcore.ConnectTimeout(f"Connecting to {host} timed out")
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout, local_address, socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as exc:
+                error = exc
+        raise error or httpcore.ConnectError(f"No address for {host}")
+
+    async def connect_unix_socket(
+        self, path, timeout=None, socket_options=None
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class ResolvingHTTPTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, ttl: float, negative_ttl: float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        # httpx does not take a network backend, its connection pool does
+        self._pool._network_backend = ResolvingNetworkBackend(  # pylint: disable=protected-access
+            ttl, negative_ttl
+        )
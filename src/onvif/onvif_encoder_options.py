@@ -0,0 +1,203 @@
+"""
+Video encoder settings shared by the media and media2 configurations, and their validation
+against the options the camera reports
+"""
+
+import copy
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Callable
+
+
+@dataclass
+class FloatRange:
+    min: float
+    max: float
+
+    @staticmethod
+    def create(obj: Any) -> "FloatRange":
+        return FloatRange(min=obj["Min"], max=obj["Max"])
+
+
+@dataclass
+class VideoResolution:
+    width: int
+    height: int
+
+    @staticmethod
+    def create(obj: Any) -> "VideoResolution":
+        return VideoResolution(width=obj["Width"], height=obj["Height"])
+
+
+@dataclass
+class VideoEncoderSettings:
+    """Encoder parameters shared by media and media2 configurations, None means unset"""
+
+    encoding: str | None = None
+    width: int | None = None
+    height: int | None = None
+    quality: float | None = None
+    frame_rate_limit: float | None = None
+    bitrate_limit: int | None = None
+    gov_length: int | None = None
+    profile: str | None = None
+
+    def merge(self, change: "VideoEncoderSettings") -> "VideoEncoderSettings":
+        changes = {key: value for key, value in asdict(change).items() if value is not None}
+        return replace(self, **changes)
+
+
+@dataclass(frozen=True)
+class EncoderLayout:
+    """
+    Where a VideoEncoderConfiguration keeps the fields of VideoEncoderSettings. Media nests
+    GovLength and the profile in its H264 element, media2 keeps them in the configuration.
+    """
+
+    codec: str | None
+    profile: str
+    frame_rate: Callable[[float], float]
+
+
+MEDIA_ENCODER_LAYOUT = EncoderLayout(codec="H264", profile="H264Profile", frame_rate=int)
+MEDIA2_ENCODER_LAYOUT = EncoderLayout(codec=None, profile="Profile", frame_rate=float)
+
+
+def get_video_encoder_settings(obj: Any, layout: EncoderLayout) -> VideoEncoderSettings:
+    rate_control = obj["RateControl"]
+    codec = obj[layout.codec] if layout.codec else obj
+    return VideoEncoderSettings(
+        encoding=obj["Encoding"],
+        width=obj["Resolution"]["Width"],
+        height=obj["Resolution"]["Height"],
+        quality=obj["Quality"],
+        frame_rate_limit=rate_control["FrameRateLimit"] if rate_control else None,
+        bitrate_limit=rate_control["BitrateLimit"] if rate_control else None,
+        gov_length=codec["GovLength"] if codec else None,
+        profile=codec[layout.profile] if codec else None,
+    )
+
+
+def apply_video_encoder_settings(
+    obj: Any, settings: VideoEncoderSettings, layout: EncoderLayout
+) -> Any:
+    """Copy of the configuration object with the settings, fields it has no place for are kept"""
+    obj = copy.deepcopy(obj)
+    obj["Encoding"] = settings.encoding
+    obj["Resolution"]["Width"] = settings.width
+    obj["Resolution"]["Height"] = settings.height
+    obj["Quality"] = settings.quality
+    if rate_control := obj["RateControl"]:
+        if settings.frame_rate_limit is not None:
+            rate_control["FrameRateLimit"] = layout.frame_rate(settings.frame_rate_limit)
+        rate_control["BitrateLimit"] = settings.bitrate_limit
+    if codec := obj[layout.codec] if layout.codec else obj:
+        codec["GovLength"] = settings.gov_length
+        codec[layout.profile] = settings.profile
+    return obj
+
+
+def _float_range(obj: Any) -> FloatRange | None:
+    return FloatRange.create(obj) if obj else None
+
+
+def _in_range(value: float | None, value_range: FloatRange | None) -> bool:
+    return value is None or value_range is None or value_range.min <= value <= value_range.max
+
+
+@dataclass
+class VideoEncodingOptions:
+    quality_range: FloatRange | None = None
+    resolutions: list[VideoResolution] = field(default_factory=list)
+    frame_rate_range: FloatRange | None = None
+    frame_rates: list[float] = field(default_factory=list)
+    bitrate_range: FloatRange | None = None
+    gov_length_range: FloatRange | None = None
+    profiles: list[str] = field(default_factory=list)
+
+    def validate(self, settings: VideoEncoderSettings) -> list[str]:
+        errors = []
+        if not _in_range(settings.quality, self.quality_range):
+            errors.append(f"Quality {settings.quality} is out of {self.quality_range}")
+        resolution = VideoResolution(width=settings.width or 0, height=settings.height or 0)
+        if self.resolutions and resolution not in self.resolutions:
+            errors.append(f"Resolution {resolution.width}x{resolution.height} is not available")
+        if not _in_range(settings.frame_rate_limit, self.frame_rate_range) or (
+            self.frame_rates
+            and settings.frame_rate_limit is not None
+            and settings.frame_rate_limit not in self.frame_rates
+        ):
+            errors.append(f"Frame rate {settings.frame_rate_limit} is not supported")
+        if not _in_range(settings.bitrate_limit, self.bitrate_range):
+            errors.append(f"Bitrate {settings.bitrate_limit} is out of {self.bitrate_range}")
+        if settings.gov_length is not None and (
+            not self.gov_length_range or not _in_range(settings.gov_length, self.gov_length_range)
+        ):
+            errors.append(f"GOV length {settings.gov_length} is not supported")
+        if settings.profile is not None and self.profiles and settings.profile not in self.profiles:
+            errors.append(f"Profile {settings.profile} is not supported")
+        return errors
+
+
+@dataclass
+class VideoEncoderOptions:
+    encodings: dict[str, VideoEncodingOptions] = field(default_factory=dict)
+
+    def validate(self, settings: VideoEncoderSettings) -> list[str]:
+        if not (options := self.encodings.get(settings.encoding or "")):
+            return [f"Encoding {settings.encoding} is not supported"]
+        return options.validate(settings)
+
+    @staticmethod
+    def create(obj: Any) -> "VideoEncoderOptions":
+        quality_range = _float_range(obj["QualityRange"])
+        extension = obj["Extension"]
+        encodings = {}
+        for encoding, profiles_name in [
+            ("JPEG", None),
+            ("MPEG4", "Mpeg4ProfilesSupported"),
+            ("H264", "H264ProfilesSupported"),
+        ]:
+            if not (options := obj[encoding]):
+                continue
+            bitrate = extension[encoding] if extension else None
+            encodings[encoding] = VideoEncodingOptions(
+                quality_range=quality_range,
+                resolutions=[
+                    VideoResolution.create(resolution)
+                    for resolution in options["ResolutionsAvailable"] or []
+                ],
+                frame_rate_range=_float_range(options["FrameRateRange"]),
+                bitrate_range=_float_range(bitrate["BitrateRange"]) if bitrate else None,
+                gov_length_range=(
+                    _float_range(options["GovLengthRange"]) if encoding != "JPEG" else None
+                ),
+                profiles=list(options[profiles_name] or []) if profiles_name else [],
+            )
+        return VideoEncoderOptions(encodings=encodings)
+
+    @staticmethod
+    def create_media2(objs: Any) -> "VideoEncoderOptions":
+        """Media2 returns one options element per encoding, list attributes may come as text"""
+
+        def to_list(value: Any) -> list:
+            return value.split() if isinstance(value, str) else list(value or [])
+
+        encodings = {}
+        for obj in objs:
+            gov_length_range = [int(value) for value in to_list(obj["GovLengthRange"])]
+            encodings[obj["Encoding"]] = VideoEncodingOptions(
+                quality_range=_float_range(obj["QualityRange"]),
+                resolutions=[
+                    VideoResolution.create(resolution)
+                    for resolution in obj["ResolutionsAvailable"] or []
+                ],
+                frame_rates=[float(value) for value in to_list(obj["FrameRatesSupported"])],
+                bitrate_range=_float_range(obj["BitrateRange"]),
+                gov_length_range=(
+                    FloatRange(min=min(gov_length_range), max=max(gov_length_range))
+                    if gov_length_range
+                    else None
+                ),
+                profiles=to_list(obj["ProfilesSupported"]),
+            )
+        return VideoEncoderOptions(encodings=encodings)
@@ -0,0 +1,152 @@
+"""Rollout of video encoder changes to many cameras"""
+
+import asyncio
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import AsyncGenerator
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_media import OnvifClientMedia
+from src.onvif.onvif_client_media_2 import OnvifClientMedia2
+from src.onvif.onvif_config_snapshot import FieldChange, diff_values
+from src.onvif.onvif_encoder_options import (
+    VideoEncoderSettings,
+    apply_video_encoder_settings,
+    get_video_encoder_settings,
+)
+from src.onvif.onvif_rate_limit import TokenBucket
+
+PUSH_PLANNED = "planned"
+PUSH_UNCHANGED = "unchanged"
+PUSH_INVALID = "invalid"
+PUSH_APPLIED = "applied"
+PUSH_FAILED = "failed"
+PUSH_ROLLED_BACK = "rolled_back"
+PUSH_ROLLBACK_FAILED = "rollback_failed"
+
+
+@dataclass
+class EncoderChange:
+    configuration_token: str
+    before: VideoEncoderSettings
+    after: VideoEncoderSettings
+    fields: list[FieldChange] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+@dataclass
+class CameraEncoderPush:
+    camera: str
+    status: str
+    encoders: list[EncoderChange] = field(default_factory=list)
+    error: str | None = None
+
+
+async def push_camera_encoders(
+    settings: OnvifClientSettings,
+    change: VideoEncoderSettings,
+    configuration_tokens: list[str] | None = None,
+    media2: bool = True,
+    dry_run: bool = False,
+    rollback: bool = True,
+) -> CameraEncoderPush:
+    """
+    Validate the change of every encoder of the camera before anything is sent, then apply
+    them one by one. When one of them fails, the encoders changed so far are restored.
+    """
+    camera = settings.source.get_camera_key()
+    client: OnvifClientMedia | OnvifClientMedia2 = await (
+        OnvifClientMedia2 if media2 else OnvifClientMedia
+    ).create_async(settings)
+    try:
+        # Cameras handle configuration changes slowly, requests to one camera are paced
+        bucket = TokenBucket(settings.common.encoder_push_rate, 1)
+
+        plans = []
+        for token in configuration_tokens or await client.get_video_encoder_configuration_tokens():
+            await bucket.acquire()
+            obj = await client.get_video_encoder_configuration_object(token)
+            before = get_video_encoder_settings(obj, client.ENCODER_LAYOUT)
+            after = before.merge(change)
+            options = await client.get_video_encoder_configuration_options(token)
+            fields = diff_values(asdict(before), asdict(after))
+            plans.append(
+                (obj, EncoderChange(token, before, after, fields, options.validate(after)))
+            )
+        encoders = [encoder for _, encoder in plans]
+
+        if any(encoder.errors for encoder in encoders):
+            return CameraEncoderPush(camera, PUSH_INVALID, encoders)
+        if not (changed := [(obj, encoder) for obj, encoder in plans if encoder.fields]):
+            return CameraEncoderPush(camera, PUSH_UNCHANGED, encoders)
+        if dry_run:
+            return CameraEncoderPush(camera, PUSH_PLANNED, encoders)
+
+        applied = []
+        try:
+            for obj, encoder in changed:
+                await bucket.acquire()
+                await client.set_video_encoder_configuration(
+                    apply_video_encoder_settings(obj, encoder.after, client.ENCODER_LAYOUT)
+                )
+                applied.append(obj)
+        except Exception as exc:  # pylint: disable=broad-except
+            if not (rollback and applied):
+                return CameraEncoderPush(camera, PUSH_FAILED, encoders, str(exc))
+            status = PUSH_ROLLED_BACK
+            for obj in reversed(applied):
+                await bucket.acquire()
+                try:
+                    await client.set_video_encoder_configuration(obj)
+                except Exception as rollback_exc:  # pylint: disable=broad-except
+                    logging.warning("Rollback of encoder on %s failed: %s", camera, rollback_exc)
+                    status = PUSH_ROLLBACK_FAILED
+            return CameraEncoderPush(camera, status, encoders, str(exc))
+        return CameraEncoderPush(camera, PUSH_APPLIED, encoders)
+    finally:
+        await client.close()
+
+
+async def push_fleet_encoders(
+    sources: list[Source],
+    common: ONVIFSettings,
+    change: VideoEncoderSettings,
+    configuration_tokens: list[str] | None = None,
+    media2: bool = True,
+    dry_run: bool = False,
+    rollback: bool = True,
+    concurrency: int | None = None,
+) -> AsyncGenerator[CameraEncoderPush, None]:
+    """
+    Yield the result of every camera as soon as it is done. When the consumer goes away,
+    cameras which have not started are skipped, the ones in progress are finished so that
+    no camera is left half changed.
+    """
+    semaphore = asyncio.Semaphore(concurrency or common.fleet_concurrency)
+    closed = False
+
+    async def push(source: Source) -> CameraEncoderPush | None:
+        async with semaphore:
+            if closed:
+                return None
+            try:
+                return await push_camera_encoders(
+                    OnvifClientSettings(source=source, common=common),
+                    change,
+                    configuration_tokens,
+                    media2,
+                    dry_run,
+                    rollback,
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                return CameraEncoderPush(source.get_camera_key(), PUSH_FAILED, error=str(exc))
+
+    tasks = [asyncio.create_task(push(source)) for source in sources]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if result := await next_done:
+                yield result
+    finally:
+        closed = True
@@ -0,0 +1,58 @@
+"""Reuse of serialized SOAP envelopes for operations without arguments"""
+
+import copy
+from typing import Any
+
+from lxml import etree
+from zeep import AsyncClient
+from zeep.proxy import AsyncServiceProxy
+
+from src.onvif.onvif_offload import process_reply
+
+# (wsdl path, binding name, operation) -> envelope without WS-Security and its http headers
+EnvelopeKey = tuple[str, str, str]
+
+_envelopes: dict[EnvelopeKey, tuple[etree._Element, dict[str, str]]] = {}
+
+
+def render_envelope(
+    client: AsyncClient, service: AsyncServiceProxy, wsdl_path: str, operation: str
+) -> tuple[etree._Element, dict[str, str]]:
+    """
+    Envelope of the operation with a fresh WS-Security header. The body is serialized by
+    zeep once per wsdl and operation, later calls copy it and only apply the security header.
+    """
+    binding = service._binding  # pylint: disable=protected-access
+    key = (wsdl_path, binding.name.text, operation)
+    if (template := _envelopes.get(key)) is None:
+        operation_obj = binding.get(operation)
+        serialized = operation_obj.create()
+        binding._set_http_headers(serialized, operation_obj)  # pylint: disable=protected-access
+        template = _envelopes[key] = (serialized.content, dict(serialized.headers))
+    envelope, http_headers = copy.deepcopy(template[0]), dict(template[1])
+    if client.wsse:
+        envelope, http_headers = client.wsse.apply(envelope, http_headers)
+    return envelope, http_headers
+
+
+def can_prerender(client: AsyncClient, service: AsyncServiceProxy, operation: str) -> bool:
+    """Plugins and WS-Addressing may change the envelope per call, those take the zeep path"""
+    operation_obj = service._binding.get(operation)  # pylint: disable=protected-access
+    return not (
+        client.plugins
+        or operation_obj.abstract.wsa_action
+        or client.settings.extra_http_headers
+        or isinstance(client.wsse, list)
+    )
+
+
+async def call_prerendered(
+    client: AsyncClient, service: AsyncServiceProxy, wsdl_path: str, operation: str
+) -> Any:
+    if not can_prerender(client, service, operation):
+        return await getattr(service, operation)()
+    envelope, http_headers = render_envelope(client, service, wsdl_path, operation)
+    binding = service._binding  # pylint: disable=protected-access
+    address = service._binding_options["address"]  # pylint: disable=protected-access
+    response = await client.transport.post_xml(address, envelope, http_headers)
+    return await process_reply(client, binding, operation, response)
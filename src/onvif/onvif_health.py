@@ -0,0 +1,89 @@
+"""Health state of cameras, published by the health scheduler and consulted by clients"""
+
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+
+class CameraStatus(str, Enum):
+    UNKNOWN = "unknown"
+    UP = "up"
+    DOWN = "down"
+
+
+class CameraUnavailableError(Exception):
+    pass
+
+
+@dataclass
+class CameraHealth:
+    camera: str
+    status: CameraStatus = CameraStatus.UNKNOWN
+    consecutive_failures: int = 0
+    last_check: float | None = None
+    last_success: float | None = None
+    latency: float | None = None
+    clock_offset: float | None = None
+    error: str | None = None
+
+
+class HealthRegistry:
+    def __init__(self) -> None:
+        self._health: dict[str, CameraHealth] = {}
+
+    def get(self, camera_key: str) -> CameraHealth | None:
+        return self._health.get(camera_key)
+
+    def list(self) -> list[CameraHealth]:
+        return list(self._health.values())
+
+    def remove(self, camera_key: str) -> None:
+        self._health.pop(camera_key, None)
+
+    def report_success(
+        self, camera_key: str, latency: float, clock_offset: float | None = None
+    ) -> CameraHealth:
+        health = self._health.setdefault(camera_key, CameraHealth(camera=camera_key))
+        health.status = CameraStatus.UP
+        health.consecutive_failures = 0
+        health.last_check = health.last_success = time.time()
+        health.latency = latency
+        health.clock_offset = clock_offset
+        health.error = None
+        return health
+
+    def report_failure(self, camera_key: str, error: str, down_after: int) -> CameraHealth:
+        health = self._health.setdefault(camera_key, CameraHealth(camera=camera_key))
+        health.consecutive_failures += 1
+        health.last_check = time.time()
+        health.error = error
+        if health.consecutive_failures >= down_after:
+            health.status = CameraStatus.DOWN
+        return health
+
+    def report_available(self, camera_key: str) -> None:
+        """A request got an answer from the camera, so a camera marked down has recovered"""
+        health = self._health.get(camera_key)
+        if health and health.status == CameraStatus.DOWN:
+            health.status = CameraStatus.UP
+            health.consecutive_failures = 0
+            health.last_check = health.last_success = time.time()
+            health.error = None
+
+    def check_available(self, camera_key: str, probe_after: float) -> None:
+        """
+        Fail fast instead of waiting for the request timeout of a camera known to be down.
+        Once the down state is older than `probe_after` one request is let through as a
+        probe, so a recovered camera does not wait for the next scheduled health check.
+        """
+        health = self._health.get(camera_key)
+        if not health or health.status != CameraStatus.DOWN:
+            return
+        now = time.time()
+        if health.last_check is None or now - health.last_check >= probe_after:
+            health.last_check = now
+            return
+        raise CameraUnavailableError(f"Camera {camera_key} is down: {health.error}")
+
+
+camera_health = HealthRegistry()
@@ -0,0 +1,183 @@
+"""Background health checks of registered cameras"""
+
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass
+
+from zeep.exceptions import Fault
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientServiceError, OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_clock import clock_offsets
+from src.onvif.onvif_health import CameraHealth, camera_health
+from src.onvif.onvif_metrics import metrics
+from src.onvif.onvif_rate_limit import TokenBucket
+from src.onvif.onvif_registry import camera_registry
+
+REGISTRY_SYNC_INTERVAL = 5.0
+
+
+@dataclass
+class _ScheduledCamera:
+    settings: OnvifClientSettings
+    client: OnvifClientDevice | None = None
+    check: asyncio.Task | None = None
+
+
+class HealthScheduler:
+    """
+    Periodically sends GetSystemDateAndTime to every registered camera.
+    Due checks are kept in a priority queue ordered by their due time. Intervals are
+    jittered per camera so a fleet registered at once does not stay in lockstep, checks of
+    failing cameras back off exponentially, and a global token bucket bounds the rate of
+    checks sent to the network.
+    """
+
+    def __init__(self) -> None:
+        self._cameras: dict[str, _ScheduledCamera] = {}
+        self._queue: list[tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._checks: set[asyncio.Task] = set()
+        self._registry_version: int | None = None
+        self.common = ONVIFSettings()
+
+    def start(self, common: ONVIFSettings) -> None:
+        if not common.health_enabled or self._task:
+            return
+        self.common = common
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def register(self, source: Source) -> CameraHealth:
+        camera_key = source.get_camera_key()
+        if camera_key not in self._cameras:
+            self._cameras[camera_key] = _ScheduledCamera(
+                OnvifClientSettings(source=source, common=self.common, check_health=False)
+            )
+            # The first check of every camera is spread over one interval
+            self._schedule(camera_key, random.uniform(0, self.common.health_check_interval))
+        return camera_health.get(camera_key) or CameraHealth(camera=camera_key)
+
+    async def unregister(self, camera_key: str) -> None:
+        """Stop checking the camera, its running check is cancelled and its client closed"""
+        # Entries left in the queue are skipped when they become due
+        if camera := self._cameras.pop(camera_key, None):
+            if camera.check:
+                camera.check.cancel()
+                await asyncio.gather(camera.check, return_exceptions=True)
+            await self._close_client(camera)
+        camera_health.remove(camera_key)
+
+    @staticmethod
+    async def _close_client(camera: _ScheduledCamera) -> None:
+        if client := camera.client:
+            camera.client = None
+            await client.close()
+
+    def _schedule(self, camera_key: str, delay: float) -> None:
+        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), camera_key))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _get_interval(self, failures: int) -> float:
+        interval = min(
+            self.common.health_check_interval * 2**failures, self.common.health_check_max_interval
+        )
+        jitter = self.common.health_check_jitter
+        return interval * random.uniform(1 - jitter, 1 + jitter)
+
+    def _sync_registry(self) -> None:
+        # The registry is walked only after discovery changed it
+        if camera_registry.version == self._registry_version:
+            return
+        self._registry_version = camera_registry.version
+        for camera in camera_registry.list():
+            if camera.endpoint_reference not in self._cameras:
+                self.register(Source.parse_obj({"endpoint_reference": camera.endpoint_reference}))
+
+    async def _wait(self, timeout: float) -> None:
+        assert self._wakeup
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        bucket = TokenBucket(self.common.health_check_rate, self.common.health_check_burst)
+        semaphore = asyncio.Semaphore(self.common.health_check_concurrency)
+        while True:
+            self._sync_registry()
+            if not self._queue or (delay := self._queue[0][0] - time.monotonic()) > 0:
+                await self._wait(
+                    min(delay, REGISTRY_SYNC_INTERVAL) if self._queue else REGISTRY_SYNC_INTERVAL
+                )
+                continue
+            _, _, camera_key = heapq.heappop(self._queue)
+            if not (camera := self._cameras.get(camera_key)):
+                continue
+            await bucket.acquire()
+            await semaphore.acquire()
+            task = camera.check = asyncio.create_task(self._check(camera_key))
+            self._checks.add(task)
+            task.add_done_callback(self._checks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _check(self, camera_key: str) -> None:
+        if not (camera := self._cameras.get(camera_key)):
+            return
+        started = time.monotonic()
+        try:
+            client = camera.client or await OnvifClientDevice.create_async(camera.settings)
+            camera.client = client
+            date_time = await asyncio.wait_for(
+                client.get_system_date_and_time(), self.common.health_check_timeout
+            )
+            latency = time.monotonic() - started
+            clock_offset = date_time.get_clock_offset(time.time() - latency / 2)
+            if clock_offset is not None:
+                clock_offsets.set(camera_key, clock_offset, self.common.clock_offset_ttl)
+            health = camera_health.report_success(camera_key, latency, clock_offset)
+        except OnvifClientServiceError as exc:
+            latency = time.monotonic() - started
+            if isinstance(exc.__cause__, Fault):
+                # The camera answered, it only refused the request
+                health = camera_health.report_success(camera_key, latency)
+            else:
+                health = self._report_failure(camera_key, exc)
+        except Exception as exc:  # pylint: disable=broad-except
+            latency = time.monotonic() - started
+            health = self._report_failure(camera_key, exc)
+        metrics.observe("health_check_latency", latency, status=health.status.value)
+        if camera_key in self._cameras:
+            self._schedule(camera_key, self._get_interval(health.consecutive_failures))
+
+    def _report_failure(self, camera_key: str, exc: Exception) -> CameraHealth:
+        logging.debug("Health check of %s failed: %r", camera_key, exc)
+        metrics.inc("health_check_failures")
+        return camera_health.report_failure(
+            camera_key, str(exc) or type(exc).__name__, self.common.health_down_after
+        )
+
+    async def stop(self) -> None:
+        tasks = [task for task in [self._task, *self._checks] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._checks.clear()
+        await asyncio.gather(
+            *(self._close_client(camera) for camera in self._cameras.values()),
+            return_exceptions=True,
+        )
+
+
+health_scheduler = HealthScheduler()
@@ -0,0 +1,303 @@
+"""Local store of camera metadata, answers fleet queries without contacting the cameras"""
+
+import re
+import time
+import asyncio
+import logging
+import sqlite3
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+from src.config import CommonSettings, ONVIFSettings
+from src.model.inventory import InventoryQuery
+from src.onvif.onvif_storage import get_private_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cameras (
+    camera TEXT PRIMARY KEY,
+    manufacturer TEXT,
+    model TEXT,
+    firmware_version TEXT,
+    firmware_key TEXT,
+    serial_number TEXT,
+    hardware_id TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cameras_model ON cameras (manufacturer, model);
+CREATE INDEX IF NOT EXISTS cameras_firmware ON cameras (firmware_key);
+CREATE TABLE IF NOT EXISTS profiles (
+    camera TEXT NOT NULL,
+    token TEXT NOT NULL,
+    name TEXT,
+    video_source_token TEXT,
+    video_encoder_token TEXT,
+    PRIMARY KEY (camera, token)
+);
+CREATE TABLE IF NOT EXISTS encoders (
+    camera TEXT NOT NULL,
+    token TEXT NOT NULL,
+    name TEXT,
+    encoding TEXT,
+    width INTEGER,
+    height INTEGER,
+    frame_rate_limit REAL,
+    bitrate_limit INTEGER,
+    gov_length INTEGER,
+    profile TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (camera, token)
+);
+CREATE INDEX IF NOT EXISTS encoders_encoding ON encoders (encoding, camera);
+CREATE TABLE IF NOT EXISTS services (
+    camera TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    xaddr TEXT,
+    version TEXT,
+    PRIMARY KEY (camera, namespace)
+);
+CREATE INDEX IF NOT EXISTS services_namespace ON services (namespace, camera);
+"""
+
+DEVICE_FIELDS = ("manufacturer", "model", "firmware_version", "serial_number", "hardware_id")
+
+# Below the default SQLITE_MAX_VARIABLE_NUMBER of old SQLite versions
+MAX_QUERY_VARIABLES = 500
+
+
+def firmware_sort_key(version: str | None) -> str | None:
+    """
+    Key which sorts firmware versions numerically as text, so "7.10" > "7.9" holds in SQL.
+    Every digit group is zero padded, other characters are kept as they are.
+    """
+    if version is None:
+        return None
+    return re.sub(r"\d+", lambda match: match.group().zfill(10), version.strip())
+
+
+@dataclass
+class EncoderSummary:
+    token: str
+    name: str | None = None
+    encoding: str | None = None
+    width: int | None = None
+    height: int | None = None
+    frame_rate_limit: float | None = None
+    bitrate_limit: int | None = None
+    gov_length: int | None = None
+    profile: str | None = None
+
+
+@dataclass
+class ProfileSummary:
+    token: str
+    name: str | None = None
+    video_source_token: str | None = None
+    video_encoder_token: str | None = None
+
+
+@dataclass
+class ServiceSummary:
+    namespace: str
+    xaddr: str | None = None
+    version: str | None = None
+
+
+@dataclass
+class CameraMetadata:
+    camera: str
+    manufacturer: str | None = None
+    model: str | None = None
+    firmware_version: str | None = None
+    serial_number: str | None = None
+    hardware_id: str | None = None
+    updated_at: float | None = None
+    profiles: list[ProfileSummary] = field(default_factory=list)
+    encoders: list[EncoderSummary] = field(default_factory=list)
+    services: list[ServiceSummary] = field(default_factory=list)
+
+
+def _chunks(items: list[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _log_write_error(future: Future) -> None:
+    if exc := future.exception():
+        logging.warning("Writing the metadata store failed: %r", exc)
+
+
+class MetadataStore:
+    """
+    Every database call runs in one thread owned by the store. Updates come from the hot
+    paths of the clients, they are queued to that thread and the caller does not wait.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="onvif-metadata")
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # The store is rebuilt by the next requests, the last commits may be lost on power loss
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def _submit(self, func: Callable[..., Any], *args: Any) -> None:
+        self._executor.submit(func, *args).add_done_callback(_log_write_error)
+
+    def update_device_information(self, camera_key: str, information: dict) -> None:
+        self._submit(self._update_device_information, camera_key, information)
+
+    def update_profiles(self, camera_key: str, profiles: list[ProfileSummary]) -> None:
+        self._submit(self._update_profiles, camera_key, profiles)
+
+    def update_encoders(self, camera_key: str, encoders: list[EncoderSummary]) -> None:
+        """Replace the encoders of the camera, the last media or media2 fetch wins"""
+        self._submit(self._update_encoders, camera_key, encoders, time.time())
+
+    def update_services(self, camera_key: str, services: list[ServiceSummary]) -> None:
+        self._submit(self._update_services, camera_key, services)
+
+    def _update_device_information(self, camera_key: str, information: dict) -> None:
+        values = [information.get(name) for name in DEVICE_FIELDS]
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO cameras (camera, manufacturer, model, firmware_version, "
+                "serial_number, hardware_id, firmware_key, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (camera) DO UPDATE SET manufacturer = excluded.manufacturer, "
+                "model = excluded.model, firmware_version = excluded.firmware_version, "
+                "serial_number = excluded.serial_number, hardware_id = excluded.hardware_id, "
+                "firmware_key = excluded.firmware_key, updated_at = excluded.updated_at",
+                (
+                    camera_key,
+                    *values,
+                    firmware_sort_key(information.get("firmware_version")),
+                    time.time(),
+                ),
+            )
+
+    def _update_profiles(self, camera_key: str, profiles: list[ProfileSummary]) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM profiles WHERE camera = ?", (camera_key,))
+            self._connection.executemany(
+                "INSERT INTO profiles VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        camera_key,
+                        profile.token,
+                        profile.name,
+                        profile.video_source_token,
+                        profile.video_encoder_token,
+                    )
+                    for profile in profiles
+                ],
+            )
+
+    def _update_encoders(self, camera_key: str, encoders: list[EncoderSummary], now: float) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM encoders WHERE camera = ?", (camera_key,))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO encoders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        camera_key,
+                        encoder.token,
+                        encoder.name,
+                        encoder.encoding,
+                        encoder.width,
+                        encoder.height,
+                        encoder.frame_rate_limit,
+                        encoder.bitrate_limit,
+                        encoder.gov_length,
+                        encoder.profile,
+                        now,
+                    )
+                    for encoder in encoders
+                ],
+            )
+
+    def _update_services(self, camera_key: str, services: list[ServiceSummary]) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM services WHERE camera = ?", (camera_key,))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO services VALUES (?, ?, ?, ?)",
+                [
+                    (camera_key, service.namespace, service.xaddr, service.version)
+                    for service in services
+                ],
+            )
+
+    async def query(self, query: InventoryQuery) -> list[CameraMetadata]:
+        """Cameras matching every given filter, queued behind the pending updates"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._query, query)
+
+    def _query(self, query: InventoryQuery) -> list[CameraMetadata]:
+        conditions: list[str] = []
+        params: list[str | None] = []
+        for column, value in [("manufacturer", query.manufacturer), ("model", query.model)]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if query.firmware_below is not None:
+            conditions.append("firmware_key < ?")
+            params.append(firmware_sort_key(query.firmware_below))
+        if query.firmware_at_least is not None:
+            conditions.append("firmware_key >= ?")
+            params.append(firmware_sort_key(query.firmware_at_least))
+        if query.encoding is not None:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM encoders "
+                "WHERE encoders.encoding = ? AND encoders.camera = cameras.camera)"
+            )
+            params.append(query.encoding)
+        if query.service is not None:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM services "
+                "WHERE services.namespace = ? AND services.camera = cameras.camera)"
+            )
+            params.append(query.service)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection.execute(
+            f"SELECT camera, {', '.join(DEVICE_FIELDS)}, updated_at FROM cameras {where} "
+            "ORDER BY camera",
+            params,
+        ).fetchall()
+        cameras = {row[0]: CameraMetadata(*row) for row in rows}
+        # One IN list per chunk, SQLite limits the number of variables of a statement
+        for keys in _chunks(list(cameras), MAX_QUERY_VARIABLES):
+            self._add_details(cameras, keys)
+        return list(cameras.values())
+
+    def _add_details(self, cameras: dict[str, CameraMetadata], keys: list[str]) -> None:
+        placeholders = ", ".join("?" * len(keys))
+        for row in self._connection.execute(
+            f"SELECT * FROM profiles WHERE camera IN ({placeholders}) ORDER BY camera, token",
+            keys,
+        ):
+            cameras[row[0]].profiles.append(ProfileSummary(*row[1:]))
+        for row in self._connection.execute(
+            f"SELECT * FROM encoders WHERE camera IN ({placeholders}) ORDER BY camera, token",
+            keys,
+        ):
+            cameras[row[0]].encoders.append(EncoderSummary(*row[1:-1]))
+        for row in self._connection.execute(
+            f"SELECT * FROM services WHERE camera IN ({placeholders}) ORDER BY camera, namespace",
+            keys,
+        ):
+            cameras[row[0]].services.append(ServiceSummary(*row[1:]))
+
+    def close(self) -> None:
+        """Wait for the queued updates and close the database"""
+        self._executor.shutdown(wait=True)
+        self._connection.close()
+
+
+def create_metadata_store(settings: ONVIFSettings) -> MetadataStore | None:
+    if not settings.metadata_store_enabled:
+        return None
+    return MetadataStore(get_private_path(settings, settings.metadata_store_path))
+
+
+metadata_store = create_metadata_store(CommonSettings().onvif_settings)
@@ -0,0 +1,69 @@
+"""In-process metrics for onvif clients"""
+
+from collections import deque
+from dataclasses import dataclass, field
+
+Labels = tuple[tuple[str, str], ...]
+
+SUMMARY_WINDOW = 1024
+
+
+@dataclass
+class Summary:
+    count: int = 0
+    total: float = 0.0
+    min: float | None = None
+    max: float | None = None
+    window: deque = field(default_factory=lambda: deque(maxlen=SUMMARY_WINDOW))
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.window.append(value)
+
+    def quantile(self, quantile: float) -> float | None:
+        if not self.window:
+            return None
+        values = sorted(self.window)
+        return values[min(len(values) - 1, int(quantile * len(values)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._summaries: dict[tuple[str, Labels], Summary] = {}
+
+    @staticmethod
+    def _labels(labels: dict[str, object]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: object) -> None:
+        key = (name, self._labels(labels))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        self._summaries.setdefault((name, self._labels(labels)), Summary()).observe(value)
+
+    def snapshot(self) -> dict[str, list[dict]]:
+        result: dict[str, list[dict]] = {}
+        for (name, labels), value in self._counters.items():
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), summary in self._summaries.items():
+            result.setdefault(name, []).append({"labels": dict(labels), **summary.as_dict()})
+        return result
+
+
+metrics = Metrics()
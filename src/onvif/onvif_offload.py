@@ -0,0 +1,93 @@
+"""Parsing of large SOAP responses outside of the event loop"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, TypeVar
+
+from zeep import AsyncClient
+
+from src.config import ONVIFSettings
+from src.onvif.onvif_metrics import metrics
+
+T = TypeVar("T")
+
+# Size of the last response received by the current task, tells whether its conversion
+# to dataclasses is worth offloading as well
+reply_size: ContextVar[int] = ContextVar("reply_size", default=0)
+
+
+class OffloadPool:
+    """
+    Parsing gets its own threads, so large responses do not hold up asyncio.to_thread
+    users such as client creation. Zeep objects cannot be pickled, a process pool would
+    not be able to send the results back. The pool is sized by the settings at startup,
+    without configure, e.g. in the CLI, it has the default size.
+    """
+
+    def __init__(self) -> None:
+        self.workers = ONVIFSettings().parse_offload_workers
+        self._executor: ThreadPoolExecutor | None = None
+
+    def configure(self, settings: ONVIFSettings) -> None:
+        self.close()
+        self.workers = settings.parse_offload_workers
+        self._get_executor()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="onvif-parse"
+            )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+
+    def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+offload_pool = OffloadPool()
+
+
+async def process_reply(client: AsyncClient, binding: Any, operation: str, response: Any) -> Any:
+    """Parse the response into zeep objects, in the worker pool when it is large"""
+    operation_obj = binding.get(operation)
+    size = len(response.content)
+    reply_size.set(size)
+    threshold = getattr(client, "offload_threshold", None)
+    if threshold is None or size < threshold:
+        return binding.process_reply(client, operation_obj, response)
+    metrics.inc("offloaded_replies", operation=operation)
+    return await offload_pool.run(binding.process_reply, client, operation_obj, response)
+
+
+async def convert(client: AsyncClient, create: Callable[[Any], T], obj: Any) -> T:
+    """Convert a response into dataclasses, in the worker pool when the response was large"""
+    threshold = getattr(client, "offload_threshold", None)
+    if threshold is None or reply_size.get() < threshold:
+        return create(obj)
+    return await offload_pool.run(create, obj)
+
+
+class OffloadingBinding:
+    """
+    Binding of a service whose replies are processed by process_reply. The client is
+    created with raw_response, so zeep's send_async stops at the HTTP response and the
+    parsing can leave the event loop. Everything else is the wrapped binding's.
+    """
+
+    def __init__(self, binding: Any) -> None:
+        self.binding = binding
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.binding, name)
+
+    async def send_async(  # pylint: disable=too-many-arguments
+        self, client, options, operation, args, kwargs
+    ):
+        response = await self.binding.send_async(client, options, operation, args, kwargs)
+        return await process_reply(client, self.binding, operation, response)
@@ -0,0 +1,80 @@
+"""Registry of known cameras, filled by WS-Discovery"""
+
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from src.onvif.onvif_discovery import ProbeMatch
+
+NAME_SCOPE_PREFIX = "onvif://www.onvif.org/name/"
+HARDWARE_SCOPE_PREFIX = "onvif://www.onvif.org/hardware/"
+
+
+class UnknownCameraError(Exception):
+    pass
+
+
+@dataclass
+class RegisteredCamera:
+    endpoint_reference: str
+    host: str
+    port: int
+    scheme: str = "http"
+    xaddrs: list[str] = field(default_factory=list)
+    scopes: list[str] = field(default_factory=list)
+    name: str | None = None
+    hardware: str | None = None
+    last_seen: float = 0.0
+
+    @staticmethod
+    def create(match: ProbeMatch) -> "RegisteredCamera":
+        # Prefer an http XAddr, a device which only lists https is reached over https
+        xaddr = next((url for url in match.xaddrs if url.startswith("http://")), match.xaddrs[0])
+        url = urlsplit(xaddr)
+        return RegisteredCamera(
+            endpoint_reference=match.endpoint_reference,
+            host=url.hostname or "",
+            port=url.port or (443 if url.scheme == "https" else 80),
+            scheme=url.scheme or "http",
+            xaddrs=match.xaddrs,
+            scopes=match.scopes,
+            name=_get_scope(match.scopes, NAME_SCOPE_PREFIX),
+            hardware=_get_scope(match.scopes, HARDWARE_SCOPE_PREFIX),
+            last_seen=time.time(),
+        )
+
+
+def _get_scope(scopes: list[str], prefix: str) -> str | None:
+    return next((scope.removeprefix(prefix) for scope in scopes if scope.startswith(prefix)), None)
+
+
+class CameraRegistry:
+    def __init__(self) -> None:
+        self._cameras: dict[str, RegisteredCamera] = {}
+        # Counts the updates, readers compare it to skip a registry which did not change
+        self.version = 0
+
+    def update(self, matches: list[ProbeMatch]) -> list[RegisteredCamera]:
+        cameras = [RegisteredCamera.create(match) for match in matches if match.xaddrs]
+        for camera in cameras:
+            self._cameras[camera.endpoint_reference] = camera
+        if cameras:
+            self.version += 1
+        return cameras
+
+    def get(self, endpoint_reference: str) -> RegisteredCamera:
+        if not (camera := self._cameras.get(endpoint_reference)):
+            raise UnknownCameraError(f"Camera {endpoint_reference} is not registered")
+        return camera
+
+    def get_base_url(self, endpoint_reference: str) -> str:
+        camera = self.get(endpoint_reference)
+        # urlsplit drops the brackets of an IPv6 host, they are required in a URL
+        host = f"[{camera.host}]" if ":" in camera.host else camera.host
+        return f"{camera.scheme}://{host}:{camera.port}"
+
+    def list(self) -> list[RegisteredCamera]:
+        return list(self._cameras.values())
+
+
+camera_registry = CameraRegistry()
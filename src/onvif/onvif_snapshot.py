@@ -0,0 +1,258 @@
+"""Snapshot proxy which streams camera JPEGs and shares concurrent fetches"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import httpx
+
+from src.onvif.onvif_cache import CacheSection, response_cache, with_credentials
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_media import MediaUri, OnvifClientMedia
+from src.onvif.onvif_deadline import create_background_task
+from src.onvif.onvif_metrics import metrics
+from src.onvif.onvif_transport import CachedDigestAuth
+
+# Camera key, credentials key and profile token
+SnapshotKey = tuple[str, str, str | None]
+
+
+class SlowSubscriberError(Exception):
+    pass
+
+
+@dataclass
+class CachedSnapshot:
+    content_type: str
+    data: bytes
+    expires_at: float
+
+
+class SnapshotCache:
+    """LRU cache of snapshot bytes bounded by the total size of the images"""
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[SnapshotKey, CachedSnapshot] = OrderedDict()
+        self._size = 0
+
+    def get(self, key: SnapshotKey) -> CachedSnapshot | None:
+        if not (entry := self._entries.get(key)):
+            return None
+        if time.monotonic() >= entry.expires_at:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(
+        self, key: SnapshotKey, content_type: str, data: bytes, ttl: float, max_bytes: int
+    ) -> None:
+        if len(data) > max_bytes:
+            return
+        self._remove(key)
+        while self._entries and self._size + len(data) > max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._entries[key] = CachedSnapshot(content_type, data, time.monotonic() + ttl)
+        self._size += len(data)
+
+    def _remove(self, key: SnapshotKey) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= len(entry.data)
+
+
+class SnapshotFetch:
+    """
+    One in-flight snapshot download shared by every request for the same camera.
+    Chunks are pushed to each subscriber as they arrive. The chunks received so far are
+    kept for late subscribers and the cache only while the image stays below max_bytes,
+    larger images are passed through without being held in memory. A subscriber which
+    falls more than max_chunks behind is cut off, so a slow client cannot hold the image.
+    """
+
+    def __init__(self, max_bytes: int, max_chunks: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self.content_type = "image/jpeg"
+        self.buffer: list[bytes] | None = []
+        self.size = 0
+        self.error: Exception | None = None
+        self.headers_ready = asyncio.Event()
+        self.done = False
+        self._subscribers: list[asyncio.Queue] = []
+
+    @property
+    def joinable(self) -> bool:
+        return not self.done and self.buffer is not None
+
+    def subscribe(self) -> asyncio.Queue:
+        # One more item than max_chunks, so the end of the download always fits
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_chunks + 1)
+        if self.buffer:
+            queue.put_nowait(b"".join(self.buffer))
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.buffer is not None:
+            if self.size <= self.max_bytes:
+                self.buffer.append(chunk)
+            else:
+                self.buffer = None
+        for queue in list(self._subscribers):
+            if queue.qsize() < self.max_chunks:
+                queue.put_nowait(chunk)
+            else:
+                self._cut_off(queue)
+
+    def _cut_off(self, queue: asyncio.Queue) -> None:
+        self.unsubscribe(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(SlowSubscriberError("Snapshot client is too slow"))
+
+    def finish(self, error: Exception | None = None) -> None:
+        self.done = True
+        self.error = error
+        self.headers_ready.set()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+
+    async def iterate(self, queue: asyncio.Queue) -> AsyncIterator[bytes]:
+        try:
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, SlowSubscriberError):
+                    raise chunk
+                yield chunk
+            if self.error:
+                raise self.error
+        finally:
+            self.unsubscribe(queue)
+
+
+@dataclass
+class Snapshot:
+    content_type: str
+    chunks: AsyncIterator[bytes]
+
+
+async def _iterate_bytes(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+class SnapshotProxy:
+    def __init__(self) -> None:
+        self._cache = SnapshotCache()
+        self._fetches: dict[SnapshotKey, SnapshotFetch] = {}
+        # The event loop only keeps weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self, settings: OnvifClientSettings) -> httpx.AsyncClient:
+        if not self._client:
+            self._client = httpx.AsyncClient(
+                verify=settings.common.verify_ssl, timeout=settings.common.timeout
+            )
+        return self._client
+
+    async def open(self, settings: OnvifClientSettings, profile_token: str | None) -> Snapshot:
+        source = settings.source
+        key = (source.get_camera_key(), source.get_credentials_key(), profile_token)
+        if cached := self._cache.get(key):
+            metrics.inc("snapshot_requests", result="cache")
+            return Snapshot(cached.content_type, _iterate_bytes(cached.data))
+        fetch = self._fetches.get(key)
+        if fetch and fetch.joinable:
+            metrics.inc("snapshot_requests", result="shared")
+        else:
+            metrics.inc("snapshot_requests", result="fetch")
+            fetch = self._fetches[key] = SnapshotFetch(
+                settings.common.snapshot_max_image_bytes,
+                settings.common.snapshot_subscriber_chunks,
+            )
+            task = create_background_task(self._fetch(settings, profile_token, key, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue = fetch.subscribe()
+        await fetch.headers_ready.wait()
+        if fetch.error and not fetch.size:
+            fetch.unsubscribe(queue)
+            raise fetch.error
+        return Snapshot(fetch.content_type, fetch.iterate(queue))
+
+    async def _fetch(
+        self,
+        settings: OnvifClientSettings,
+        profile_token: str | None,
+        key: SnapshotKey,
+        fetch: SnapshotFetch,
+    ) -> None:
+        source = settings.source
+        try:
+            uri = await self._get_snapshot_uri(settings, profile_token)
+            auth = (
+                CachedDigestAuth(key[0], source.user, source.password or "")
+                if source.user
+                else None
+            )
+            async with self._get_client(settings).stream("GET", uri.uri, auth=auth) as response:
+                response.raise_for_status()
+                fetch.content_type = response.headers.get("content-type", fetch.content_type)
+                fetch.headers_ready.set()
+                async for chunk in response.aiter_bytes():
+                    fetch.publish(chunk)
+            if fetch.buffer is not None:
+                self._cache.set(
+                    key,
+                    fetch.content_type,
+                    b"".join(fetch.buffer),
+                    settings.common.snapshot_cache_ttl,
+                    settings.common.snapshot_cache_max_bytes,
+                )
+            fetch.finish()
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Snapshot of %s failed: %s", key[0], exc)
+            fetch.finish(exc)
+        finally:
+            if self._fetches.get(key) is fetch:
+                del self._fetches[key]
+
+    @staticmethod
+    async def _get_snapshot_uri(
+        settings: OnvifClientSettings, profile_token: str | None
+    ) -> MediaUri:
+        source = settings.source
+        key = with_credentials(
+            (CacheSection.MEDIA_SNAPSHOT_URI, profile_token), source.get_credentials_key()
+        )
+        if profile_token and (uri := await response_cache.get_async(source.get_camera_key(), key)):
+            return uri
+        # Creating the media client parses the wsdl, so it is done only when the uri is unknown
+        media = await OnvifClientMedia.create_async(settings)
+        try:
+            if not profile_token:
+                profiles = await media.get_profiles()
+                if not profiles.profiles:
+                    raise ValueError("Camera has no media profiles")
+                profile_token = profiles.profiles[0].token
+            return await media.get_snapshot_uri(profile_token)
+        finally:
+            await media.close()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+
+snapshot_proxy = SnapshotProxy()
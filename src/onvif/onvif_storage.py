@@ -0,0 +1,36 @@
+"""Private directory of the local databases of the API"""
+
+import os
+import stat
+
+from src.config import ONVIFSettings
+
+DATA_DIR_NAME = "onvif-api"
+
+
+class InsecureDataDirError(OSError):
+    pass
+
+
+def get_data_dir(settings: ONVIFSettings) -> str:
+    if settings.data_dir:
+        return settings.data_dir
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, DATA_DIR_NAME)
+
+
+def get_private_path(settings: ONVIFSettings, path: str) -> str:
+    """
+    Location of a local database, relative paths are placed in the data directory.
+    The directory is created accessible to the current user only, and a directory other
+    users can write to is refused: they could plant a database or replace it with a link.
+    """
+    path = os.path.join(get_data_dir(settings), path)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise InsecureDataDirError(
+            f"{directory} must be owned and only writable by the user running the API"
+        )
+    return path
@@ -0,0 +1,233 @@
+"""HTTP transport helpers shared by the onvif clients"""
+
+import os
+import re
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Callable, Generator
+
+import httpx
+from zeep.transports import AsyncTransport
+
+from src.onvif.onvif_deadline import cap_timeout, request_deadline
+from src.onvif.onvif_metrics import metrics
+
+DIGEST_PARAM = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^,\s]*)')
+SOAP_ACTION = re.compile(r'action="?([^";]+)')
+
+UNKNOWN_MODEL = "unknown"
+
+DIGEST_HASHES: dict[str, Callable[[bytes], Any]] = {
+    "MD5": hashlib.md5,
+    "SHA-256": hashlib.sha256,
+    "SHA-512-256": lambda data: hashlib.new("sha512_256", data),
+}
+
+
+@dataclass
+class DigestChallenge:
+    realm: str
+    nonce: str
+    algorithm: str = "MD5"
+    qop: str | None = None
+    opaque: str | None = None
+    stale: bool = False
+    nonce_count: int = 0
+
+    @staticmethod
+    def parse(header: str) -> "DigestChallenge | None":
+        """Digest challenge of a WWW-Authenticate header, None for other schemes"""
+        if not (match := re.search(r"digest\s+", header, re.IGNORECASE)):
+            return None
+        params = {
+            key.lower(): value[1:-1].replace('\\"', '"') if value.startswith('"') else value
+            for key, value in DIGEST_PARAM.findall(header, match.end())
+        }
+        if "realm" not in params or "nonce" not in params:
+            return None
+        qops = [qop.strip() for qop in params.get("qop", "").split(",")]
+        return DigestChallenge(
+            realm=params["realm"],
+            nonce=params["nonce"],
+            algorithm=params.get("algorithm", "MD5"),
+            qop="auth" if "auth" in qops else None,
+            opaque=params.get("opaque"),
+            stale=params.get("stale", "").lower() == "true",
+        )
+
+    def _hash(self, data: str) -> str:
+        algorithm = self.algorithm.upper().removesuffix("-SESS")
+        return DIGEST_HASHES.get(algorithm, hashlib.md5)(data.encode()).hexdigest()
+
+    def authorize(self, request: httpx.Request, user: str, password: str) -> str:
+        """Authorization header for the request, every use counts up the nonce count"""
+        self.nonce_count += 1
+        nonce_count = f"{self.nonce_count:08x}"
+        cnonce = os.urandom(8).hex()
+        uri = request.url.raw_path.decode()
+        ha1 = self._hash(f"{user}:{self.realm}:{password}")
+        if self.algorithm.upper().endswith("-SESS"):
+            ha1 = self._hash(f"{ha1}:{self.nonce}:{cnonce}")
+        ha2 = self._hash(f"{request.method}:{uri}")
+        if self.qop:
+            response = self._hash(f"{ha1}:{self.nonce}:{nonce_count}:{cnonce}:{self.qop}:{ha2}")
+        else:
+            response = self._hash(f"{ha1}:{self.nonce}:{ha2}")
+        params = {
+            "username": f'"{user}"',
+            "realm": f'"{self.realm}"',
+            "nonce": f'"{self.nonce}"',
+            "uri": f'"{uri}"',
+            "response": f'"{response}"',
+            "algorithm": self.algorithm,
+        }
+        if self.opaque is not None:
+            params["opaque"] = f'"{self.opaque}"'
+        if self.qop:
+            params.update({"qop": self.qop, "nc": nonce_count, "cnonce": f'"{cnonce}"'})
+        return "Digest " + ", ".join(f"{key}={value}" for key, value in params.items())
+
+
+class DigestChallenges:
+    """Last Digest challenge of every camera, shared by all clients talking to it"""
+
+    def __init__(self) -> None:
+        self._challenges: dict[str, DigestChallenge] = {}
+
+    def get(self, camera_key: str) -> DigestChallenge | None:
+        return self._challenges.get(camera_key)
+
+    def set(self, camera_key: str, challenge: DigestChallenge) -> None:
+        self._challenges[camera_key] = challenge
+
+    def remove(self, camera_key: str) -> None:
+        self._challenges.pop(camera_key, None)
+
+
+digest_challenges = DigestChallenges()
+
+
+class CachedDigestAuth(httpx.Auth):
+    """
+    HTTP Digest which reuses the camera's last challenge to authenticate the first request
+    right away. Only a rejected or stale nonce costs the extra 401 round trip.
+    """
+
+    def __init__(self, camera_key: str, user: str, password: str) -> None:
+        self.camera_key = camera_key
+        self.user = user
+        self.password = password
+
+    def auth_flow(self, request: httpx.Request) -> Generator[httpx.Request, httpx.Response, None]:
+        if challenge := digest_challenges.get(self.camera_key):
+            request.headers["Authorization"] = challenge.authorize(
+                request, self.user, self.password
+            )
+        response = yield request
+        if response.status_code != 401:
+            if challenge:
+                metrics.inc("digest_round_trips_saved")
+            return
+        header = response.headers.get("www-authenticate", "")
+        if not (new_challenge := DigestChallenge.parse(header)):
+            return
+        reason = "stale" if new_challenge.stale else "rejected" if challenge else "initial"
+        metrics.inc("digest_challenges", reason=reason)
+        digest_challenges.set(self.camera_key, new_challenge)
+        request.headers["Authorization"] = new_challenge.authorize(
+            request, self.user, self.password
+        )
+        yield request
+
+
+class ResponseTooLargeError(Exception):
+    pass
+
+
+class CameraModels:
+    """Model of every camera, the label of the response size metrics"""
+
+    def __init__(self) -> None:
+        self._models: dict[str, str] = {}
+
+    def get(self, camera_key: str) -> str:
+        return self._models.get(camera_key, UNKNOWN_MODEL)
+
+    def set(self, camera_key: str, model: str | None) -> None:
+        if model:
+            self._models[camera_key] = model
+
+
+camera_models = CameraModels()
+
+
+def get_soap_operation(headers: dict) -> str | None:
+    """Operation name from the SOAP 1.2 Content-Type action or the SOAP 1.1 SOAPAction header"""
+    action = headers.get("SOAPAction", "").strip('"')
+    if not action and (match := SOAP_ACTION.search(headers.get("Content-Type", ""))):
+        action = match.group(1)
+    return action.rsplit("/", 1)[-1] if action else None
+
+
+class BoundedAsyncTransport(AsyncTransport):
+    """
+    Transport which streams operation responses and aborts as soon as the body exceeds the
+    limit of the operation, instead of buffering whatever the camera sends.
+    """
+
+    def __init__(
+        self,
+        camera_key: str,
+        max_response_size: int,
+        max_response_sizes: dict[str, int] | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.camera_key = camera_key
+        self.max_response_size = max_response_size
+        self.max_response_sizes = max_response_sizes or {}
+
+    async def post(self, address, message, headers):
+        operation = get_soap_operation(headers) or "unknown"
+        limit = self.max_response_sizes.get(operation, self.max_response_size)
+        timeout = cap_timeout(self.client.timeout)
+        request = self.client.build_request(
+            "POST", address, content=message, headers=headers, timeout=timeout
+        )
+        deadline = request_deadline.get()
+        try:
+            # Whole exchange, the read timeout alone restarts with every chunk
+            async with asyncio.timeout_at(deadline):
+                return await self._post(request, operation, limit)
+        except TimeoutError as exc:
+            metrics.inc("deadline_exceeded", operation=operation)
+            raise httpx.ReadTimeout("Request deadline exceeded", request=request) from exc
+
+    async def _post(self, request: httpx.Request, operation: str, limit: int) -> httpx.Response:
+        response = await self.client.send(request, stream=True)
+        try:
+            length = response.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > limit:
+                self._reject(operation, int(length), limit)
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > limit:
+                    self._reject(operation, size, limit)
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        metrics.observe(
+            "response_bytes", size, model=camera_models.get(self.camera_key), operation=operation
+        )
+        # The body is already decoded, new_response() must not read the closed stream again
+        response._content = b"".join(chunks)  # pylint: disable=protected-access
+        return response
+
+    def _reject(self, operation: str, size: int, limit: int) -> None:
+        model = camera_models.get(self.camera_key)
+        metrics.inc("responses_too_large", model=model, operation=operation)
+        raise ResponseTooLargeError(
+            f"{operation} response of {self.camera_key} exceeds {limit} bytes ({size} read)"
+        )
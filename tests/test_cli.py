@@ -0,0 +1,31 @@
+import json
+
+from src.cli import drop_errors, read_done_cameras
+
+
+def write_lines(path, lines):
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines) + '{"camera": "cut', "utf-8")
+
+
+def test_retry_errors_keeps_one_line_per_camera(tmp_path):
+    output = tmp_path / "results.jsonl"
+    write_lines(
+        output,
+        [
+            {"camera": "10.0.0.1:80", "operation": "profiles", "result": {}},
+            {"camera": "10.0.0.2:80", "operation": "profiles", "error": "timed out"},
+        ],
+    )
+    assert read_done_cameras(str(output)) == {"10.0.0.1:80", "10.0.0.2:80"}
+
+    drop_errors(str(output))
+
+    lines = [json.loads(line) for line in output.read_text("utf-8").splitlines()]
+    assert lines == [{"camera": "10.0.0.1:80", "operation": "profiles", "result": {}}]
+    assert read_done_cameras(str(output)) == {"10.0.0.1:80"}
+
+
+def test_missing_output_has_no_done_cameras(tmp_path):
+    path = str(tmp_path / "missing.jsonl")
+    drop_errors(path)
+    assert read_done_cameras(path) == set()
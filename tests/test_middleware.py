@@ -0,0 +1,128 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.config import ONVIFSettings
+from src.middleware import AdmissionController, AdmissionControlMiddleware
+from src.onvif.onvif_deadline import deadline_scope
+
+RANKS = {"interactive": 0, "normal": 1, "bulk": 2}
+
+
+def create_controller(max_in_flight=1, queue_limit=8, queue_timeout=5.0) -> AdmissionController:
+    return AdmissionController(
+        max_in_flight=max_in_flight,
+        priority_ranks=RANKS,
+        queue_limits={priority: queue_limit for priority in RANKS},
+        queue_timeout=queue_timeout,
+    )
+
+
+def test_freed_slots_go_to_the_most_important_class_first():
+    async def main():
+        controller = create_controller()
+        assert await controller.acquire("normal")
+        admitted: list[str] = []
+
+        async def request(name: str, priority: str) -> None:
+            assert await controller.acquire(priority)
+            admitted.append(name)
+            controller.release()
+
+        tasks = []
+        for name, priority in [("bulk", "bulk"), ("normal-1", "normal"), ("normal-2", "normal")]:
+            tasks.append(asyncio.create_task(request(name, priority)))
+            await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("interactive", "interactive")))
+        await asyncio.sleep(0)
+        assert controller.queued("normal") == 2
+        controller.release()
+        await asyncio.gather(*tasks)
+        return admitted, controller.in_flight
+
+    admitted, in_flight = asyncio.run(main())
+    assert admitted == ["interactive", "normal-1", "normal-2", "bulk"]
+    assert in_flight == 0
+
+
+def test_request_is_shed_when_its_queue_is_full():
+    async def main():
+        controller = create_controller(queue_limit=1)
+        assert await controller.acquire("normal")
+        waiter = asyncio.create_task(controller.acquire("normal"))
+        await asyncio.sleep(0)
+        shed = await controller.acquire("normal")
+        controller.release()
+        return shed, await waiter
+
+    assert asyncio.run(main()) == (False, True)
+
+
+def test_request_is_shed_after_the_queue_timeout_or_its_deadline():
+    async def main():
+        controller = create_controller(queue_timeout=0.05)
+        assert await controller.acquire("normal")
+        timed_out = await controller.acquire("normal")
+        with deadline_scope(0.01):
+            past_deadline = await asyncio.wait_for(controller.acquire("normal"), 0.04)
+        controller.release()
+        return timed_out, past_deadline, controller.in_flight, controller.queued("normal")
+
+    assert asyncio.run(main()) == (False, False, 0, 0)
+
+
+def test_cancelled_waiter_does_not_keep_its_slot():
+    async def main():
+        controller = create_controller()
+        assert await controller.acquire("normal")
+        cancelled = asyncio.create_task(controller.acquire("normal"))
+        waiting = asyncio.create_task(controller.acquire("normal"))
+        await asyncio.sleep(0)
+        # The slot is handed to the first waiter, which is cancelled before it runs
+        controller.release()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert await asyncio.wait_for(waiting, 1)
+        controller.release()
+        return controller.in_flight, controller.queued("normal")
+
+    assert asyncio.run(main()) == (0, 0)
+
+
+def test_shed_request_gets_503_with_retry_after():
+    release = asyncio.Event()
+
+    async def slow(_):
+        await release.wait()
+        return PlainTextResponse("done")
+
+    async def fast(_):
+        return PlainTextResponse("done")
+
+    settings = ONVIFSettings(
+        admission_max_in_flight=1,
+        admission_queue_limits={"normal": 0},
+        admission_retry_after=7,
+    )
+    app = Starlette(
+        routes=[
+            Route("/api/slow", slow, methods=["POST"]),
+            Route("/api/fast", fast, methods=["POST"]),
+            Route("/api/metrics", fast),
+        ]
+    )
+    app.add_middleware(AdmissionControlMiddleware, settings=settings)
+    with TestClient(app) as client:
+        middleware = app.middleware_stack.app
+        controller = middleware.controller
+        assert client.portal.call(controller.acquire, "normal")
+        response = client.post("/api/fast")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "7"
+        # The metrics are served even when the API is overloaded
+        assert client.get("/api/metrics").status_code == 200
+        client.portal.call(controller.release)
+        assert client.post("/api/fast").text == "done"
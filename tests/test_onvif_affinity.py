@@ -0,0 +1,125 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.config import ONVIFSettings
+from src.middleware import FORWARDED_HEADER, AffinityMiddleware
+from src.model.source import Source
+from src.onvif.onvif_affinity import HashRing, camera_affinity, normalize_camera_key
+
+SELF_URL = "http://self:8000"
+OWNER_URL = "http://owner:8000"
+
+
+@pytest.fixture(params=[None, "secret"], ids=["unsigned", "signed"])
+def owned_source(request):
+    camera_affinity.configure(
+        ONVIFSettings(
+            affinity_enabled=True,
+            affinity_self_url=SELF_URL,
+            affinity_nodes=[SELF_URL, OWNER_URL],
+            affinity_secret=request.param,
+        )
+    )
+    source = next(
+        source
+        for source in (Source.parse_obj({"host": f"10.0.0.{i}"}) for i in range(1, 100))
+        if camera_affinity.get_forward_url(source) == OWNER_URL
+    )
+    yield source
+    asyncio.run(camera_affinity.close())
+    camera_affinity.configure(ONVIFSettings())
+
+
+def create_client(handler) -> TestClient:
+    async def local(_):
+        return PlainTextResponse("local")
+
+    camera_affinity._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app = Starlette(routes=[Route("/api/media/profiles", local, methods=["POST"])])
+    app.add_middleware(AffinityMiddleware)
+    return TestClient(app)
+
+
+def client_failing_with(error: Exception) -> TestClient:
+    def fail(request):
+        raise error
+
+    return create_client(fail)
+
+
+def test_unreachable_owner_is_served_locally(owned_source):
+    client = client_failing_with(httpx.ConnectError("refused"))
+    response = client.post("/api/media/profiles", content=owned_source.json())
+    assert response.text == "local"
+
+
+def test_owner_failing_after_the_request_is_not_run_again(owned_source):
+    client = client_failing_with(httpx.ReadTimeout("timed out"))
+    response = client.post("/api/media/profiles", content=owned_source.json())
+    assert response.status_code == 502
+
+
+def test_forward_mark_is_trusted_only_from_peers(owned_source):
+    forwarded = []
+
+    def owner(request: httpx.Request) -> httpx.Response:
+        forwarded.append(request.headers[FORWARDED_HEADER.decode()])
+        return httpx.Response(200, stream=httpx.ByteStream(b"owner"))
+
+    client = create_client(owner)
+    # Clients may name this instance, or a peer when they cannot sign with the shared secret
+    spoofed = f"{OWNER_URL};sig=forged" if camera_affinity.secret else SELF_URL
+    for mark in ["http://client:8000", spoofed]:
+        response = client.post(
+            "/api/media/profiles", content=owned_source.json(), headers={"x-onvif-forwarded": mark}
+        )
+        assert response.text == "owner"
+    assert forwarded == [camera_affinity.sign_forward("POST", "/api/media/profiles")] * 2
+
+    camera_affinity.self_url = OWNER_URL
+    peer_mark = camera_affinity.sign_forward("POST", "/api/media/profiles")
+    camera_affinity.self_url = SELF_URL
+    response = client.post(
+        "/api/media/profiles", content=owned_source.json(), headers={"x-onvif-forwarded": peer_mark}
+    )
+    assert response.text == "local"
+
+
+def test_camera_key_ignores_the_spelling_of_the_host():
+    keys = {
+        normalize_camera_key(Source.parse_obj(data))
+        for data in [
+            {"host": "Cam-1.Example.com."},
+            {"host": " cam-1.example.com", "port": 80},
+            {"host": "cam-1.example.com", "endpoint_reference": "urn:uuid:ABC"},
+        ]
+    }
+    assert keys == {"cam-1.example.com:80"}
+    assert normalize_camera_key(Source.parse_obj({"host": "cam-1", "port": 8080})) == "cam-1:8080"
+    assert normalize_camera_key(Source.parse_obj({"endpoint_reference": " urn:uuid:ABC "})) == (
+        "urn:uuid:abc"
+    )
+
+
+def test_ring_moves_only_the_cameras_of_the_changed_node():
+    keys = [f"10.0.{i // 256}.{i % 256}:80" for i in range(2000)]
+    nodes = [f"http://node-{i}:8000" for i in range(3)]
+    ring = HashRing(nodes=nodes)
+    before = {key: ring.get_node(key) for key in keys}
+
+    ring.set_nodes([*nodes, "http://node-3:8000"])
+    added = {key: ring.get_node(key) for key in keys}
+    moved = [key for key in keys if added[key] != before[key]]
+    assert all(added[key] == "http://node-3:8000" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+    ring.set_nodes(nodes[1:])
+    removed = {key: ring.get_node(key) for key in keys}
+    assert all(removed[key] == before[key] for key in keys if before[key] != nodes[0])
+    assert HashRing().get_node(keys[0]) is None
@@ -0,0 +1,229 @@
+import os
+import asyncio
+
+import pytest
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif import onvif_cache, onvif_client
+from src.onvif.onvif_cache import CacheSection, OnvifCache, SqliteOnvifCache, create_cache
+from src.onvif.onvif_client import OnvifClient, OnvifClientSettings
+from src.onvif.onvif_client_events import NotificationMessage, get_invalidated_sections
+from src.onvif.onvif_client_media import MediaUri
+from src.onvif.onvif_client_search import RecordingIndex, RecordingInformation
+from src.onvif.onvif_storage import InsecureDataDirError
+
+CAMERA = "10.0.0.1:80"
+
+
+class FakeClient(OnvifClient):
+    """Client without a zeep service, only the caching of the base class is used"""
+
+    def _get_service(self):
+        return None
+
+    def _get_service_url(self):
+        return ""
+
+    def _get_wsdl_path(self):
+        return ""
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(monkeypatch) -> OnvifCache:
+    cache = OnvifCache()
+    monkeypatch.setattr(onvif_cache, "response_cache", cache)
+    monkeypatch.setattr(onvif_client, "response_cache", cache)
+    return cache
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(onvif_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def create_client(
+    user: str | None = "admin", password: str | None = "secret", common: ONVIFSettings | None = None
+) -> FakeClient:
+    source = Source(host="10.0.0.1", port=80, user=user, password=password)
+    return FakeClient(
+        OnvifClientSettings(source=source, common=common or ONVIFSettings(), check_health=False)
+    )
+
+
+def create_fetch(value: str):
+    calls = []
+
+    async def fetch() -> str:
+        calls.append(value)
+        return value
+
+    return fetch, calls
+
+
+def test_entry_expires_after_ttl(cache, clock):
+    cache.set(CAMERA, (CacheSection.MEDIA_PROFILES,), "profiles", ttl=10)
+    clock[0] += 9
+    assert cache.get(CAMERA, (CacheSection.MEDIA_PROFILES,)) == "profiles"
+    clock[0] += 1
+    assert cache.get(CAMERA, (CacheSection.MEDIA_PROFILES,)) is None
+
+
+def test_invalidate_sections_keeps_other_sections(cache):
+    cache.set(CAMERA, (CacheSection.MEDIA_PROFILES, "a"), "profiles", ttl=10)
+    cache.set(CAMERA, (CacheSection.IMAGING_OPTIONS, "a"), "options", ttl=10)
+    cache.set("10.0.0.2:80", (CacheSection.MEDIA_PROFILES, "a"), "other", ttl=10)
+    cache.invalidate(CAMERA, CacheSection.MEDIA_PROFILES)
+    assert cache.get(CAMERA, (CacheSection.MEDIA_PROFILES, "a")) is None
+    assert cache.get(CAMERA, (CacheSection.IMAGING_OPTIONS, "a")) == "options"
+    assert cache.get("10.0.0.2:80", (CacheSection.MEDIA_PROFILES, "a")) == "other"
+
+
+def test_invalidate_without_sections_drops_camera(cache):
+    cache.set(CAMERA, (CacheSection.MEDIA_PROFILES,), "profiles", ttl=10)
+    cache.set(CAMERA, (CacheSection.IMAGING_OPTIONS,), "options", ttl=10)
+    cache.invalidate(CAMERA)
+    assert cache.get(CAMERA, (CacheSection.MEDIA_PROFILES,)) is None
+    assert cache.get(CAMERA, (CacheSection.IMAGING_OPTIONS,)) is None
+
+
+def test_get_or_fetch_fetches_once_until_expired(cache, clock):
+    fetch, calls = create_fetch("profiles")
+    for _ in range(3):
+        assert asyncio.run(cache.get_or_fetch(CAMERA, (CacheSection.MEDIA_PROFILES,), fetch, 5))
+    clock[0] += 5
+    asyncio.run(cache.get_or_fetch(CAMERA, (CacheSection.MEDIA_PROFILES,), fetch, 5))
+    assert len(calls) == 2
+
+
+def test_cached_response_is_shared_by_the_same_credentials(cache):
+    fetch, calls = create_fetch("profiles")
+    asyncio.run(create_client()._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    asyncio.run(create_client()._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    assert calls == ["profiles"]
+
+
+@pytest.mark.parametrize(
+    "user, password", [("admin", "wrong"), ("admin", None), (None, None), ("viewer", "secret")]
+)
+def test_cached_response_is_not_served_to_other_credentials(cache, user, password):
+    owner_fetch, _ = create_fetch("admin profiles")
+    asyncio.run(create_client()._cached((CacheSection.MEDIA_PROFILES,), owner_fetch))
+    other_fetch, calls = create_fetch("camera answer")
+    value = asyncio.run(
+        create_client(user, password)._cached((CacheSection.MEDIA_PROFILES,), other_fetch)
+    )
+    assert value == "camera answer"
+    assert calls == ["camera answer"]
+
+
+def test_invalidate_drops_entries_of_every_credential(cache):
+    for password in ("secret", "other"):
+        fetch, _ = create_fetch(password)
+        asyncio.run(create_client(password=password)._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    cache.invalidate(CAMERA, CacheSection.MEDIA_PROFILES)
+    fetch, calls = create_fetch("fresh")
+    asyncio.run(create_client()._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    assert calls == ["fresh"]
+
+
+def test_event_backed_camera_uses_longer_ttl(cache, clock):
+    common = ONVIFSettings(cache_ttl=10, cache_ttl_with_events=100)
+    cache.set_event_backed(CAMERA, True)
+    fetch, calls = create_fetch("profiles")
+    asyncio.run(create_client(common=common)._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    clock[0] += common.cache_ttl + 1
+    asyncio.run(create_client(common=common)._cached((CacheSection.MEDIA_PROFILES,), fetch))
+    assert calls == ["profiles"]
+
+
+def test_profile_changed_invalidates_profile_sections():
+    message = NotificationMessage(topic="Media/ProfileChanged")
+    assert CacheSection.MEDIA_PROFILES in get_invalidated_sections(message)
+    assert CacheSection.MEDIA2_STREAM_URI in get_invalidated_sections(message)
+
+
+def test_video_encoder_change_invalidates_encoder_sections():
+    message = NotificationMessage(
+        topic="Media/ConfigurationChanged", source={"Type": "VideoEncoder"}
+    )
+    sections = get_invalidated_sections(message)
+    assert CacheSection.MEDIA2_VIDEO_ENCODER_CONFIGURATIONS in sections
+    assert CacheSection.MEDIA_PROFILES in sections
+
+
+def test_other_topics_invalidate_nothing():
+    assert get_invalidated_sections(NotificationMessage(topic="VideoSource/MotionAlarm")) == ()
+
+
+def test_value_ttl_shortens_or_skips_caching(cache, clock):
+    fetch, calls = create_fetch("uri")
+    client = create_client()
+    asyncio.run(client._cached((CacheSection.MEDIA_SNAPSHOT_URI,), fetch, get_ttl=lambda *_: 0))
+    asyncio.run(client._cached((CacheSection.MEDIA_SNAPSHOT_URI,), fetch, get_ttl=lambda *_: 5))
+    clock[0] += 4
+    asyncio.run(client._cached((CacheSection.MEDIA_SNAPSHOT_URI,), fetch))
+    clock[0] += 1
+    asyncio.run(client._cached((CacheSection.MEDIA_SNAPSHOT_URI,), fetch))
+    assert len(calls) == 3
+
+
+def create_sqlite_cache(tmp_path) -> SqliteOnvifCache:
+    settings = ONVIFSettings(data_dir=str(tmp_path / "data"), cache_backend="sqlite")
+    cache = create_cache(settings)
+    assert isinstance(cache, SqliteOnvifCache)
+    return cache
+
+
+def test_sqlite_cache_rebuilds_dataclasses(tmp_path):
+    cache = create_sqlite_cache(tmp_path)
+    uri = MediaUri("rtsp://camera/stream", timeout=60.0)
+    index = RecordingIndex("camera", [RecordingInformation("recording", source_name="Lobby")])
+    cache.set(CAMERA, (CacheSection.MEDIA_STREAM_URI, "profile"), uri, ttl=10)
+    cache.set(CAMERA, (CacheSection.SEARCH_RECORDINGS,), index, ttl=10)
+    cache.set(CAMERA, (CacheSection.MEDIA2_PROFILE_TOKENS,), {"profile": "Main"}, ttl=10)
+    other = SqliteOnvifCache(cache.path)
+    assert other.get(CAMERA, (CacheSection.MEDIA_STREAM_URI, "profile")) == uri
+    assert other.get(CAMERA, (CacheSection.SEARCH_RECORDINGS,)) == index
+    assert other.get(CAMERA, (CacheSection.MEDIA2_PROFILE_TOKENS,)) == {"profile": "Main"}
+
+
+def test_sqlite_cache_does_not_load_foreign_types(tmp_path):
+    cache = create_sqlite_cache(tmp_path)
+    key = (CacheSection.MEDIA_PROFILES,)
+    with cache._connection:
+        cache._connection.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+            (CAMERA, "media.profiles", "[]", '{"type": "os:system", "value": "id"}', 2e9),
+        )
+    assert cache.get(CAMERA, key) is None
+
+
+def test_sqlite_cache_invalidation_is_not_overtaken(tmp_path):
+    cache = create_sqlite_cache(tmp_path)
+    key = (CacheSection.MEDIA_PROFILES,)
+    fetch, calls = create_fetch("profiles")
+
+    async def run() -> None:
+        await cache.get_or_fetch(CAMERA, key, fetch, 10)
+        cache.invalidate(CAMERA, CacheSection.MEDIA_PROFILES)
+        await cache.get_or_fetch(CAMERA, key, fetch, 10)
+        await cache.get_or_fetch(CAMERA, key, fetch, 10)
+
+    asyncio.run(run())
+    assert calls == ["profiles", "profiles"]
+
+
+def test_data_dir_is_private(tmp_path):
+    create_sqlite_cache(tmp_path)
+    assert os.stat(tmp_path / "data").st_mode & 0o777 == 0o700
+
+
+def test_shared_data_dir_is_refused(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(InsecureDataDirError):
+        create_cache(ONVIFSettings(data_dir=str(shared), cache_backend="sqlite"))
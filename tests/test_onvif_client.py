@@ -0,0 +1,36 @@
+import asyncio
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings, run_fleet
+
+
+def create_sources(count: int) -> list[Source]:
+    return [Source(host=f"10.0.0.{index}", port=80) for index in range(count)]
+
+
+def test_run_fleet_keeps_order_and_maps_errors():
+    async def fetch(settings: OnvifClientSettings) -> str:
+        if settings.source.host == "10.0.0.1":
+            raise ValueError("unreachable")
+        await asyncio.sleep(0.01 if settings.source.host == "10.0.0.0" else 0)
+        return settings.source.get_camera_key()
+
+    results = asyncio.run(
+        run_fleet(create_sources(3), ONVIFSettings(), fetch, lambda camera, exc: f"{camera} {exc}")
+    )
+    assert results == ["10.0.0.0:80", "10.0.0.1:80 unreachable", "10.0.0.2:80"]
+
+
+def test_run_fleet_limits_concurrency():
+    running = []
+    peak = []
+
+    async def fetch(settings: OnvifClientSettings) -> None:
+        running.append(settings)
+        peak.append(len(running))
+        await asyncio.sleep(0)
+        running.remove(settings)
+
+    asyncio.run(run_fleet(create_sources(10), ONVIFSettings(fleet_concurrency=3), fetch, print))
+    assert max(peak) == 3
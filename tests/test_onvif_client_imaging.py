@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from zeep.exceptions import Fault
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientServiceError, OnvifClientSettings
+from src.onvif.onvif_client_imaging import OnvifClientImaging
+
+
+def create_client(status_error: Exception) -> OnvifClientImaging:
+    source = Source.parse_obj({"host": "imaging.local", "port": 80})
+    settings = OnvifClientSettings(source=source, common=ONVIFSettings(events_enabled=False))
+    client = asyncio.run(OnvifClientImaging.create_async(settings))
+
+    async def get_imaging_settings(_token):
+        return None
+
+    async def get_options(_token):
+        return None
+
+    async def get_status(_token):
+        raise status_error
+
+    client.get_imaging_settings = get_imaging_settings  # type: ignore
+    client.get_options = get_options  # type: ignore
+    client.get_status = get_status  # type: ignore
+    return client
+
+
+def test_refused_status_is_left_empty():
+    error = OnvifClientServiceError("ONVIF unexpected Fault")
+    error.__cause__ = Fault("Optional Action Not Implemented")
+    client = create_client(error)
+    imaging = asyncio.run(client.get_video_source_imaging("VideoSource_1"))
+    assert imaging.video_source_token == "VideoSource_1"
+    assert imaging.status is None
+
+
+def test_status_timeout_is_raised():
+    client = create_client(OnvifClientServiceError("ONVIF timeout error"))
+    with pytest.raises(OnvifClientServiceError, match="timeout"):
+        asyncio.run(client.get_video_source_imaging("VideoSource_1"))
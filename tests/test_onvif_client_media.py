@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+import pytest
+from lxml import etree
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_media import OnvifClientMedia
+
+SOAP_ENV = "http://www.w3.org/2003/05/soap-envelope"
+MULTICAST = """<tt:Multicast>
+  <tt:Address><tt:Type>IPv4</tt:Type><tt:IPv4Address>0.0.0.0</tt:IPv4Address></tt:Address>
+  <tt:Port>0</tt:Port><tt:TTL>1</tt:TTL><tt:AutoStart>false</tt:AutoStart>
+</tt:Multicast>"""
+
+
+def video_source(tag: str) -> str:
+    return f"""<{tag} token="VideoSourceToken">
+  <tt:Name>VideoSourceConfig</tt:Name><tt:UseCount>2</tt:UseCount>
+  <tt:SourceToken>VideoSource_1</tt:SourceToken>
+  <tt:Bounds x="0" y="0" width="1920" height="1080"/>
+</{tag}>"""
+
+
+def video_encoder(tag: str) -> str:
+    return f"""<{tag} token="VideoEncoderToken_1">
+  <tt:Name>VideoEncoder_1</tt:Name><tt:UseCount>1</tt:UseCount><tt:Encoding>H264</tt:Encoding>
+  <tt:Resolution><tt:Width>1920</tt:Width><tt:Height>1080</tt:Height></tt:Resolution>
+  <tt:Quality>5</tt:Quality>
+  <tt:RateControl>
+    <tt:FrameRateLimit>25</tt:FrameRateLimit><tt:EncodingInterval>1</tt:EncodingInterval>
+    <tt:BitrateLimit>4096</tt:BitrateLimit>
+  </tt:RateControl>
+  <tt:H264><tt:GovLength>50</tt:GovLength><tt:H264Profile>Main</tt:H264Profile></tt:H264>
+  {MULTICAST}
+  <tt:SessionTimeout>PT60S</tt:SessionTimeout>
+</{tag}>"""
+
+
+def metadata(tag: str) -> str:
+    return f"""<{tag} token="MetadataToken">
+  <tt:Name>Metadata_1</tt:Name><tt:UseCount>1</tt:UseCount><tt:Analytics>true</tt:Analytics>
+  {MULTICAST}
+  <tt:SessionTimeout>PT60S</tt:SessionTimeout>
+</{tag}>"""
+
+
+def profile(tag: str) -> str:
+    return f"""<{tag} token="Profile_1" fixed="true">
+  <tt:Name>mainStream</tt:Name>
+  {video_source("tt:VideoSourceConfiguration")}
+  {video_encoder("tt:VideoEncoderConfiguration")}
+  {metadata("tt:MetadataConfiguration")}
+</{tag}>"""
+
+
+REPLIES = {
+    "GetProfiles": f"<trt:GetProfilesResponse>{profile('trt:Profiles')}</trt:GetProfilesResponse>",
+    "GetProfile": f"<trt:GetProfileResponse>{profile('trt:Profile')}</trt:GetProfileResponse>",
+    "GetVideoSourceConfiguration": "<trt:GetVideoSourceConfigurationResponse>"
+    f"{video_source('trt:Configuration')}</trt:GetVideoSourceConfigurationResponse>",
+    "GetVideoEncoderConfiguration": "<trt:GetVideoEncoderConfigurationResponse>"
+    f"{video_encoder('trt:Configuration')}</trt:GetVideoEncoderConfigurationResponse>",
+    "GetMetadataConfiguration": "<trt:GetMetadataConfigurationResponse>"
+    f"{metadata('trt:Configuration')}</trt:GetMetadataConfigurationResponse>",
+}
+
+
+def envelope(body: str) -> bytes:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:trt="http://www.onvif.org/ver10/media/wsdl"
+    xmlns:tt="http://www.onvif.org/ver10/schema">
+  <env:Body>{body}</env:Body>
+</env:Envelope>""".encode()
+
+
+def create_client(host: str, operations: list[str]) -> OnvifClientMedia:
+    source = Source.parse_obj({"host": host, "port": 80})
+    common = ONVIFSettings(events_enabled=False)
+    client = OnvifClientMedia(OnvifClientSettings(source=source, common=common))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = etree.fromstring(request.content).find(f"{{{SOAP_ENV}}}Body")
+        operation = etree.QName(body[0]).localname
+        operations.append(operation)
+        return httpx.Response(200, content=envelope(REPLIES[operation]))
+
+    client.client.transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_profiles_convert_the_requested_fields_only():
+    operations: list[str] = []
+    client = create_client("192.0.2.41", operations)
+
+    async def main():
+        projected = await client.get_profiles(["video_encoder_configuration"])
+        await client.get_profiles(["video_encoder_configuration"])
+        full = await client.get_profiles()
+        return projected.profiles[0], full.profiles[0]
+
+    projected, full = asyncio.run(main())
+    assert (projected.token, projected.name, projected.fixed) == ("Profile_1", "mainStream", True)
+    assert projected.video_encoder_configuration.h264.gov_length == 50
+    assert projected.video_source_configuration is None
+    assert projected.metadata_configuration is None
+    assert full.video_source_configuration.source_token == "VideoSource_1"
+    assert full.metadata_configuration.token == "MetadataToken"
+    # A projection and the full profiles are cached separately
+    assert operations == ["GetProfiles", "GetProfiles"]
+
+
+def test_unknown_profile_field_is_rejected():
+    client = create_client("192.0.2.42", [])
+    with pytest.raises(ValueError, match="Unknown profile fields: encoder"):
+        asyncio.run(client.get_profiles(["encoder", "video_source_configuration"]))
+
+
+def test_single_configuration_queries():
+    operations: list[str] = []
+    client = create_client("192.0.2.43", operations)
+
+    async def main():
+        return (
+            await client.get_profile("Profile_1"),
+            await client.get_video_source_configuration("VideoSourceToken"),
+            await client.get_video_encoder_configuration("VideoEncoderToken_1"),
+            await client.get_metadata_configuration("MetadataToken"),
+            await client.get_video_encoder_configuration("VideoEncoderToken_1"),
+        )
+
+    media_profile, source, encoder, metadata_configuration, cached = asyncio.run(main())
+    assert media_profile.video_encoder_configuration.token == "VideoEncoderToken_1"
+    assert (source.token, source.bounds.width) == ("VideoSourceToken", 1920)
+    assert (encoder.encoding.value, encoder.resolution.height) == ("H264", 1080)
+    assert metadata_configuration.analytics is True
+    assert cached == encoder
+    assert operations == [
+        "GetProfile",
+        "GetVideoSourceConfiguration",
+        "GetVideoEncoderConfiguration",
+        "GetMetadataConfiguration",
+    ]
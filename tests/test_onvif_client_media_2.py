@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_media_2 import OnvifClientMedia2
+
+# GetProfiles reply of a camera asked for the VideoSource and VideoEncoder types only
+PROFILES_REPLY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:tr2="http://www.onvif.org/ver20/media/wsdl"
+    xmlns:tt="http://www.onvif.org/ver10/schema">
+  <env:Body>
+    <tr2:GetProfilesResponse>
+      <tr2:Profiles token="Profile_1" fixed="true">
+        <tr2:Name>mainStream</tr2:Name>
+        <tr2:Configurations>
+          <tr2:VideoSource token="VideoSourceToken">
+            <tt:Name>VideoSourceConfig</tt:Name>
+            <tt:UseCount>2</tt:UseCount>
+            <tt:SourceToken>VideoSource_1</tt:SourceToken>
+            <tt:Bounds x="0" y="0" width="1920" height="1080"></tt:Bounds>
+          </tr2:VideoSource>
+          <tr2:VideoEncoder token="VideoEncoderToken_1" GovLength="50" Profile="Main">
+            <tt:Name>VideoEncoder_1</tt:Name>
+            <tt:UseCount>1</tt:UseCount>
+            <tt:Encoding>H264</tt:Encoding>
+            <tt:Resolution>
+              <tt:Width>1920</tt:Width>
+              <tt:Height>1080</tt:Height>
+            </tt:Resolution>
+            <tt:RateControl ConstantBitRate="false">
+              <tt:FrameRateLimit>25</tt:FrameRateLimit>
+              <tt:BitrateLimit>4096</tt:BitrateLimit>
+            </tt:RateControl>
+            <tt:Quality>5</tt:Quality>
+          </tr2:VideoEncoder>
+        </tr2:Configurations>
+      </tr2:Profiles>
+    </tr2:GetProfilesResponse>
+  </env:Body>
+</env:Envelope>"""
+
+
+def create_client(host: str, requests: list[bytes]) -> OnvifClientMedia2:
+    source = Source.parse_obj({"host": host, "port": 80})
+    client = OnvifClientMedia2(OnvifClientSettings(source=source, common=ONVIFSettings()))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.content)
+        return httpx.Response(200, content=PROFILES_REPLY)
+
+    client.client.transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_profiles_with_a_subset_of_configurations():
+    requests: list[bytes] = []
+    client = create_client("192.0.2.31", requests)
+    profiles = asyncio.run(client.get_profiles(["VideoSource", "VideoEncoder"])).profiles
+
+    assert len(profiles) == 1
+    profile = profiles[0]
+    assert (profile.token, profile.name, profile.fixed) == ("Profile_1", "mainStream", True)
+    assert profile.video_source.source_token == "VideoSource_1"
+    assert profile.video_source.bounds.width == 1920
+    encoder = profile.video_encoder
+    assert (encoder.token, encoder.encoding, encoder.gov_length) == (
+        "VideoEncoderToken_1",
+        "H264",
+        50,
+    )
+    assert encoder.resolution.height == 1080
+    assert encoder.rate_control.frame_rate_limit == 25
+    # Types which were not asked for stay empty
+    assert profile.audio_source is None and profile.metadata is None and profile.ptz is None
+    assert b"<ns0:Type>VideoEncoder</ns0:Type>" in requests[0]
+
+
+def test_profiles_are_cached_per_types_and_token():
+    requests: list[bytes] = []
+    client = create_client("192.0.2.32", requests)
+
+    async def main():
+        await client.get_profiles(["VideoSource", "VideoEncoder"])
+        # The same types in another order are the same query
+        await client.get_profiles(["VideoEncoder", "VideoSource", "VideoEncoder"])
+        await client.get_profiles(["VideoEncoder"])
+        await client.get_profiles(["VideoEncoder"], "Profile_1")
+        await client.get_profiles(["VideoEncoder"], "Profile_1")
+
+    asyncio.run(main())
+    assert len(requests) == 3
+    assert b"Profile_1" not in requests[1]
+    assert b"<ns0:Token>Profile_1</ns0:Token>" in requests[2]
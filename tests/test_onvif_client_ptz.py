@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_ptz import OnvifClientPTZ, PTZCommandQueues
+
+
+class FakePTZClient:
+    def __init__(self, settings: OnvifClientSettings) -> None:
+        self.source = settings.source
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fixture_create_async(monkeypatch) -> None:
+    async def create_async(settings: OnvifClientSettings) -> FakePTZClient:
+        return FakePTZClient(settings)
+
+    monkeypatch.setattr(OnvifClientPTZ, "create_async", create_async)
+
+
+def create_settings(user: str | None, password: str | None) -> OnvifClientSettings:
+    source = Source(host="10.0.0.1", port=80, user=user, password=password)
+    return OnvifClientSettings(source=source, common=ONVIFSettings())
+
+
+async def get_clients(*logins: tuple[str | None, str | None]) -> list:
+    queues = PTZCommandQueues()
+    clients = [(await queues.get(create_settings(*login))).client for login in logins]
+    await queues.stop()
+    return clients
+
+
+def test_same_credentials_share_the_warm_client():
+    first, second = asyncio.run(get_clients(("admin", "secret"), ("admin", "secret")))
+    assert first is second
+
+
+@pytest.mark.parametrize("login", [("admin", "wrong"), ("admin", None), (None, None)])
+def test_other_credentials_get_their_own_client(login):
+    owner, other = asyncio.run(get_clients(("admin", "secret"), login))
+    assert owner is not other
+    assert (other.source.user, other.source.password) == login
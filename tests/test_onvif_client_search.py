@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientServiceError, OnvifClientSettings
+from src.onvif.onvif_client_search import OnvifClientSearch
+
+
+class FakeSearchClient(OnvifClientSearch):
+    """Search client without a zeep service, pages come from the test"""
+
+    def __init__(self, common: ONVIFSettings) -> None:
+        source = Source(host="10.0.0.1", port=80)
+        super().__init__(OnvifClientSettings(source=source, common=common, check_health=False))
+        self.ended: list[str] = []
+
+    def _get_service(self):
+        return None
+
+    async def end_search(self, search_token: str) -> None:
+        self.ended.append(search_token)
+
+
+def create_get_page(states: list[str]):
+    requested = []
+
+    async def get_page(search_token: str) -> dict:
+        requested.append(search_token)
+        return {"SearchState": states[min(len(requested), len(states)) - 1]}
+
+    return get_page, requested
+
+
+async def read_pages(client: FakeSearchClient, get_page) -> list[dict]:
+    return [page async for page in client._iterate_pages("search", get_page)]
+
+
+def test_pages_are_read_until_the_search_completes():
+    client = FakeSearchClient(ONVIFSettings())
+    get_page, requested = create_get_page(["Searching", "Searching", "Completed"])
+    pages = asyncio.run(read_pages(client, get_page))
+    assert [page["SearchState"] for page in pages] == ["Searching", "Searching", "Completed"]
+    assert len(requested) == 3
+    assert client.ended == ["search"]
+
+
+def test_search_which_never_completes_fails_after_max_pages():
+    client = FakeSearchClient(ONVIFSettings(search_max_pages=5))
+    get_page, requested = create_get_page(["Searching"])
+    with pytest.raises(OnvifClientServiceError):
+        asyncio.run(read_pages(client, get_page))
+    assert len(requested) == 5
+    assert client.ended == ["search"]
+
+
+def test_cancellation_during_end_search_is_not_swallowed():
+    class SlowEndSearchClient(FakeSearchClient):
+        async def end_search(self, search_token: str) -> None:
+            await asyncio.sleep(0.05)
+            await super().end_search(search_token)
+
+    client = SlowEndSearchClient(ONVIFSettings())
+    get_page, _ = create_get_page(["Completed"])
+
+    async def run() -> None:
+        task = asyncio.create_task(read_pages(client, get_page))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The shielded EndSearch is still sent
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert client.ended == ["search"]
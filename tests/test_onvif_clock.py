@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+from lxml import etree
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif import onvif_client_device
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_clock import SkewedUsernameToken, clock_offsets
+from tests.test_onvif_transport import DEVICE_INFORMATION_REPLY
+
+AUTH_FAULT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:ter="http://www.onvif.org/ver10/error">
+  <env:Body>
+    <env:Fault>
+      <env:Code>
+        <env:Value>env:Sender</env:Value>
+        <env:Subcode><env:Value>ter:NotAuthorized</env:Value></env:Subcode>
+      </env:Code>
+      <env:Reason><env:Text xml:lang="en">Sender not Authorized</env:Text></env:Reason>
+    </env:Fault>
+  </env:Body>
+</env:Envelope>"""
+
+WSU = "{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd}"
+
+
+def created_of(envelope) -> datetime:
+    created = envelope.find(f".//{WSU}Created").text
+    return datetime.strptime(created.rstrip("Z").split("+")[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def test_token_is_created_in_the_camera_time():
+    clock_offsets.set("skewed:80", 3600.0, 60)
+    token = SkewedUsernameToken("skewed:80", "admin", "secret")
+    envelope = etree.fromstring(
+        b'<soap-env:Envelope xmlns:soap-env="http://www.w3.org/2003/05/soap-envelope">'
+        b"<soap-env:Body/></soap-env:Envelope>"
+    )
+    envelope, _ = token.apply(envelope, {})
+    skew = (created_of(envelope) - datetime.utcnow()).total_seconds()
+    assert 3590 < skew < 3610
+    # The next request gets a fresh timestamp
+    assert token.created is None
+
+
+@pytest.fixture
+def measurements(monkeypatch):
+    calls: list[str] = []
+
+    async def measure(settings):
+        calls.append(settings.source.get_camera_key())
+        await asyncio.sleep(0.01)
+        return 120.0
+
+    monkeypatch.setattr(onvif_client_device, "measure_clock_offset", measure)
+    return calls
+
+
+def create_client(host: str, replies: list[bytes]) -> OnvifClientDevice:
+    source = Source.parse_obj({"host": host, "port": 80, "user": "admin", "password": "secret"})
+    client = OnvifClientDevice(OnvifClientSettings(source=source, common=ONVIFSettings()))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        reply = replies.pop(0) if len(replies) > 1 else replies[0]
+        return httpx.Response(500 if reply is AUTH_FAULT else 200, content=reply)
+
+    client.client.transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_offset_is_measured_once_on_first_contact(measurements):
+    client = create_client("192.0.2.21", [DEVICE_INFORMATION_REPLY])
+
+    async def main():
+        await asyncio.gather(*(client.get_device_information() for _ in range(5)))
+        await client.get_device_information()
+
+    asyncio.run(main())
+    assert measurements == ["192.0.2.21:80"]
+    assert clock_offsets.get("192.0.2.21:80") == 120.0
+    assert not clock_offsets.needs_refresh("192.0.2.21:80")
+
+
+def test_offset_is_refreshed_before_it_expires(measurements):
+    clock_offsets.set("192.0.2.22:80", 0.0, 0.0)
+    assert clock_offsets.needs_refresh("192.0.2.22:80")
+    client = create_client("192.0.2.22", [DEVICE_INFORMATION_REPLY])
+    asyncio.run(client.get_device_information())
+    assert measurements == ["192.0.2.22:80"]
+
+
+def test_auth_fault_measures_the_clock_again_and_retries(measurements):
+    client = create_client("192.0.2.23", [AUTH_FAULT, DEVICE_INFORMATION_REPLY])
+    clock_offsets.set("192.0.2.23:80", 0.0, 3600)
+    information = asyncio.run(client.get_device_information())
+    assert information.model == "Model-1"
+    assert measurements == ["192.0.2.23:80"]
+    assert clock_offsets.get("192.0.2.23:80") == 120.0
+
+
+def test_failed_measurement_is_not_repeated_before_every_request(monkeypatch):
+    calls = []
+
+    async def measure(settings):
+        calls.append(settings)
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(onvif_client_device, "measure_clock_offset", measure)
+    client = create_client("192.0.2.24", [DEVICE_INFORMATION_REPLY])
+
+    async def main():
+        await client.get_device_information()
+        await client.get_device_information()
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert clock_offsets.get("192.0.2.24:80") == 0.0
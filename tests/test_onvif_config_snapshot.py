@@ -0,0 +1,81 @@
+import asyncio
+from dataclasses import dataclass
+
+from fastapi.testclient import TestClient
+
+from src import api
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif import onvif_config_snapshot
+from src.onvif.onvif_config_snapshot import (
+    SECTION_ADDED,
+    SECTION_CHANGED,
+    ConfigSection,
+    ConfigSnapshots,
+    get_fleet_config_changes,
+)
+
+CAMERA = "10.0.0.1:80"
+
+
+@dataclass
+class Encoder:
+    quality: float
+
+
+def create_sections(quality: float) -> dict[str, ConfigSection]:
+    name = "video_encoder/encoder"
+    return {name: ConfigSection.create(name, Encoder(quality))}
+
+
+def test_changes_are_tracked_per_consumer():
+    snapshots = ConfigSnapshots()
+    snapshots.commit("nvr", {CAMERA: create_sections(5)})
+    changes = snapshots.diff("nvr", CAMERA, create_sections(7))
+    assert not changes.full
+    assert [change.change for change in changes.changes] == [SECTION_CHANGED]
+    # A consumer without a snapshot gets everything
+    changes = snapshots.diff("inventory", CAMERA, create_sections(7))
+    assert changes.full
+    assert [change.change for change in changes.changes] == [SECTION_ADDED]
+
+
+def test_undelivered_changes_are_reported_again():
+    snapshots = ConfigSnapshots()
+    snapshots.commit("nvr", {CAMERA: create_sections(5)})
+    first = snapshots.diff("nvr", CAMERA, create_sections(7))
+    second = snapshots.diff("nvr", CAMERA, create_sections(7))
+    assert first == second
+
+
+def test_fleet_changes_do_not_commit_failed_cameras(monkeypatch):
+    async def get_config_changes(settings, consumer, full):
+        if settings.source.host == "10.0.0.2":
+            raise TimeoutError("unreachable")
+        sections = create_sections(5)
+        camera_key = settings.source.get_camera_key()
+        return ConfigSnapshots().diff(consumer, camera_key, sections, full), sections
+
+    monkeypatch.setattr(onvif_config_snapshot, "get_config_changes", get_config_changes)
+    sources = [Source(host="10.0.0.1", port=80), Source(host="10.0.0.2", port=80)]
+    changes, snapshots = asyncio.run(get_fleet_config_changes(sources, ONVIFSettings(), "nvr"))
+    assert [item.error for item in changes] == [None, "unreachable"]
+    assert list(snapshots) == [CAMERA]
+
+
+def test_api_commits_the_snapshot_after_the_response(monkeypatch):
+    snapshots = ConfigSnapshots()
+    monkeypatch.setattr(api, "config_snapshots", snapshots)
+
+    async def get_fleet_config_changes(sources, common, consumer, full):
+        return [snapshots.diff(consumer, CAMERA, create_sections(5), full)], {
+            CAMERA: create_sections(5)
+        }
+
+    monkeypatch.setattr(api, "get_fleet_config_changes", get_fleet_config_changes)
+    client = TestClient(api.app)
+    body = {"sources": [{"host": "10.0.0.1", "port": 80}], "consumer": "nvr"}
+    first = client.post("/api/media/get_config_changes", json=body).json()
+    second = client.post("/api/media/get_config_changes", json=body).json()
+    assert first[0]["full"] and not second[0]["full"]
+    assert second[0]["changes"] == []
@@ -0,0 +1,42 @@
+import asyncio
+
+import httpx
+
+from src.onvif.onvif_deadline import (
+    cap_timeout,
+    create_background_task,
+    deadline_scope,
+    get_remaining,
+    request_deadline,
+)
+
+
+def test_background_task_does_not_inherit_the_deadline():
+    async def main():
+        async def deadline():
+            return request_deadline.get()
+
+        with deadline_scope(5):
+            inherited = await asyncio.create_task(deadline())
+            background = await create_background_task(deadline())
+        return inherited, background
+
+    inherited, background = asyncio.run(main())
+    assert inherited is not None
+    assert background is None
+
+
+def test_timeouts_end_at_the_deadline():
+    async def main():
+        with deadline_scope(2):
+            remaining = get_remaining()
+            return cap_timeout(httpx.Timeout(10, connect=1)), remaining
+
+    timeout, remaining = asyncio.run(main())
+    assert timeout.connect == 1
+    assert 0 < timeout.read <= remaining <= 2
+
+
+def test_timeouts_are_unchanged_without_a_deadline():
+    timeout = httpx.Timeout(10)
+    assert cap_timeout(timeout) is timeout
@@ -0,0 +1,83 @@
+import re
+import asyncio
+
+from src.onvif.onvif_discovery import probe
+from src.onvif.onvif_registry import CameraRegistry
+
+PROBE_MATCHES = """<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope"
+ xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+ xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery">
+<s:Header><a:RelatesTo>{relates_to}</a:RelatesTo></s:Header>
+<s:Body><d:ProbeMatches><d:ProbeMatch>
+<a:EndpointReference><a:Address>{endpoint_reference}</a:Address></a:EndpointReference>
+<d:Types>dn:NetworkVideoTransmitter</d:Types>
+<d:Scopes>onvif://www.onvif.org/name/Lobby onvif://www.onvif.org/hardware/M3045</d:Scopes>
+<d:XAddrs>{xaddrs}</d:XAddrs>
+<d:MetadataVersion>1</d:MetadataVersion>
+</d:ProbeMatch></d:ProbeMatches></s:Body>
+</s:Envelope>"""
+
+DEVICES = {
+    "urn:uuid:http-camera": "http://127.0.0.1:8080/onvif/device_service",
+    "urn:uuid:https-camera": "https://127.0.0.1/onvif/device_service",
+}
+
+
+class Responder(asyncio.DatagramProtocol):
+    """Local stand-in for devices answering a WS-Discovery probe"""
+
+    def __init__(self) -> None:
+        self.transport: asyncio.DatagramTransport | None = None
+        self.probes = 0
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self.probes += 1
+        message_id = re.search(rb"<a:MessageID>(.*?)</a:MessageID>", data).group(1).decode()
+        # Another client's probe and garbage are ignored by the prober
+        self.reply(addr, "urn:uuid:other-probe", "urn:uuid:stranger", "http://127.0.0.2/")
+        self.transport.sendto(b"not xml", addr)
+        for endpoint_reference, xaddrs in DEVICES.items():
+            self.reply(addr, message_id, endpoint_reference, xaddrs)
+
+    def reply(self, addr: tuple, relates_to: str, endpoint_reference: str, xaddrs: str) -> None:
+        message = PROBE_MATCHES.format(
+            relates_to=relates_to, endpoint_reference=endpoint_reference, xaddrs=xaddrs
+        )
+        self.transport.sendto(message.encode(), addr)
+
+
+async def discover(**kwargs):
+    loop = asyncio.get_running_loop()
+    transport, responder = await loop.create_datagram_endpoint(
+        Responder, local_addr=("127.0.0.1", 0)
+    )
+    try:
+        matches = await probe(target=transport.get_extra_info("sockname"), **kwargs)
+    finally:
+        transport.close()
+    return matches, responder
+
+
+def test_probe_collects_matches_of_every_device_once():
+    matches, responder = asyncio.run(discover(timeout=0.5, repeats=2))
+    assert responder.probes == 2
+    assert sorted(match.endpoint_reference for match in matches) == sorted(DEVICES)
+    assert all(match.address == "127.0.0.1" for match in matches)
+
+
+def test_probe_stops_at_max_matches():
+    matches, _ = asyncio.run(discover(timeout=5, repeats=1, max_matches=2))
+    assert len(matches) == 2
+
+
+def test_registry_keeps_the_scheme_of_the_xaddr():
+    matches, _ = asyncio.run(discover(timeout=0.5, repeats=1))
+    registry = CameraRegistry()
+    registry.update(matches)
+    assert registry.get_base_url("urn:uuid:http-camera") == "http://127.0.0.1:8080"
+    assert registry.get_base_url("urn:uuid:https-camera") == "https://127.0.0.1:443"
+    assert registry.get("urn:uuid:http-camera").name == "Lobby"
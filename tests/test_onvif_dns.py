@@ -0,0 +1,48 @@
+import asyncio
+
+import httpcore
+import pytest
+
+from src.onvif.onvif_dns import ResolvingNetworkBackend, dns_cache
+
+
+class SlowBackend:
+    """Backend whose every address fails after `delay` seconds"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.timeouts: list[float] = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.timeouts.append(timeout)
+        await asyncio.sleep(self.delay)
+        raise httpcore.ConnectError(f"{host} refused")
+
+
+def test_addresses_share_the_connect_timeout(monkeypatch):
+    async def resolve(*_):
+        return ["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"]
+
+    monkeypatch.setattr(dns_cache, "resolve", resolve)
+    backend = ResolvingNetworkBackend(ttl=60, negative_ttl=5)
+    slow = backend._backend = SlowBackend(0.1)
+
+    with pytest.raises(httpcore.ConnectTimeout):
+        asyncio.run(backend.connect_tcp("camera.local", 80, timeout=0.25))
+    assert len(slow.timeouts) == 3
+    assert slow.timeouts[0] <= 0.25
+    assert slow.timeouts[1] < slow.timeouts[0]
+    assert slow.timeouts[2] < 0.1
+
+
+def test_without_timeout_every_address_is_tried(monkeypatch):
+    async def resolve(*_):
+        return ["192.0.2.1", "192.0.2.2"]
+
+    monkeypatch.setattr(dns_cache, "resolve", resolve)
+    backend = ResolvingNetworkBackend(ttl=60, negative_ttl=5)
+    slow = backend._backend = SlowBackend(0)
+
+    with pytest.raises(httpcore.ConnectError):
+        asyncio.run(backend.connect_tcp("camera.local", 80))
+    assert slow.timeouts == [None, None]
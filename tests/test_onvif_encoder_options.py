@@ -0,0 +1,59 @@
+from dataclasses import replace
+
+import pytest
+
+from src.onvif.onvif_encoder_options import (
+    MEDIA2_ENCODER_LAYOUT,
+    MEDIA_ENCODER_LAYOUT,
+    VideoEncoderSettings,
+    apply_video_encoder_settings,
+    get_video_encoder_settings,
+)
+
+
+def create_media_configuration() -> dict:
+    return {
+        "Encoding": "H264",
+        "Resolution": {"Width": 1920, "Height": 1080},
+        "Quality": 5.0,
+        "RateControl": {"FrameRateLimit": 25, "BitrateLimit": 4096},
+        "H264": {"GovLength": 50, "H264Profile": "Main"},
+    }
+
+
+def create_media2_configuration() -> dict:
+    return {
+        "Encoding": "H264",
+        "Resolution": {"Width": 1920, "Height": 1080},
+        "Quality": 5.0,
+        "RateControl": {"FrameRateLimit": 25.0, "BitrateLimit": 4096},
+        "GovLength": 50,
+        "Profile": "Main",
+    }
+
+
+@pytest.mark.parametrize(
+    "obj, layout",
+    [
+        (create_media_configuration(), MEDIA_ENCODER_LAYOUT),
+        (create_media2_configuration(), MEDIA2_ENCODER_LAYOUT),
+    ],
+)
+def test_encoder_settings_round_trip(obj, layout):
+    settings = get_video_encoder_settings(obj, layout)
+    assert settings == VideoEncoderSettings("H264", 1920, 1080, 5.0, 25, 4096, 50, "Main")
+    change = VideoEncoderSettings(frame_rate_limit=12.5, gov_length=25, profile="High")
+    changed = apply_video_encoder_settings(obj, settings.merge(change), layout)
+    expected = replace(settings, frame_rate_limit=layout.frame_rate(12.5), gov_length=25)
+    assert get_video_encoder_settings(changed, layout) == replace(expected, profile="High")
+    # The camera's object is not modified
+    assert get_video_encoder_settings(obj, layout) == settings
+
+
+def test_media_encoder_without_h264_keeps_its_fields():
+    obj = create_media_configuration()
+    obj["Encoding"], obj["H264"] = "JPEG", None
+    settings = get_video_encoder_settings(obj, MEDIA_ENCODER_LAYOUT)
+    assert settings.gov_length is None and settings.profile is None
+    changed = apply_video_encoder_settings(obj, settings, MEDIA_ENCODER_LAYOUT)
+    assert changed["H264"] is None
@@ -0,0 +1,46 @@
+from zeep.wsdl.utils import etree_to_string
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_envelopes import _envelopes, render_envelope
+
+SECURITY = b"<wsse:Security"
+
+
+def create_client(**credentials) -> OnvifClientDevice:
+    source = Source.parse_obj({"host": "127.0.0.1", "port": 80, **credentials})
+    return OnvifClientDevice(OnvifClientSettings(source=source, common=ONVIFSettings()))
+
+
+def test_prerendered_envelope_matches_zeep():
+    client = create_client()
+    service = client.service
+    for operation in ("GetDeviceInformation", "GetSystemDateAndTime"):
+        expected, expected_headers = service._binding._create(
+            operation, (), {}, client=client.client, options=service._binding_options
+        )
+        for _ in range(2):
+            envelope, headers = render_envelope(
+                client.client, service, client._get_wsdl_path(), operation
+            )
+            assert etree_to_string(envelope) == etree_to_string(expected)
+            assert headers == expected_headers
+
+
+def test_security_header_is_applied_to_a_copy():
+    client = create_client(user="admin", password="secret")
+    wsdl_path = client._get_wsdl_path()
+    first, _ = render_envelope(client.client, client.service, wsdl_path, "GetDeviceInformation")
+    second, _ = render_envelope(client.client, client.service, wsdl_path, "GetDeviceInformation")
+
+    assert first is not second
+    assert etree_to_string(first).count(SECURITY) == 1
+    assert etree_to_string(second).count(SECURITY) == 1
+    templates = [
+        template
+        for (path, _, operation), (template, _) in _envelopes.items()
+        if path == wsdl_path and operation == "GetDeviceInformation"
+    ]
+    assert templates and all(SECURITY not in etree_to_string(t) for t in templates)
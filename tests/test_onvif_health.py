@@ -0,0 +1,47 @@
+import pytest
+
+from src.onvif import onvif_health
+from src.onvif.onvif_health import CameraStatus, CameraUnavailableError, HealthRegistry
+
+CAMERA = "10.0.0.1:80"
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(onvif_health.time, "time", lambda: now[0])
+    return now
+
+
+def create_down_registry() -> HealthRegistry:
+    registry = HealthRegistry()
+    registry.report_failure(CAMERA, "timeout", down_after=2)
+    registry.report_failure(CAMERA, "timeout", down_after=2)
+    return registry
+
+
+def test_down_camera_is_refused_until_the_state_is_stale(clock):
+    registry = create_down_registry()
+    with pytest.raises(CameraUnavailableError):
+        registry.check_available(CAMERA, probe_after=30)
+    clock[0] += 30
+    registry.check_available(CAMERA, probe_after=30)
+    # Only one probe per period, the next requests fail fast again
+    with pytest.raises(CameraUnavailableError):
+        registry.check_available(CAMERA, probe_after=30)
+
+
+def test_answered_request_marks_the_camera_up(clock):
+    registry = create_down_registry()
+    registry.report_available(CAMERA)
+    registry.check_available(CAMERA, probe_after=30)
+    health = registry.get(CAMERA)
+    assert health.status == CameraStatus.UP
+    assert health.consecutive_failures == 0
+
+
+def test_unknown_and_failing_cameras_are_available(clock):
+    registry = HealthRegistry()
+    registry.check_available(CAMERA, probe_after=30)
+    registry.report_failure(CAMERA, "timeout", down_after=2)
+    registry.check_available(CAMERA, probe_after=30)
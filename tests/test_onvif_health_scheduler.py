@@ -0,0 +1,67 @@
+import asyncio
+
+from src.model.source import Source
+from src.onvif import onvif_health_scheduler
+from src.onvif.onvif_discovery import ProbeMatch
+from src.onvif.onvif_health_scheduler import HealthScheduler
+from src.onvif.onvif_registry import CameraRegistry
+
+
+class ClosingClient:
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_registry_is_walked_only_after_it_changed(monkeypatch):
+    registry = CameraRegistry()
+    monkeypatch.setattr(onvif_health_scheduler, "camera_registry", registry)
+    walks = []
+
+    def walk():
+        walks.append(registry.version)
+        return CameraRegistry.list(registry)
+
+    monkeypatch.setattr(registry, "list", walk)
+    scheduler = HealthScheduler()
+
+    scheduler._sync_registry()
+    scheduler._sync_registry()
+    registry.update([ProbeMatch("urn:uuid:camera", xaddrs=["http://10.0.0.1/onvif"])])
+    scheduler._sync_registry()
+    scheduler._sync_registry()
+    assert walks == [0, 1]
+    assert list(scheduler._cameras) == ["urn:uuid:camera"]
+
+
+def test_unregister_cancels_the_check_and_closes_the_client():
+    async def run():
+        scheduler = HealthScheduler()
+        scheduler.register(Source.parse_obj({"host": "10.0.0.1", "port": 80}))
+        camera = scheduler._cameras["10.0.0.1:80"]
+        camera.client = client = ClosingClient()  # type: ignore
+        camera.check = check = asyncio.create_task(asyncio.sleep(60))
+        await scheduler.unregister("10.0.0.1:80")
+        return scheduler, client, check
+
+    scheduler, client, check = asyncio.run(run())
+    assert not scheduler._cameras
+    assert client.closed and check.cancelled()
+
+
+def test_stop_closes_the_clients():
+    async def run():
+        scheduler = HealthScheduler()
+        clients = []
+        for host in ["10.0.0.1", "10.0.0.2"]:
+            scheduler.register(Source.parse_obj({"host": host, "port": 80}))
+            clients.append(ClosingClient())
+            scheduler._cameras[f"{host}:80"].client = clients[-1]  # type: ignore
+        await scheduler.stop()
+        return scheduler, clients
+
+    scheduler, clients = asyncio.run(run())
+    assert all(client.closed for client in clients)
+    assert all(camera.client is None for camera in scheduler._cameras.values())
@@ -0,0 +1,68 @@
+import asyncio
+
+from src.config import ONVIFSettings
+from src.model.inventory import InventoryQuery
+from src.onvif import onvif_metadata_store
+from src.onvif.onvif_metadata_store import (
+    EncoderSummary,
+    MetadataStore,
+    ProfileSummary,
+    ServiceSummary,
+    create_metadata_store,
+)
+
+
+def test_store_is_disabled_by_default():
+    assert create_metadata_store(ONVIFSettings()) is None
+
+
+def test_updates_are_visible_to_later_queries(tmp_path):
+    store = create_metadata_store(
+        ONVIFSettings(data_dir=str(tmp_path), metadata_store_enabled=True)
+    )
+    assert isinstance(store, MetadataStore)
+    information = {"manufacturer": "Axis", "model": "M3045", "firmware_version": "7.10"}
+    store.update_device_information("10.0.0.1:80", information)
+    store.update_profiles("10.0.0.1:80", [ProfileSummary("profile", video_encoder_token="enc")])
+    store.update_encoders("10.0.0.1:80", [EncoderSummary("enc", encoding="H264")])
+    cameras = asyncio.run(store.query(InventoryQuery(manufacturer="Axis", firmware_at_least="7.9")))
+    store.close()
+    assert [camera.camera for camera in cameras] == ["10.0.0.1:80"]
+    assert cameras[0].profiles == [ProfileSummary("profile", video_encoder_token="enc")]
+    assert cameras[0].encoders == [EncoderSummary("enc", encoding="H264")]
+
+
+def test_details_of_many_cameras_are_queried_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(onvif_metadata_store, "MAX_QUERY_VARIABLES", 3)
+    store = MetadataStore(str(tmp_path / "metadata.sqlite"))
+    cameras = [f"10.0.0.{index}:80" for index in range(10)]
+    for camera in cameras:
+        store.update_device_information(camera, {"model": "M3045"})
+        store.update_encoders(camera, [EncoderSummary("enc", encoding="H264")])
+    result = asyncio.run(store.query(InventoryQuery(model="M3045", encoding="H264")))
+    store.close()
+    assert sorted(camera.camera for camera in result) == sorted(cameras)
+    assert all(len(camera.encoders) == 1 for camera in result)
+
+
+def test_encoders_of_a_camera_are_replaced(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.sqlite"))
+    store.update_device_information("10.0.0.1:80", {"model": "M3045"})
+    store.update_encoders("10.0.0.1:80", [EncoderSummary("old", encoding="H264")])
+    store.update_encoders("10.0.0.1:80", [EncoderSummary("new", encoding="H265")])
+    assert asyncio.run(store.query(InventoryQuery(encoding="H264"))) == []
+    cameras = asyncio.run(store.query(InventoryQuery(encoding="H265")))
+    store.close()
+    assert cameras[0].encoders == [EncoderSummary("new", encoding="H265")]
+
+
+def test_cameras_are_queried_by_service(tmp_path):
+    ptz = "http://www.onvif.org/ver20/ptz/wsdl"
+    store = MetadataStore(str(tmp_path / "metadata.sqlite"))
+    for camera in ["10.0.0.1:80", "10.0.0.2:80"]:
+        store.update_device_information(camera, {"model": "M3045"})
+    store.update_services("10.0.0.1:80", [ServiceSummary(ptz, "http://10.0.0.1/onvif/ptz", "2.60")])
+    cameras = asyncio.run(store.query(InventoryQuery(service=ptz)))
+    store.close()
+    assert [camera.camera for camera in cameras] == ["10.0.0.1:80"]
+    assert cameras[0].services == [ServiceSummary(ptz, "http://10.0.0.1/onvif/ptz", "2.60")]
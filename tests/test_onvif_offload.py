@@ -0,0 +1,80 @@
+import os
+import asyncio
+import threading
+
+import httpx
+import zeep
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif import onvif_offload
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_offload import OffloadPool
+
+DEVICE_INFORMATION_REPLY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:tds="http://www.onvif.org/ver10/device/wsdl">
+  <env:Body>
+    <tds:GetDeviceInformationResponse>
+      <tds:Manufacturer>Vendor</tds:Manufacturer>
+      <tds:Model>Model-1</tds:Model>
+      <tds:FirmwareVersion>1.0</tds:FirmwareVersion>
+      <tds:SerialNumber>0001</tds:SerialNumber>
+      <tds:HardwareId>42</tds:HardwareId>
+    </tds:GetDeviceInformationResponse>
+  </env:Body>
+</env:Envelope>"""
+
+
+def test_pool_is_sized_by_the_configured_settings():
+    pool = OffloadPool()
+    pool.configure(ONVIFSettings(parse_offload_workers=2))
+    try:
+        names = asyncio.run(pool.run(lambda: threading.current_thread().name))
+        assert names.startswith("onvif-parse")
+        assert pool.workers == 2
+        assert pool._get_executor()._max_workers == 2
+    finally:
+        pool.close()
+
+
+def test_unconfigured_pool_has_the_default_size():
+    pool = OffloadPool()
+    try:
+        assert asyncio.run(pool.run(sum, [1, 2])) == 3
+        assert pool._get_executor()._max_workers == ONVIFSettings().parse_offload_workers
+    finally:
+        pool.close()
+
+
+def create_device_client(offload_threshold: int) -> OnvifClientDevice:
+    source = Source.parse_obj({"host": "192.0.2.20", "port": 80})
+    common = ONVIFSettings(events_enabled=False, parse_offload_threshold=offload_threshold)
+    client = OnvifClientDevice(OnvifClientSettings(source=source, common=common))
+    transport = httpx.MockTransport(lambda _: httpx.Response(200, content=DEVICE_INFORMATION_REPLY))
+    client.client.transport.client = httpx.AsyncClient(transport=transport)
+    return client
+
+
+def test_zeep_is_the_pinned_version():
+    """OffloadingBinding relies on send_async returning the raw response, recheck on upgrade"""
+    path = os.path.join(os.path.dirname(__file__), "..", "setup", "requirements.txt")
+    with open(path, encoding="utf-8") as requirements:
+        assert f"zeep[async]=={zeep.__version__}\n" in requirements.read()
+
+
+def test_zeep_calls_are_parsed_by_the_binding(monkeypatch):
+    offloaded = []
+    run = onvif_offload.offload_pool.run
+
+    async def record(func, *args):
+        offloaded.append(func)
+        return await run(func, *args)
+
+    monkeypatch.setattr(onvif_offload.offload_pool, "run", record)
+    small = asyncio.run(create_device_client(1024 * 1024).service.GetDeviceInformation())
+    assert not offloaded
+    large = asyncio.run(create_device_client(0).service.GetDeviceInformation())
+    assert len(offloaded) == 1
+    assert small.Model == large.Model == "Model-1"
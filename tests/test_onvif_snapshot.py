@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_media import MediaUri
+from src.onvif.onvif_snapshot import SlowSubscriberError, SnapshotFetch, SnapshotProxy
+
+
+async def read(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+def test_late_subscriber_gets_the_chunks_received_so_far():
+    async def run() -> bytes:
+        fetch = SnapshotFetch(max_bytes=1024, max_chunks=2)
+        for chunk in (b"a", b"b", b"c"):
+            fetch.publish(chunk)
+        queue = fetch.subscribe()
+        fetch.publish(b"d")
+        fetch.finish()
+        return await read(fetch.iterate(queue))
+
+    assert asyncio.run(run()) == b"abcd"
+
+
+def test_slow_subscriber_is_cut_off():
+    async def run() -> None:
+        fetch = SnapshotFetch(max_bytes=1024, max_chunks=2)
+        slow = fetch.subscribe()
+        for chunk in (b"a", b"b", b"c"):
+            fetch.publish(chunk)
+        fetch.finish()
+        assert slow.qsize() == 1
+        await read(fetch.iterate(slow))
+
+    with pytest.raises(SlowSubscriberError):
+        asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "uri, ttl",
+    [
+        (MediaUri("rtsp://camera"), 300),
+        (MediaUri("rtsp://camera", timeout=60), 60),
+        (MediaUri("rtsp://camera", timeout=600), 300),
+        (MediaUri("rtsp://camera", invalid_after_connect=True), 0),
+    ],
+)
+def test_media_uri_cache_ttl(uri, ttl):
+    assert uri.get_cache_ttl(300) == ttl
+
+
+def test_snapshot_is_not_served_to_other_credentials(monkeypatch):
+    requests = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=b"jpeg", headers={"content-type": "image/jpeg"})
+
+    async def get_snapshot_uri(*_) -> MediaUri:
+        return MediaUri("http://10.0.0.1/snapshot.jpg")
+
+    monkeypatch.setattr(SnapshotProxy, "_get_snapshot_uri", staticmethod(get_snapshot_uri))
+
+    async def run() -> list[bytes]:
+        proxy = SnapshotProxy()
+        proxy._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        images = []
+        for user, password in (("admin", "secret"), ("admin", "secret"), ("admin", "wrong")):
+            source = Source(host="10.0.0.1", port=80, user=user, password=password)
+            settings = OnvifClientSettings(source=source, common=ONVIFSettings())
+            snapshot = await proxy.open(settings, "profile")
+            images.append(await read(snapshot.chunks))
+            # Let the download finish and fill the cache
+            await asyncio.sleep(0.01)
+        await proxy.close()
+        return images
+
+    assert asyncio.run(run()) == [b"jpeg"] * 3
+    assert len(requests) == 2
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+from src.config import ONVIFSettings
+from src.model.source import Source
+from src.onvif.onvif_client import OnvifClientSettings
+from src.onvif.onvif_client_device import OnvifClientDevice
+from src.onvif.onvif_transport import (
+    DIGEST_PARAM,
+    CachedDigestAuth,
+    DigestChallenge,
+    ResponseTooLargeError,
+    digest_challenges,
+)
+
+GET_INFO_HEADERS = {"SOAPAction": '"http://www.onvif.org/ver10/device/wsdl/GetDeviceInformation"'}
+
+
+def test_parse_digest_challenge():
+    challenge = DigestChallenge.parse(
+        'Basic realm="x", Digest realm="AXIS_\\"1\\"", nonce="abc", '
+        'qop="auth,auth-int", algorithm=SHA-256, stale=TRUE'
+    )
+    assert challenge == DigestChallenge(
+        realm='AXIS_"1"', nonce="abc", algorithm="SHA-256", qop="auth", stale=True
+    )
+
+
+def test_other_schemes_are_not_digest_challenges():
+    assert DigestChallenge.parse('Basic realm="camera"') is None
+
+
+@pytest.mark.parametrize(
+    "algorithm, expected",
+    [
+        ("MD5", hashlib.md5(b"data").hexdigest()),
+        ("SHA-256-sess", hashlib.sha256(b"data").hexdigest()),
+        ("SHA-512-256", hashlib.new("sha512_256", b"data").hexdigest()),
+        ("unknown", hashlib.md5(b"data").hexdigest()),
+    ],
+)
+def test_digest_hash_follows_the_algorithm(algorithm, expected):
+    assert DigestChallenge("realm", "nonce", algorithm)._hash("data") == expected
+
+
+class DigestCamera:
+    """Camera checking Digest authorization, its nonce can be rotated like on expiry"""
+
+    def __init__(self, qop: str | None) -> None:
+        self.qop = qop
+        self.nonce = "nonce-1"
+        self.authorizations: list[dict[str, str] | None] = []
+
+    def challenge(self, stale: bool = False) -> httpx.Response:
+        header = f'Digest realm="camera", nonce="{self.nonce}"'
+        if self.qop:
+            header += f', qop="{self.qop}"'
+        if stale:
+            header += ", stale=TRUE"
+        return httpx.Response(401, headers={"WWW-Authenticate": header})
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if not (header := request.headers.get("Authorization")):
+            self.authorizations.append(None)
+            return self.challenge()
+        params = {key: value.strip('"') for key, value in DIGEST_PARAM.findall(header)}
+        self.authorizations.append(params)
+        if params["nonce"] != self.nonce:
+            return self.challenge(stale=True)
+        ha1 = hashlib.md5(b"admin:camera:secret").hexdigest()
+        ha2 = hashlib.md5(f"{request.method}:{params['uri']}".encode()).hexdigest()
+        if self.qop:
+            data = f"{ha1}:{self.nonce}:{params['nc']}:{params['cnonce']}:auth:{ha2}"
+        else:
+            data = f"{ha1}:{self.nonce}:{ha2}"
+        if params["response"] != hashlib.md5(data.encode()).hexdigest():
+            return self.challenge()
+        return httpx.Response(200)
+
+
+def get_with_digest(camera: DigestCamera, camera_key: str) -> int:
+    auth = CachedDigestAuth(camera_key, "admin", "secret")
+    with httpx.Client(transport=httpx.MockTransport(camera.handler), auth=auth) as client:
+        return client.get("http://192.0.2.10/onvif/device_service").status_code
+
+
+@pytest.mark.parametrize("qop", ["auth", None])
+def test_cached_challenge_authorizes_the_next_requests(qop):
+    camera = DigestCamera(qop)
+    camera_key = f"digest-{qop}:80"
+    try:
+        assert get_with_digest(camera, camera_key) == 200
+        assert get_with_digest(camera, camera_key) == 200
+    finally:
+        digest_challenges.remove(camera_key)
+    first, retry, cached = camera.authorizations
+    assert first is None
+    assert retry and cached
+    if qop:
+        assert (retry["qop"], retry["nc"], cached["nc"]) == ("auth", "00000001", "00000002")
+        assert retry["cnonce"] != cached["cnonce"]
+    else:
+        assert "qop" not in retry and "nc" not in cached
+
+
+def test_stale_nonce_is_challenged_again_and_replaced():
+    camera = DigestCamera("auth")
+    camera_key = "digest-stale:80"
+    try:
+        assert get_with_digest(camera, camera_key) == 200
+        camera.nonce = "nonce-2"
+        assert get_with_digest(camera, camera_key) == 200
+        challenge = digest_challenges.get(camera_key)
+    finally:
+        digest_challenges.remove(camera_key)
+    stale, retry = camera.authorizations[2:]
+    assert stale and stale["nonce"] == "nonce-1"
+    assert retry and (retry["nonce"], retry["nc"]) == ("nonce-2", "00000001")
+    assert challenge and (challenge.nonce, challenge.stale) == ("nonce-2", True)
+
+
+DEVICE_INFORMATION_REPLY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:tds="http://www.onvif.org/ver10/device/wsdl">
+  <env:Body>
+    <tds:GetDeviceInformationResponse>
+      <tds:Manufacturer>Vendor</tds:Manufacturer>
+      <tds:Model>Model-1</tds:Model>
+      <tds:FirmwareVersion>1.0</tds:FirmwareVersion>
+      <tds:SerialNumber>0001</tds:SerialNumber>
+      <tds:HardwareId>42</tds:HardwareId>
+    </tds:GetDeviceInformationResponse>
+  </env:Body>
+</env:Envelope>"""
+
+
+def create_device_client(handler, max_response_size: int) -> OnvifClientDevice:
+    source = Source.parse_obj({"host": "192.0.2.10", "port": 8080})
+    common = ONVIFSettings(max_response_size=max_response_size, max_response_sizes={})
+    client = OnvifClientDevice(OnvifClientSettings(source=source, common=common))
+    client.client.transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_response_below_the_limit_is_parsed():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=DEVICE_INFORMATION_REPLY)
+
+    client = create_device_client(handler, max_response_size=len(DEVICE_INFORMATION_REPLY))
+    information = asyncio.run(client.get_device_information())
+    assert (information.model, information.hardware_id) == ("Model-1", "42")
+
+
+def test_response_over_the_limit_is_aborted_while_streaming():
+    pulled = []
+
+    async def body():
+        for number in range(100):
+            pulled.append(number)
+            yield b"x" * 1024
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body())
+
+    client = create_device_client(handler, max_response_size=4096)
+    with pytest.raises(ResponseTooLargeError, match="GetDeviceInformation .* exceeds 4096 bytes"):
+        asyncio.run(client.client.transport.post("http://192.0.2.10:8080", b"", GET_INFO_HEADERS))
+    assert len(pulled) < 10
+
+
+def test_declared_length_over_the_limit_is_rejected_before_the_body():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"x" * 8192)
+
+    client = create_device_client(handler, max_response_size=4096)
+    with pytest.raises(ResponseTooLargeError, match="8192 read"):
+        asyncio.run(client.client.transport.post("http://192.0.2.10:8080", b"", GET_INFO_HEADERS))